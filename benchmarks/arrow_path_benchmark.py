@@ -0,0 +1,82 @@
+"""
+compares the current duckdb -> pandas path (.df()) with the arrow path used by
+ConnectionManager.fetch_df/fetch_arrow on a synthetic donations_facility table
+
+NOTE: arrow buffers are allocated outside of python, the peak column only covers
+python & numpy allocations while the result column covers the fetched data
+
+usage: python -m benchmarks.arrow_path_benchmark [n_rows]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from src.pages.blood_donation_pipeline.src.connection_manager import ConnectionManager
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
+
+import duckdb
+import pyarrow as pa
+
+QUERY = "SELECT * FROM donations_facility"
+
+
+def create_donations_facility(conn: duckdb.DuckDBPyConnection, n_rows: int) -> None:
+    conn.execute(f"""
+    CREATE OR REPLACE TABLE donations_facility AS
+    SELECT
+        TIMESTAMP '2006-01-01' + to_days(CAST(i % 6500 AS INTEGER)) AS date,
+        'Hospital ' || CAST(i % 120 AS VARCHAR) AS hospital,
+        CAST(i % 97 AS INTEGER) AS daily,
+        CAST(i % 31 AS INTEGER) AS blood_a,
+        CAST(i % 29 AS INTEGER) AS blood_b,
+        CAST(i % 37 AS INTEGER) AS blood_o,
+        CAST(i % 7 AS INTEGER) AS blood_ab
+    FROM range({n_rows}) t(i);
+    """)
+
+
+def result_size(result) -> int:
+    if isinstance(result, pa.Table):
+        return result.nbytes
+    return int(result.memory_usage(deep=True).sum())
+
+
+def measure(name: str, func, repeat: int = 3) -> None:
+    """prints the best latency, python/numpy peak memory & result size of func"""
+    timings = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(
+        f"{name:<32} {min(timings) * 1000:>9.1f} ms"
+        f" {python_peak / 2**20:>9.1f} MiB peak python/numpy"
+        f" {result_size(result) / 2**20:>9.1f} MiB result"
+    )
+
+
+def main(n_rows: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        snapshots = SnapshotManager(folder, "benchmark")
+        path = snapshots.begin("1")
+        with duckdb.connect(path) as conn:
+            create_donations_facility(conn, n_rows)
+        snapshots.publish(path)
+        numpy_path = ConnectionManager(snapshots, use_arrow=False)
+        arrow_path = ConnectionManager(snapshots, use_arrow=True)
+
+        print(f"{n_rows} rows")
+        measure(".df() (numpy objects)", lambda: numpy_path.fetch_df(QUERY))
+        measure("arrow -> pandas (arrow strings)", lambda: arrow_path.fetch_df(QUERY))
+        measure("arrow table (charts)", lambda: arrow_path.fetch_arrow(QUERY))
+        numpy_path.close()
+        arrow_path.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
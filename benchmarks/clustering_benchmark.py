@@ -0,0 +1,103 @@
+"""
+times dashboard lookups & the visit enrichment on synthetic tables in the
+order the source files have them, then again once TableClusterer sorted them
+
+NOTE: a file database is used so the tables are checkpointed into row groups
+with zone maps like the published snapshots
+
+usage: python -m benchmarks.clustering_benchmark [n_visits]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from src.pages.blood_donation_pipeline.src.sql_dialect import (
+    apply_bigquery_settings,
+    bigquery_to_duckdb,
+)
+from src.pages.blood_donation_pipeline.src.table_clusterer import TableClusterer
+import src.pages.blood_donation_pipeline.src.gbq_queries as gbqq
+
+import duckdb
+
+QUERIES = {
+    "hospital lookup": """
+    SELECT date, daily FROM donations_facility
+    WHERE hospital = 'Hospital 7' AND date >= TIMESTAMP '2020-01-01'
+    """,
+    "state lookup": """
+    SELECT date, daily FROM donations_state
+    WHERE state = 'State 3' AND date BETWEEN TIMESTAMP '2015-01-01' AND TIMESTAMP '2016-01-01'
+    """,
+    "donor lookup": "SELECT * FROM ds_data_granular WHERE donor_id = '12345'",
+    "visit enrichment": bigquery_to_duckdb(
+        gbqq.granular_visits_enriched_select, "blood_donation_pipeline_v2"
+    ),
+}
+
+
+def create_tables(conn: duckdb.DuckDBPyConnection, n_visits: int) -> None:
+    """source tables with rows in no particular order, like the csv files"""
+    conn.execute(f"""
+    CREATE OR REPLACE TABLE donations_facility AS
+    SELECT
+        TIMESTAMP '2006-01-01' + to_days(CAST(hash(i) % 6500 AS INTEGER)) AS date,
+        'Hospital ' || CAST(hash(i + 1) % 120 AS VARCHAR) AS hospital,
+        CAST(i % 97 AS INTEGER) AS daily
+    FROM range(6500 * 120) t(i);
+
+    CREATE OR REPLACE TABLE donations_state AS
+    SELECT
+        TIMESTAMP '2006-01-01' + to_days(CAST(hash(i) % 6500 AS INTEGER)) AS date,
+        'State ' || CAST(hash(i + 1) % 16 AS VARCHAR) AS state,
+        CAST(i % 97 AS INTEGER) AS daily
+    FROM range(6500 * 16) t(i);
+
+    CREATE OR REPLACE TABLE ds_data_granular AS
+    SELECT
+        CAST(hash(i) % {max(1, n_visits // 4)} AS VARCHAR) AS donor_id,
+        TIMESTAMP '2006-01-01' + to_days(CAST(hash(i + 1) % 6500 AS INTEGER)) AS visit_date,
+        CAST(1950 + hash(i) % 55 AS SMALLINT) AS birth_date
+    FROM range({n_visits}) t(i);
+    CHECKPOINT;
+    """)
+
+
+def measure(conn: duckdb.DuckDBPyConnection, repeat: int = 3) -> dict[str, float]:
+    """best latency in ms of every query of QUERIES"""
+    timings = {}
+    for name, query in QUERIES.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # NOTE: materialised so unused columns of the query are not optimised away
+            conn.execute(f"CREATE OR REPLACE TEMP TABLE result AS {query}")
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best * 1000
+    return timings
+
+
+def main(n_visits: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        conn = duckdb.connect(os.path.join(folder, "benchmark.duckdb"))
+        apply_bigquery_settings(conn)
+        create_tables(conn, n_visits)
+        before = measure(conn)
+
+        start = time.perf_counter()
+        TableClusterer(conn).cluster_all()
+        conn.execute("CHECKPOINT")
+        print(f"{n_visits} visits, clustered in {time.perf_counter() - start:.1f}s")
+
+        after = measure(conn)
+        conn.close()
+
+    print(f"{'query':<20} {'before':>12} {'after':>12}")
+    for name in QUERIES:
+        print(f"{name:<20} {before[name]:>9.1f} ms {after[name]:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 6_000_000)
@@ -0,0 +1,215 @@
+"""
+times the ingest path on seeded synthetic datasets & fails on regressions
+
+for every dataset & size it measures:
+    - parse: DataFrameManager reading the raw file (csv, parquet for granular)
+    - clean/<step>: every DataFrameCleaner step, from DataFrameCleaner.metrics
+    - clean: the whole DataFrameCleaner.clean_dataframe call
+    - upload: ParquetUploader staging & loading the cleaned dataframe, the
+      offline stand-in of the bigquery load jobs
+    - duckdb_load: DuckDBLoader loading the raw file
+
+the seconds are the best of `--repeat` runs, the peak memory comes from one
+extra run traced by tracemalloc (python & numpy allocations, arrow & duckdb
+buffers are not covered), results are compared with benchmarks/baselines.json &
+any measurement over its baseline by more than the tolerance fails the run
+
+NOTE: baselines are machine specific, regenerate them on the machine running
+the suite with --update-baselines
+
+usage: python -m benchmarks.regression_suite [--sizes 100k 1M 10M] [--update-baselines]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import synthetic_data
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+from src.pages.blood_donation_pipeline.src.duckdb_loader import DuckDBLoader
+from src.pages.blood_donation_pipeline.src.uploaders import ParquetUploader
+
+import duckdb
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+SIZES = {"100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+DATES = ["date", "visit_date"]
+# NOTE: dataset > (generator, raw file extension)
+DATASETS = {
+    "donations_facility": (synthetic_data.donations_facility, "csv"),
+    "ds_data_granular": (synthetic_data.ds_data_granular, "parquet"),
+}
+# NOTE: measurements faster than this are too noisy to compare relatively
+MIN_SECONDS = 0.01
+MIN_PEAK_MIB = 1.0
+
+
+def measure(func, repeat: int) -> tuple[dict, object]:
+    """
+    runs func `repeat` times untraced & once traced
+
+    Returns:
+        tuple[dict, object]: {"seconds", "peak_mib"} & the result of the last run
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mib": peak / 2**20}, result
+
+
+def run_case(name: str, n_rows: int, folder: str, repeat: int) -> dict[str, dict]:
+    """measures every stage of a single dataset & size"""
+    generator, extension = DATASETS[name]
+    path = os.path.join(folder, f"{name}.{extension}")
+    raw_df = generator(n_rows)
+    if extension == "csv":
+        raw_df.to_csv(path, index=False)
+    else:
+        raw_df.to_parquet(path, index=False)
+    del raw_df
+
+    results = {}
+    results["parse"], df = measure(lambda: DataFrameManager(path).df, repeat)
+
+    cleaners = []
+
+    def clean():
+        cleaner = DataFrameCleaner()
+        cleaners.append(cleaner)
+        return cleaner.clean_dataframe(df.copy(), DATES)
+
+    results["clean"], cleaned_df = measure(clean, repeat)
+    # NOTE: the last run is traced & slower, steps use the best untraced run
+    for cleaner in cleaners[:-1]:
+        for metric in cleaner.metrics:
+            key = f"clean/{metric['step']}"
+            seconds = min(metric["seconds"], results.get(key, {}).get("seconds", 1e9))
+            results[key] = {"seconds": seconds}
+
+    def upload():
+        uploader = ParquetUploader(os.path.join(folder, "tables"))
+        uploader.upload(cleaned_df, name, "replace")
+        uploader.close()
+
+    results["upload"], _ = measure(upload, repeat)
+
+    def duckdb_load():
+        with duckdb.connect() as conn:
+            DuckDBLoader(conn).load(path, name, DATES)
+
+    results["duckdb_load"], _ = measure(duckdb_load, repeat)
+    return results
+
+
+def compare(
+    results: dict[str, dict],
+    baselines: dict[str, dict],
+    time_tolerance: float,
+    memory_tolerance: float,
+) -> list[str]:
+    """
+    compares measurements with their baselines
+
+    Args:
+        results (dict[str, dict]): measurements keyed by dataset/size/stage
+        baselines (dict[str, dict]): stored measurements with the same keys
+        time_tolerance (float): allowed relative slowdown, eg. 0.3 for 30%
+        memory_tolerance (float): allowed relative growth of the peak memory
+
+    Returns:
+        list[str]: a description of every regression, empty if there are none
+    """
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+        for field, tolerance, floor in [
+            ("seconds", time_tolerance, MIN_SECONDS),
+            ("peak_mib", memory_tolerance, MIN_PEAK_MIB),
+        ]:
+            if field not in result or field not in baseline:
+                continue
+            limit = max(baseline[field], floor) * (1 + tolerance)
+            if result[field] > limit:
+                regressions.append(
+                    f"{key} {field}: {result[field]:.3f} > {limit:.3f}"
+                    f" (baseline {baseline[field]:.3f})"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", nargs="+", default=["100k"], choices=SIZES)
+    parser.add_argument("--datasets", nargs="+", default=list(DATASETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--time-tolerance", type=float, default=0.3)
+    parser.add_argument("--memory-tolerance", type=float, default=0.2)
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--update-baselines", action="store_true")
+    args = parser.parse_args()
+    # NOTE: the synthetic data is dirty on purpose, its schema warnings are expected
+    logging.basicConfig(level=logging.ERROR)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.datasets:
+            for size in args.sizes:
+                for stage, result in run_case(
+                    name, SIZES[size], folder, args.repeat
+                ).items():
+                    key = f"{name}/{size}/{stage}"
+                    results[key] = result
+                    print(
+                        f"{key:<48} {result['seconds'] * 1000:>10.1f} ms"
+                        + (
+                            f" {result['peak_mib']:>9.1f} MiB peak"
+                            if "peak_mib" in result
+                            else ""
+                        )
+                    )
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    if args.update_baselines:
+        baselines.update(
+            {
+                key: {field: round(value, 4) for field, value in result.items()}
+                for key, result in results.items()
+            }
+        )
+        with open(args.baselines, "w") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=4)
+        print(f"updated {len(results)} baselines in {args.baselines}")
+        return 0
+
+    regressions = compare(
+        results, baselines, args.time_tolerance, args.memory_tolerance
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    missing = [key for key in results if key not in baselines]
+    if missing:
+        print(f"no baseline for {len(missing)} measurements, run --update-baselines")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+seeded synthetic versions of the raw datasets, with the same columns & the
+same kinds of dirt (negative counters, invalid & future dates, duplicates) as
+the MoH-Malaysia files so every cleaning step has work to do
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.pages.blood_donation_pipeline.src.dataframe_schemas import DONATION_COUNTERS
+
+FIRST_DATE = pd.Timestamp("2006-01-01")
+N_DAYS = 6500
+N_HOSPITALS = 120
+# NOTE: share of rows made dirty, per kind of dirt
+DIRTY_SHARE = 0.001
+
+
+def donations_facility(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    mimics donations_facility.csv: a date, a hospital & daily donation counters
+
+    Args:
+        n_rows (int): number of rows
+        seed (int): seed of the random generator
+
+    Returns:
+        pd.DataFrame: raw dataframe, dates are iso strings
+    """
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, N_DAYS, n_rows)
+    df = pd.DataFrame(
+        {
+            "date": _date_strings(rng, days),
+            "hospital": np.array([f"Hospital {i}" for i in range(N_HOSPITALS)])[
+                rng.integers(0, N_HOSPITALS, n_rows)
+            ],
+        }
+    )
+    for column in DONATION_COUNTERS:
+        counter = rng.poisson(20, n_rows)
+        counter[rng.random(n_rows) < DIRTY_SHARE] = -1
+        df[column] = counter
+    return _with_duplicates(rng, df)
+
+
+def ds_data_granular(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    mimics ds_data_granular: one row per visit of a donor, donors visit ~4 times
+
+    Args:
+        n_rows (int): number of rows
+        seed (int): seed of the random generator
+
+    Returns:
+        pd.DataFrame: raw dataframe, dates are iso strings
+    """
+    rng = np.random.default_rng(seed)
+    donors = rng.integers(0, max(1, n_rows // 4), n_rows)
+    birth_years = 1950 + (donors * 2654435761) % 55
+    df = pd.DataFrame(
+        {
+            "donor_id": pd.Series(donors).astype(str),
+            "visit_date": _date_strings(rng, rng.integers(0, N_DAYS, n_rows)),
+            "birth_date": birth_years.astype("int64"),
+        }
+    )
+    return _with_duplicates(rng, df)
+
+
+def _date_strings(rng: np.random.Generator, days: np.ndarray) -> pd.Series:
+    """iso date strings with a few invalid & future dates"""
+    # NOTE: formatting the distinct days only, like DateParser parses them
+    calendar = (FIRST_DATE + pd.to_timedelta(np.arange(N_DAYS), unit="D")).strftime(
+        "%Y-%m-%d"
+    )
+    dates = pd.Series(np.asarray(calendar, dtype=object)[days])
+    dirty = rng.random(len(days))
+    dates[dirty < DIRTY_SHARE] = "not a date"
+    dates[(dirty >= DIRTY_SHARE) & (dirty < 2 * DIRTY_SHARE)] = "2999-01-01"
+    return dates
+
+
+def _with_duplicates(rng: np.random.Generator, df: pd.DataFrame) -> pd.DataFrame:
+    """overwrites a few rows with copies of other rows"""
+    n_dupes = int(len(df) * DIRTY_SHARE)
+    if n_dupes:
+        targets = rng.choice(len(df), n_dupes, replace=False)
+        sources = rng.choice(len(df), n_dupes, replace=False)
+        df.iloc[targets] = df.iloc[sources].to_numpy()
+    return df
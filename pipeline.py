@@ -1,18 +1,56 @@
 """main entrypoint to run the pipeline"""
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging
+import multiprocessing
 import os
+import sys
 
+from src.pages.blood_donation_pipeline.src.column_profiler import ColumnProfiler
 from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
 from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+from src.pages.blood_donation_pipeline.src.deduplicator import Deduplicator
+from src.pages.blood_donation_pipeline.src.deferred_commits import DeferredCommits
+from src.pages.blood_donation_pipeline.src.duckdb_loader import DuckDBLoader
+from src.pages.blood_donation_pipeline.src.http_cache import HttpCache
+from src.pages.blood_donation_pipeline.src.incremental_datamarts import (
+    CHURN_TABLE,
+    COHORTS_TABLE,
+    ENRICHED_TABLE,
+    IncrementalDatamarts,
+)
+from src.pages.blood_donation_pipeline.src.ingest_steps import (
+    has_table,
+    is_up_to_date,
+    refresh_incremental,
+)
+from src.pages.blood_donation_pipeline.src.parallel_cleaner import ParallelCleaner
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
+from src.pages.blood_donation_pipeline.src.sql_dialect import (
+    apply_bigquery_settings,
+    bigquery_to_duckdb,
+)
+from src.pages.blood_donation_pipeline.src.table_clusterer import (
+    CLUSTER_KEYS,
+    TableClusterer,
+)
+from src.pages.blood_donation_pipeline.src.task_runner import run_all
+from src.pages.blood_donation_pipeline.src.uploaders import (
+    BigQueryUploader,
+    DuckDBUploader,
+    ParquetUploader,
+    Uploader,
+)
+from src.pages.blood_donation_pipeline.src.watermark_store import WatermarkStore
 import src.pages.blood_donation_pipeline.src.gbq_queries as gbqq
 
 import duckdb
 import pandas as pd
-import pandas_gbq as pdbq
 
 ##### LOGGING #####
+# NOTE: identifies the run in the data_quality_profile table
+RUN_ID = datetime.now().strftime("%Y%m%dT%H%M%S")
 DATE_NOW = datetime.now().strftime("%Y/%m/%d")
 LOG_NAME = "blood-donation-pipeline.log"
 LOG_DIR = os.path.join("logs", DATE_NOW)
@@ -37,6 +75,22 @@ FILE_URLS = [
 
 DATES = ["date", "visit_date"]
 
+# NOTE: datasets too large to hold in memory, these are cleaned & uploaded batch by batch
+STREAMING_DATASETS = ["ds_data_granular"]
+BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", 500_000))
+
+# NOTE: datasets that only gain new dates at the tail & the column used as their high-water mark
+INCREMENTAL_DATASETS = {
+    "donations_facility": "date",
+    "donations_state": "date",
+    "newdonors_facility": "date",
+    "newdonors_state": "date",
+}
+# NOTE: days before the high-water mark that are re-ingested to pick up late corrections
+LOOKBACK_DAYS = int(os.getenv("PIPELINE_LOOKBACK_DAYS", 7))
+# NOTE: set PIPELINE_FULL_REFRESH=1 to rebuild every table regardless of cache & watermarks
+FULL_REFRESH = os.getenv("PIPELINE_FULL_REFRESH", "0") == "1"
+
 LOAD_FOLDER = "load"
 DUCKDB_FOLDER = "duckdb"
 if not os.path.exists(LOAD_FOLDER):
@@ -44,46 +98,365 @@ if not os.path.exists(LOAD_FOLDER):
 if not os.path.exists(DUCKDB_FOLDER):
     os.makedirs(DUCKDB_FOLDER)
 
-DUCKDB_DB = os.path.join(
-    f"{os.getcwd()}", "duckdb", "blood_donation_pipeline_v2.duckdb"
+# NOTE: every run writes a new snapshot of the database & publishes it once complete,
+# the dashboard keeps reading the previous snapshot meanwhile
+SNAPSHOTS = SnapshotManager(
+    os.path.join(f"{os.getcwd()}", DUCKDB_FOLDER), "blood_donation_pipeline_v2"
 )
+DUCKDB_DB = SNAPSHOTS.begin(RUN_ID)
 
 DUCKDB_CONN = duckdb.connect(DUCKDB_DB)
 
+# NOTE: raw downloads are cached so unchanged upstream files are not re-processed
+HTTP_CACHE = HttpCache(os.path.join(LOAD_FOLDER, "http_cache"))
+WATERMARKS = WatermarkStore(os.path.join(LOAD_FOLDER, "watermarks.json"))
+# NOTE: cache & watermark updates are only applied once the snapshot is published, so a
+# failed run ingests the same data again instead of skipping what it never published
+COMMITS = DeferredCommits()
+
 GCP_PROJECT_ID = "itsmejoeyong-portfolio"
 BQ_SCHEMA = "blood_donation_pipeline_v2"
 
+# NOTE: pandas (DataFrameManager + DataFrameCleaner) or duckdb (DuckDBLoader)
+LOADER_BACKEND = os.getenv("PIPELINE_LOADER", "pandas")
 
-def main() -> None:
-    logger.info("beginning of log: running pipeline.py")
-    for url in FILE_URLS:
-        df_cleaner = DataFrameCleaner()
-        df_manager = DataFrameManager(url)
-        df_name = df_manager.name
-        df = df_manager.df
-        bq_destination = f"{BQ_SCHEMA}.{df_name}"
+# NOTE: bigquery load jobs, or an offline stand-in: parquet files under load/tables or a
+# separate duckdb database, use the duckdb datamart backend with the stand-ins
+UPLOADER_BACKEND = os.getenv("PIPELINE_UPLOADER", "bigquery")
+# NOTE: number of load jobs running at the same time, across every table
+UPLOAD_WORKERS = int(os.getenv("PIPELINE_UPLOAD_WORKERS", 8))
+
+# NOTE: bigquery runs the datamarts on the uploaded tables, duckdb runs them locally on
+# copies of the cleaned tables kept in DUCKDB_DB, without credentials or scan charges
+DATAMART_BACKEND = os.getenv("PIPELINE_DATAMART_BACKEND", "bigquery")
+# NOTE: set PIPELINE_INCREMENTAL_DATAMARTS=1 with the duckdb backend to keep the cohort & churn
+# datamarts from per-donor state, recomputing only donors with visits since the last run
+INCREMENTAL_DATAMARTS = os.getenv("PIPELINE_INCREMENTAL_DATAMARTS", "0") == "1"
+
+# NOTE: set PIPELINE_DTYPE_BACKEND=pyarrow to keep ingested dataframes arrow backed
+DTYPE_BACKEND = os.getenv("PIPELINE_DTYPE_BACKEND")
+
+# NOTE: number of datasets downloaded, cleaned & uploaded at the same time, 1 runs them one by one
+MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", len(FILE_URLS)))
+
+# NOTE: set PIPELINE_CLEAN_PROCESSES to clean on a pool of processes shared by every dataset,
+# frames larger than PIPELINE_PARTITION_ROWS are also split into row partitions
+CLEAN_PROCESSES = int(os.getenv("PIPELINE_CLEAN_PROCESSES", 0))
+PARTITION_ROWS = int(os.getenv("PIPELINE_PARTITION_ROWS", 1_000_000))
+CLEAN_POOL = None
+
+
+def start_clean_pool() -> ProcessPoolExecutor:
+    """
+    starts the process pool used for cleaning
+
+    NOTE: workers are forked up front, before the ingest threads exist, as
+    spawned workers would re-import this module & its duckdb connection
+    """
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    pool = ProcessPoolExecutor(
+        max_workers=CLEAN_PROCESSES,
+        mp_context=multiprocessing.get_context(start_method),
+    )
+    # NOTE: the first task makes a fork based pool start all of its workers
+    pool.submit(int).result()
+    logger.info(f"started {CLEAN_PROCESSES} cleaning processes")
+    return pool
+
+
+def start_uploader(backend: str) -> Uploader:
+    """
+    creates the uploader loading the cleaned tables into the warehouse
+
+    Args:
+        backend (str): bigquery/parquet/duckdb
+
+    Returns:
+        Uploader: uploader of the backend
+
+    Raises:
+        ValueError: If the backend is not supported
+    """
+    if backend == "bigquery":
+        return BigQueryUploader(GCP_PROJECT_ID, BQ_SCHEMA, max_workers=UPLOAD_WORKERS)
+    if backend == "parquet":
+        return ParquetUploader(
+            os.path.join(LOAD_FOLDER, "tables"), max_workers=UPLOAD_WORKERS
+        )
+    if backend == "duckdb":
+        return DuckDBUploader(
+            duckdb.connect(os.path.join(DUCKDB_FOLDER, "uploads.duckdb")),
+            max_workers=UPLOAD_WORKERS,
+        )
+    raise ValueError(f"unsupported uploader backend: {backend}")
+
+
+UPLOADER = start_uploader(UPLOADER_BACKEND)
+# NOTE: local copies of the uploaded tables in DUCKDB_DB, read by the duckdb datamart backend
+MIRROR = (
+    DuckDBUploader(DUCKDB_CONN, max_workers=UPLOAD_WORKERS)
+    if DATAMART_BACKEND == "duckdb"
+    else None
+)
+
+
+def upload(
+    df: pd.DataFrame, df_name: str, if_exists: str, local_copy: bool = True
+) -> None:
+    """
+    stages a dataframe once & queues its load into the warehouse table, and its
+    local copy when the datamarts are computed locally, see wait_for_uploads
+
+    Args:
+        df (pd.DataFrame): pandas dataframe
+        df_name (str): name of the destination table
+        if_exists (str): replace/append/fail, behaviour when the table exists
+        local_copy (bool): whether to mirror the dataframe into duckdb when the
+            datamarts are computed locally, False if the table is already there
+    """
+    path = UPLOADER.stage(df, df_name)
+    UPLOADER.load_file(path, df_name, if_exists)
+    if local_copy and MIRROR is not None:
+        MIRROR.load_file(path, df_name, if_exists)
+
+
+def wait_for_uploads(df_name: str) -> None:
+    """
+    waits for the queued loads & deletes of a table
+
+    Args:
+        df_name (str): name of the table
+
+    Raises:
+        Exception: the error of the first failed load or delete
+    """
+    UPLOADER.wait(df_name)
+    if MIRROR is not None:
+        MIRROR.wait(df_name)
 
+
+def has_local_table(df_name: str) -> bool:
+    """whether the local duckdb database has a table named df_name"""
+    return has_table(DUCKDB_CONN.cursor(), df_name)
+
+
+def ingest_duckdb(df_manager: DataFrameManager) -> None:
+    """
+    loads & cleans the raw file inside duckdb, then uploads the table to
+    bigquery in record batches so it is never materialised in pandas at once
+
+    Args:
+        df_manager (DataFrameManager): manager of the (cached) source file
+    """
+    df_name = df_manager.name
+    conn = DUCKDB_CONN.cursor()
+    DuckDBLoader(conn).load(
+        df_manager.source, df_name, DATES, content_type=df_manager.content_type
+    )
+
+    reader = conn.execute(f'SELECT * FROM "{df_name}"').fetch_record_batch(BATCH_SIZE)
+    for i, batch in enumerate(reader):
+        upload(
+            batch.to_pandas(),
+            df_name,
+            "replace" if i == 0 else "append",
+            local_copy=False,
+        )
+    wait_for_uploads(df_name)
+
+    if df_name in INCREMENTAL_DATASETS:
+        date_column = INCREMENTAL_DATASETS[df_name]
+        query = f'SELECT MAX({date_column}) FROM "{df_name}"'
+        COMMITS.add(WATERMARKS.set, df_name, conn.execute(query).fetchone()[0])
+
+
+def ingest(url: str) -> str:
+    """
+    downloads, cleans & uploads a single dataset to bigquery
+
+    Args:
+        url (str): url of the dataset to ingest
+
+    Returns:
+        str: name of the ingested dataset
+    """
+    df_manager = DataFrameManager(
+        url, http_cache=HTTP_CACHE, dtype_backend=DTYPE_BACKEND
+    )
+    df_name = df_manager.name
+    schema = df_manager.schema or {}
+    profiler = ColumnProfiler(df_name)
+    df_cleaner = DataFrameCleaner(
+        steps=schema.get("cleaning_steps"),
+        deduplicator=(
+            Deduplicator(keys=schema.get("dedup_keys"))
+            if df_name in STREAMING_DATASETS
+            else None
+        ),
+        profiler=profiler,
+    )
+    if CLEAN_POOL is not None:
+        df_cleaner = ParallelCleaner(df_cleaner, CLEAN_POOL, PARTITION_ROWS)
+    local_conn = DUCKDB_CONN.cursor() if DATAMART_BACKEND == "duckdb" else None
+    if is_up_to_date(df_manager, local_conn, FULL_REFRESH):
+        logger.info(f"{df_name} has not changed since the last run, skipping")
+        return df_name
+
+    watermark = WATERMARKS.get(df_name)
+    if LOADER_BACKEND == "duckdb":
+        ingest_duckdb(df_manager)
+    elif (
+        df_name in INCREMENTAL_DATASETS
+        and watermark
+        and not FULL_REFRESH
+        # NOTE: a missing local copy is rebuilt in full before it is kept incrementally
+        and (DATAMART_BACKEND != "duckdb" or has_local_table(df_name))
+    ):
+        refresh_incremental(
+            df_manager.df,
+            df_name,
+            INCREMENTAL_DATASETS[df_name],
+            df_cleaner,
+            [UPLOADER] if MIRROR is None else [UPLOADER, MIRROR],
+            WATERMARKS,
+            COMMITS,
+            LOOKBACK_DAYS,
+            DATES,
+        )
+    elif df_name in STREAMING_DATASETS:
+        # NOTE: the first batch replaces the table, the following batches are appended
+        for i, batch in enumerate(df_manager.iter_batches(BATCH_SIZE)):
+            cleaned_batch = df_cleaner.clean_dataframe(batch, DATES)
+            upload(cleaned_batch, df_name, "replace" if i == 0 else "append")
+            logger.info(f"queued batch {i} of {df_name}")
+        wait_for_uploads(df_name)
+    else:
+        df = df_manager.df
         # duckdb will select from this variable
         cleaned_df = df_cleaner.clean_dataframe(df, DATES)
-        pdbq.to_gbq(
-            dataframe=cleaned_df,
-            project_id=GCP_PROJECT_ID,
-            destination_table=bq_destination,
-            if_exists="replace",
-        )
+        upload(cleaned_df, df_name, "replace")
+        wait_for_uploads(df_name)
+        if df_name in INCREMENTAL_DATASETS:
+            date_column = INCREMENTAL_DATASETS[df_name]
+            COMMITS.add(WATERMARKS.set, df_name, cleaned_df[date_column].max())
+    if profiler.columns:
+        profiler.save(DUCKDB_CONN.cursor(), RUN_ID)
+    COMMITS.add(HTTP_CACHE.commit, url)
 
     # query = f"CREATE OR REPLACE TABLE {df_name} AS SELECT * FROM cleaned_df;"
     # DUCKDB_CONN.execute(query)
-    logger.info("end of log: pipeline.py completed successfully")
+    return df_name
+
+
+def ingest_all(urls: list[str], max_workers: int = MAX_WORKERS) -> dict[str, Exception]:
+    """
+    ingests every url using a bounded thread pool, a failing dataset is logged
+    & does not stop the remaining datasets from being ingested
+
+    Args:
+        urls (list[str]): urls of the datasets to ingest
+        max_workers (int): maximum number of datasets ingested concurrently
+
+    Returns:
+        dict[str, Exception]: url of every failed dataset & the error it raised
+    """
+    logger.info(f"ingesting {len(urls)} datasets using {max_workers} workers")
+    return run_all(ingest, urls, max_workers, name="ingest")
+
+
+def refresh_incremental_datamarts() -> list[str]:
+    """
+    refreshes the enriched visits, cohort & churn datamarts for the donors with
+    visits newer than the last refresh minus the lookback window
+
+    Returns:
+        list[str]: names of the datamarts written
+    """
+    watermark = WATERMARKS.get(ENRICHED_TABLE)
+    since = (
+        None
+        if watermark is None or FULL_REFRESH
+        else watermark - pd.Timedelta(days=LOOKBACK_DAYS)
+    )
+    conn = DUCKDB_CONN.cursor()
+    IncrementalDatamarts(conn, BQ_SCHEMA).refresh(since)
+    query = "SELECT MAX(visit_date) FROM ds_data_granular"
+    COMMITS.add(WATERMARKS.set, ENRICHED_TABLE, conn.execute(query).fetchone()[0])
+    return [COHORTS_TABLE, CHURN_TABLE]
+
+
+def main() -> None:
+    global CLEAN_POOL
+    logger.info("beginning of log: running pipeline.py")
+    if CLEAN_PROCESSES:
+        CLEAN_POOL = start_clean_pool()
+    try:
+        failures = ingest_all(FILE_URLS)
+    finally:
+        if CLEAN_POOL is not None:
+            CLEAN_POOL.shutdown()
+        if MIRROR is not None:
+            MIRROR.close()
+        UPLOADER.close()
+    if failures:
+        logger.error(
+            f"{len(failures)}/{len(FILE_URLS)} datasets failed to ingest: {list(failures)}"
+        )
+        # NOTE: an incomplete snapshot is never published, the dashboard keeps the last one
+        DUCKDB_CONN.close()
+        SNAPSHOTS.discard(DUCKDB_DB)
+        COMMITS.discard()
+        sys.exit(1)
 
     datamarts = {
         "granular_average_donations_by_age_group_query": gbqq.granular_average_donations_by_age_group_query,
         "granular_cohorts_query": gbqq.granular_cohorts_query,
         "granular_average_months_before_churn_query_v2": gbqq.granular_average_months_before_churn_query_v2,
         "granular_average_months_between_donations_query": gbqq.granular_average_months_between_donations_query,
+        # NOTE: yearly, monthly & weekly sums read by the dashboard instead of the daily tables
+        "donations_state_rollup": gbqq.donations_state_rollup_query,
+        "donations_facility_rollup": gbqq.donations_facility_rollup_query,
+        "newdonors_state_rollup": gbqq.newdonors_state_rollup_query,
+        "newdonors_facility_rollup": gbqq.newdonors_facility_rollup_query,
+    }
+    # NOTE: read the datamarts above from DUCKDB_DB, so they are built locally on both backends
+    summaries = {
+        "granular_age_group_metrics": gbqq.granular_age_group_metrics_query,
+        "granular_retention_curve": gbqq.granular_retention_curve_query,
     }
 
+    # NOTE: local sources are sorted by their filter keys before the datamarts read them,
+    # the datamarts once written, tables kept incrementally are only rewritten once enough
+    # rows were added since their last sort, see TableClusterer
+    clusterer = TableClusterer(DUCKDB_CONN)
+    clustered_datamarts = [ENRICHED_TABLE, *datamarts, *summaries]
+    clusterer.cluster_all(
+        [table for table in CLUSTER_KEYS if table not in clustered_datamarts]
+    )
+
+    # NOTE: every datamart reads the visit enrichment, it is materialised once first
+    if DATAMART_BACKEND == "duckdb":
+        apply_bigquery_settings(DUCKDB_CONN)
+        if INCREMENTAL_DATAMARTS:
+            for key in refresh_incremental_datamarts():
+                datamarts.pop(key)
+        else:
+            DUCKDB_CONN.execute(
+                bigquery_to_duckdb(gbqq.granular_visits_enriched_query, BQ_SCHEMA)
+            )
+    else:
+        # NOTE: only the bigquery backend needs the google clients, offline runs go without
+        from google.cloud import bigquery
+        import pandas_gbq as pdbq
+
+        bigquery.Client(project=GCP_PROJECT_ID).query(
+            gbqq.granular_visits_enriched_query
+        ).result()
     for key, value in datamarts.items():
+        if DATAMART_BACKEND == "duckdb":
+            query = bigquery_to_duckdb(value, BQ_SCHEMA)
+            DUCKDB_CONN.execute(f"CREATE OR REPLACE TABLE {key} AS {query}")
+            continue
         result = pdbq.read_gbq(
             query_or_table=value,
             project_id=GCP_PROJECT_ID,
@@ -91,6 +464,19 @@ def main() -> None:
         DUCKDB_CONN.execute(f"CREATE OR REPLACE TABLE {key} AS SELECT * FROM result")
 
         # print(DUCKDB_CONN.execute(f"SELECT * FROM {key} LIMIT 10").df())
+    for key, value in summaries.items():
+        query = bigquery_to_duckdb(value, BQ_SCHEMA)
+        DUCKDB_CONN.execute(f"CREATE OR REPLACE TABLE {key} AS {query}")
+    clusterer.cluster_all(
+        [table for table in clustered_datamarts if table in CLUSTER_KEYS]
+    )
+
+    # NOTE: closing checkpoints every table into the snapshot file before readers see it
+    DUCKDB_CONN.close()
+    SNAPSHOTS.publish(DUCKDB_DB)
+    COMMITS.apply()
+    SNAPSHOTS.collect_garbage()
+    logger.info("end of log: pipeline.py completed successfully")
 
 
 if __name__ == "__main__":
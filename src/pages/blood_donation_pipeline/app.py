@@ -3,18 +3,32 @@ import os
 from src.pages.blood_donation_pipeline.src.blood_donation_pipeline import (
     BloodDonationPipeline,
 )
+from src.pages.blood_donation_pipeline.src.connection_manager import ConnectionManager
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
 
-import duckdb
 import streamlit as st
 
+# NOTE: budget shared by every session of the process
+DUCKDB_THREADS = int(os.getenv("DASHBOARD_DUCKDB_THREADS", 4))
+DUCKDB_MEMORY_LIMIT = os.getenv("DASHBOARD_DUCKDB_MEMORY_LIMIT", "1GB")
 
-def display_blood_donation_pipeline():
-    DUCKDB_DB_PATH = os.path.join(
-        f"{os.getcwd()}", "duckdb", "blood_donation_pipeline_v2.duckdb"
+
+@st.cache_resource
+def connection_manager() -> ConnectionManager:
+    """one connection manager per process, it follows the snapshots published by pipeline.py"""
+    snapshots = SnapshotManager(
+        os.path.join(f"{os.getcwd()}", "duckdb"), "blood_donation_pipeline_v2"
     )
-    DUCKDB_CONN = duckdb.connect(DUCKDB_DB_PATH, True)
-    bdp = BloodDonationPipeline(DUCKDB_CONN)
+    return ConnectionManager(
+        snapshots, threads=DUCKDB_THREADS, memory_limit=DUCKDB_MEMORY_LIMIT
+    )
+
+
+def display_blood_donation_pipeline():
+    display_dashboard(BloodDonationPipeline(connection_manager()))
+
 
+def display_dashboard(bdp: BloodDonationPipeline):
     ########## CONFIG ##########
     # NOTE: This will be moved towards the main entrypoint
     # st.set_page_config(layout="wide")
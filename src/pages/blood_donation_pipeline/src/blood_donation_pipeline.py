@@ -1,13 +1,63 @@
 """module to abstract blood donation pipeline streamlit logic"""
 
-import duckdb
+from datetime import datetime
+
+from src.pages.blood_donation_pipeline.src.connection_manager import ConnectionManager
+from src.pages.blood_donation_pipeline.src.gbq_queries import ROLLUP_GRAINS
+
 import pandas as pd
 import streamlit as st
 
 
 class BloodDonationPipeline:
-    def __init__(self, duckdb_conn):
-        self.conn = duckdb_conn
+    def __init__(self, db: ConnectionManager):
+        # NOTE: every query goes through the process-wide connection manager
+        self.db = db
+
+    def _rollup_keys(self, table: str, key: str) -> list[str]:
+        """every state/hospital of a rollup table"""
+        query = f"SELECT DISTINCT {key} FROM {table} ORDER BY {key}"
+        return self.db.fetch_df(query)[key].tolist()
+
+    def _rollup_range(self, table: str, grain: str) -> tuple[datetime, datetime]:
+        """first & last period of a rollup table at a grain"""
+        query = f"SELECT MIN(period), MAX(period) FROM {table} WHERE grain = ?"
+        first, last = self.db.fetch_one(query, [grain])
+        return pd.Timestamp(first).to_pydatetime(), pd.Timestamp(last).to_pydatetime()
+
+    def _fetch_rollup(
+        self,
+        table: str,
+        key: str,
+        value: str,
+        grain: str,
+        start: datetime,
+        end: datetime,
+        columns: list[str],
+    ) -> pd.DataFrame:
+        """
+        pre-summed rows of a single state/hospital, computed by the pipeline
+
+        Args:
+            table (str): rollup table, eg. donations_state_rollup
+            key (str): state/hospital
+            value (str): selected state/hospital
+            grain (str): year/month/week
+            start (datetime): first period
+            end (datetime): last period
+            columns (list[str]): counters to fetch
+
+        Returns:
+            pd.DataFrame: date column, the first day of every period, & the counters
+        """
+        counters = ", ".join(f'"{column}"' for column in columns)
+        query = f"""
+        SELECT CAST(period AS TIMESTAMP) AS date, {counters}
+        FROM {table}
+        WHERE grain = ? AND {key} = ? AND period BETWEEN ? AND ?
+        ORDER BY period
+        """
+        return self.db.fetch_df(query, [grain, value, start, end])
 
     def display_about_section(self):
         with st.expander("About the project & data"):
@@ -23,7 +73,7 @@ class BloodDonationPipeline:
             st.subheader("Preview the data")
             # Query db information schema to get table list
             table_names_query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'"
-            table_names_df = self.conn.execute(table_names_query).df()
+            table_names_df = self.db.fetch_df(table_names_query)
             table_names = table_names_df["table_name"].tolist()
 
             # Create dropdown
@@ -32,61 +82,23 @@ class BloodDonationPipeline:
 
             if selected_table:
                 PREVIEW_DATA_QUERY = f"SELECT * FROM {selected_table} LIMIT 5;"
-                df = self.conn.execute(PREVIEW_DATA_QUERY).df()
+                df = self.db.fetch_df(PREVIEW_DATA_QUERY)
 
                 st.dataframe(df)
 
     def display_donation_metrics_by_state(self):
         with st.expander("__Donation Metrics By State__"):
             st.write("")
-            donations_state_query = """
-            SELECT
-                date,
-                state,
-                daily,
-                blood_a,
-                blood_b,
-                blood_o,
-                blood_ab,
-                social_civilian,
-                social_student,
-                social_policearmy,
-                donations_new,
-                donations_regular,
-                donations_irregular
-            FROM donations_state
-            """
-
-            # NOTE: DONATIONS_STATE_DF shorthand is: dons_st_df
-            donations_state_Df = self.conn.execute(donations_state_query).df()
-            dons_st_df_aggregate = (
-                donations_state_Df.groupby(["state", pd.Grouper(key="date", freq="YE")])
-                .agg(
-                    {
-                        "daily": "sum",
-                        "blood_a": "sum",
-                        "blood_b": "sum",
-                        "blood_o": "sum",
-                        "blood_ab": "sum",
-                        "social_civilian": "sum",
-                        "social_student": "sum",
-                        "social_policearmy": "sum",
-                        "donations_new": "sum",
-                        "donations_regular": "sum",
-                        "donations_irregular": "sum",
-                    }
-                )
-                .reset_index()
-            )
-
             # getting state list
-            state_list = dons_st_df_aggregate["state"].unique().tolist()
+            state_list = self._rollup_keys("donations_state_rollup", "state")
             selected_state = "Select a state: "
             selected_state = st.selectbox(selected_state, state_list, index=3)
+            grain = st.radio(
+                "Grain", list(ROLLUP_GRAINS), horizontal=True, key="state grain"
+            )
 
             # getting date range
-            min_date = dons_st_df_aggregate["date"].min().to_pydatetime()
-            max_date = dons_st_df_aggregate["date"].max().to_pydatetime()
+            min_date, max_date = self._rollup_range("donations_state_rollup", grain)
             (slider_min, slider_max) = st.slider(
                 "Date Range",
                 min_value=min_date,
@@ -96,12 +108,28 @@ class BloodDonationPipeline:
                 key="state date slider",
             )
 
-            # Filtering dataframe based on selection above
-            filtered_dons_st_df = dons_st_df_aggregate[
-                (dons_st_df_aggregate["state"] == selected_state)
-                & (dons_st_df_aggregate["date"] >= slider_min)
-                & (dons_st_df_aggregate["date"] <= slider_max)
-            ]
+            # NOTE: DONATIONS_STATE_DF shorthand is: dons_st_df, summed by the pipeline
+            filtered_dons_st_df = self._fetch_rollup(
+                "donations_state_rollup",
+                "state",
+                selected_state,
+                grain,
+                slider_min,
+                slider_max,
+                [
+                    "daily",
+                    "blood_a",
+                    "blood_b",
+                    "blood_o",
+                    "blood_ab",
+                    "social_civilian",
+                    "social_student",
+                    "social_policearmy",
+                    "donations_new",
+                    "donations_regular",
+                    "donations_irregular",
+                ],
+            )
 
             # set index to 'date' for better plotting
             filtered_dons_st_df.set_index("date", inplace=True)
@@ -142,38 +170,6 @@ class BloodDonationPipeline:
 
             st.markdown("### New Donor Metrics")
 
-            new_donors_state_query = """
-            SELECT
-                *
-            FROM newdonors_state;
-            """
-
-            # NOTE: NEW_DONORS_STATE_DF shorthand is: n_donors_st_df
-            new_donors_state_df = self.conn.execute(new_donors_state_query).df()
-            filtered_n_donors_st_df = new_donors_state_df[
-                (new_donors_state_df["state"] == selected_state)
-                & (new_donors_state_df["date"] >= slider_min)
-                & (new_donors_state_df["date"] <= slider_max)
-            ]
-            n_donors_st_df = (
-                filtered_n_donors_st_df.groupby(
-                    ["state", pd.Grouper(key="date", freq="YE")]
-                )
-                .agg(
-                    {
-                        "17-24": "sum",
-                        "25-29": "sum",
-                        "30-34": "sum",
-                        "40-44": "sum",
-                        "45-49": "sum",
-                        "50-54": "sum",
-                        "55-59": "sum",
-                        "60-64": "sum",
-                    }
-                )
-                .reset_index()
-                .set_index("date")
-            )
             n_donors_st_df_cols = [
                 "17-24",
                 "25-29",
@@ -184,6 +180,16 @@ class BloodDonationPipeline:
                 "55-59",
                 "60-64",
             ]
+            # NOTE: NEW_DONORS_STATE_DF shorthand is: n_donors_st_df
+            n_donors_st_df = self._fetch_rollup(
+                "newdonors_state_rollup",
+                "state",
+                selected_state,
+                grain,
+                slider_min,
+                slider_max,
+                n_donors_st_df_cols,
+            ).set_index("date")
             selected_age_groups = st.multiselect(
                 "Select age groups: ",
                 n_donors_st_df_cols,
@@ -197,63 +203,19 @@ class BloodDonationPipeline:
             else:
                 st.write("*Please select at least one age group to render the chart*")
 
-            st.markdown(
-                "> For some reason in streamlit there's an issue with year groupings as you can see, therefore the buckets we see should be 1 year less"
-            )
-
     def display_donation_metrics_by_hospital(self):
         with st.expander("__Donation Metrics By Hospital__"):
             st.write("")
-            donations_hospital_query = """
-            SELECT
-                date,
-                hospital,
-                daily,
-                blood_a,
-                blood_b,
-                blood_o,
-                blood_ab,
-                social_civilian,
-                social_student,
-                social_policearmy,
-                donations_new,
-                donations_regular,
-                donations_irregular
-            FROM donations_facility
-            """
-
-            # NOTE: DONATIONS_HOSPITAL_DF shorthand is: dons_st_df
-            donations_hospital_df = self.conn.execute(donations_hospital_query).df()
-            dons_st_df_aggregate = (
-                donations_hospital_df.groupby(
-                    ["hospital", pd.Grouper(key="date", freq="YE")]
-                )
-                .agg(
-                    {
-                        "daily": "sum",
-                        "blood_a": "sum",
-                        "blood_b": "sum",
-                        "blood_o": "sum",
-                        "blood_ab": "sum",
-                        "social_civilian": "sum",
-                        "social_student": "sum",
-                        "social_policearmy": "sum",
-                        "donations_new": "sum",
-                        "donations_regular": "sum",
-                        "donations_irregular": "sum",
-                    }
-                )
-                .reset_index()
-            )
-
             # getting hospital list
-            hospital_list = dons_st_df_aggregate["hospital"].unique().tolist()
+            hospital_list = self._rollup_keys("donations_facility_rollup", "hospital")
             selected_hospital = "Select a hospital: "
             selected_hospital = st.selectbox(selected_hospital, hospital_list, index=21)
+            grain = st.radio(
+                "Grain", list(ROLLUP_GRAINS), horizontal=True, key="hospital grain"
+            )
 
             # getting date range
-            min_date = dons_st_df_aggregate["date"].min().to_pydatetime()
-            max_date = dons_st_df_aggregate["date"].max().to_pydatetime()
+            min_date, max_date = self._rollup_range("donations_facility_rollup", grain)
             (slider_min, slider_max) = st.slider(
                 "Date Range",
                 min_value=min_date,
@@ -263,12 +225,28 @@ class BloodDonationPipeline:
                 key="hospital date slider",
             )
 
-            # Filtering dataframe based on selection above
-            filtered_dons_st_df = dons_st_df_aggregate[
-                (dons_st_df_aggregate["hospital"] == selected_hospital)
-                & (dons_st_df_aggregate["date"] >= slider_min)
-                & (dons_st_df_aggregate["date"] <= slider_max)
-            ]
+            # NOTE: DONATIONS_HOSPITAL_DF shorthand is: dons_st_df, summed by the pipeline
+            filtered_dons_st_df = self._fetch_rollup(
+                "donations_facility_rollup",
+                "hospital",
+                selected_hospital,
+                grain,
+                slider_min,
+                slider_max,
+                [
+                    "daily",
+                    "blood_a",
+                    "blood_b",
+                    "blood_o",
+                    "blood_ab",
+                    "social_civilian",
+                    "social_student",
+                    "social_policearmy",
+                    "donations_new",
+                    "donations_regular",
+                    "donations_irregular",
+                ],
+            )
 
             # set index to 'date' for better plotting
             filtered_dons_st_df.set_index("date", inplace=True)
@@ -307,38 +285,6 @@ class BloodDonationPipeline:
 
             st.markdown("### New Donor Metrics")
 
-            new_donors_hospital = """
-            SELECT
-                *
-            FROM newdonors_facility;
-            """
-
-            # NOTE: NEW_DONORS_HOSPITAL_DF shorthand is: n_donors_st_df
-            new_donors_hospital_df = self.conn.execute(new_donors_hospital).df()
-            filtered_n_donors_st_df = new_donors_hospital_df[
-                (new_donors_hospital_df["hospital"] == selected_hospital)
-                & (new_donors_hospital_df["date"] >= slider_min)
-                & (new_donors_hospital_df["date"] <= slider_max)
-            ]
-            n_donors_st_df = (
-                filtered_n_donors_st_df.groupby(
-                    ["hospital", pd.Grouper(key="date", freq="YE")]
-                )
-                .agg(
-                    {
-                        "17-24": "sum",
-                        "25-29": "sum",
-                        "30-34": "sum",
-                        "40-44": "sum",
-                        "45-49": "sum",
-                        "50-54": "sum",
-                        "55-59": "sum",
-                        "60-64": "sum",
-                    }
-                )
-                .reset_index()
-                .set_index("date")
-            )
             n_donors_st_df_cols = [
                 "17-24",
                 "25-29",
@@ -349,6 +295,16 @@ class BloodDonationPipeline:
                 "55-59",
                 "60-64",
             ]
+            # NOTE: NEW_DONORS_HOSPITAL_DF shorthand is: n_donors_st_df
+            n_donors_st_df = self._fetch_rollup(
+                "newdonors_facility_rollup",
+                "hospital",
+                selected_hospital,
+                grain,
+                slider_min,
+                slider_max,
+                n_donors_st_df_cols,
+            ).set_index("date")
             selected_age_groups = st.multiselect(
                 "Select age groups: ",
                 n_donors_st_df_cols,
@@ -362,11 +318,8 @@ class BloodDonationPipeline:
             else:
                 st.write("*Please select at least one age group to render the chart*")
 
-            st.markdown(
-                "> For some reason in streamlit there's an issue with year groupings as you can see, therefore the buckets we see should be 1 year less"
-            )
-
     def display_granular_dataset_analysis(self):
+        metrics, retention_curve = self._fetch_age_group_metrics()
         selected_age_group = st.selectbox(
             "select age group",
             ["20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80+"],
@@ -374,84 +327,56 @@ class BloodDonationPipeline:
 
         st.header("")
 
-        granular_average_months_between_donations_result = f"""
-        SELECT
-            average_months_between_visits
-        FROM
-            granular_average_months_between_donations_query
-        WHERE
-            age_group = '{selected_age_group}';
-        """
-        granular_average_months_between_visits_table = self.conn.execute(
-            granular_average_months_between_donations_result
-        ).df()
-
-        # NOTE: churn definition: users who never donate blood once every 2 years
-        granular_average_months_before_churn_result_v2 = f"""
-        SELECT
-            average_months_to_churn
-        FROM
-            granular_average_months_before_churn_query_v2
-        WHERE
-            age_group = '{selected_age_group}';
-        """
-        granular_average_months_before_churn_table_v2 = self.conn.execute(
-            granular_average_months_before_churn_result_v2
-        ).df()
-        avg_months_to_churn = (
-            granular_average_months_before_churn_table_v2[
-                "average_months_to_churn"
-            ].iloc[0]
-            if not granular_average_months_before_churn_table_v2.empty
-            else "N/A"
-        )
-
-        granular_average_donations_by_age_group_result = f"""
-        SELECT
-            avg_donations
-        FROM
-            granular_average_donations_by_age_group_query
-        WHERE
-            age_group = '{selected_age_group}';
-        """
-        granular_average_donations_by_age_group_table = self.conn.execute(
-            granular_average_donations_by_age_group_result
-        ).df()
-        avg_donations = (
-            granular_average_donations_by_age_group_table["avg_donations"].iloc[0]
-            if not granular_average_donations_by_age_group_table.empty
-            else "N/A"
-        )
-
-        granular_cohorts_result = f"""
-        SELECT
-            nth_year,
-            average_retention_rate
-        FROM
-            granular_cohorts_query
-        WHERE
-            age_group = '{selected_age_group}';
-        """
-
-        granular_cohorts_df = self.conn.execute(granular_cohorts_result).df()
+        def metric_value(column: str):
+            # NOTE: an age band missing from a datamart, eg. without churns, shows N/A
+            if selected_age_group not in metrics.index:
+                return "N/A"
+            value = metrics.at[selected_age_group, column]
+            return "N/A" if pd.isna(value) else value
 
         # eating dinner
         metric1, metric2, metric3 = st.columns(3)
         with metric1:
             st.metric(
                 "Average months between visits",
-                granular_average_months_between_visits_table[
-                    "average_months_between_visits"
-                ],
+                metric_value("average_months_between_visits"),
             )
         with metric2:
-            st.metric("Average months to churn", avg_months_to_churn)
+            # NOTE: churn definition: users who never donate blood once every 2 years
+            st.metric(
+                "Average months to churn", metric_value("average_months_to_churn")
+            )
         with metric3:
             st.metric(
                 "Average donations within age group",
-                avg_donations,
+                metric_value("avg_donations"),
             )
 
-        granular_cohorts_df = granular_cohorts_df.set_index("nth_year")
         st.write("average % retention rate on nth year")
-        st.bar_chart(granular_cohorts_df, color=(244, 67, 54, 0.7))
+        st.bar_chart(
+            retention_curve[retention_curve["age_group"] == selected_age_group],
+            x="nth_year",
+            y="average_retention_rate",
+            color=(244, 67, 54, 0.7),
+        )
+
+    def _fetch_age_group_metrics(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        every age band of granular_age_group_metrics & granular_retention_curve,
+        cached per snapshot so changing the age group does not query duckdb
+
+        Returns:
+            tuple[pd.DataFrame, pd.DataFrame]: metrics indexed by age group, retention curves
+        """
+        # NOTE: every published snapshot is a new file, its path keys the cache
+        return _fetch_age_group_metrics(self, self.db.database())
+
+
+@st.cache_data(show_spinner=False)
+def _fetch_age_group_metrics(
+    _bdp: BloodDonationPipeline, database: str
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # NOTE: arguments starting with an underscore are not hashed by st.cache_data
+    metrics = _bdp.db.fetch_df("SELECT * FROM granular_age_group_metrics")
+    retention_curve = _bdp.db.fetch_df("SELECT * FROM granular_retention_curve")
+    return metrics.set_index("age_group"), retention_curve
@@ -0,0 +1,308 @@
+"""module for profiling the columns of a dataset while it is being cleaned"""
+
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+PROFILE_TABLE = "data_quality_profile"
+# NOTE: pseudo column holding the counters that apply to whole rows, eg. duplicates
+ROW_COLUMN = "*"
+
+
+class ColumnProfiler:
+    """
+    accumulates a data quality profile of a dataset across chunks & partitions
+
+    per column it keeps the number of rows & nulls, the values the cleaner
+    nulled or dropped, min/max, a histogram & a k-minimum-values sketch of the
+    distinct count, every part can be merged so streamed batches & parallel
+    partitions are profiled without ever holding the whole dataset
+
+    histograms use fixed buckets so they can be merged: powers of 2 for
+    numbers, years for dates & the values themselves for categories
+    """
+
+    # NOTE: distinct counts above SKETCH_SIZE are estimated with a ~3% standard error
+    SKETCH_SIZE = 1024
+    # NOTE: integer columns spanning fewer values are counted value by value
+    BINCOUNT_RANGE = 1 << 16
+    # NOTE: shared by every profiler, datasets are ingested concurrently & concurrent
+    # CREATE TABLE IF NOT EXISTS fail with a catalog write-write conflict
+    SAVE_LOCK = threading.Lock()
+
+    def __init__(self, dataset: str):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.dataset = dataset
+        self.columns: dict[str, dict] = {}
+
+    def _column(self, column: str) -> dict:
+        if column not in self.columns:
+            self.columns[column] = {
+                "dtype": None,
+                "rows": 0,
+                "null_count": 0,
+                "negatives_masked": 0,
+                "values_coerced": 0,
+                "future_dates_dropped": 0,
+                "duplicates_dropped": 0,
+                "min_value": None,
+                "max_value": None,
+                "histogram": {},
+                "sketch": np.empty(0, dtype=np.uint64),
+            }
+        return self.columns[column]
+
+    def add_count(self, column: str, counter: str, count: int) -> None:
+        """
+        adds to a counter of values changed by a cleaning step
+
+        Args:
+            column (str): profiled column, ROW_COLUMN for whole rows
+            counter (str): negatives_masked/values_coerced/future_dates_dropped/duplicates_dropped
+            count (int): number of values
+        """
+        self._column(column)[counter] += count
+
+    def observe(self, df: pd.DataFrame, keep: pd.Series) -> None:
+        """
+        profiles the kept rows of every column
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            keep (pd.Series): boolean mask of the rows kept by the cleaner
+        """
+        mask = keep.to_numpy()
+        self._column(ROW_COLUMN)["rows"] += int(mask.sum())
+        for column in df.columns:
+            values = df[column] if mask.all() else df[column][mask]
+            self._observe_column(column, values)
+
+    def _observe_column(self, column: str, values: pd.Series) -> None:
+        profile = self._column(column)
+        profile["dtype"] = str(values.dtype)
+        profile["rows"] += len(values)
+        nulls = values.isna()
+        profile["null_count"] += int(nulls.sum())
+        present = values[~nulls] if nulls.any() else values
+        if present.empty:
+            return
+
+        # NOTE: only distinct values are hashed where they are already known
+        distinct = present
+        # NOTE: arrow dictionaries are the categories of the pyarrow dtype backend
+        if isinstance(values.dtype, pd.CategoricalDtype) or (
+            isinstance(values.dtype, pd.ArrowDtype)
+            and pa.types.is_dictionary(values.dtype.pyarrow_dtype)
+        ):
+            counts = present.value_counts(sort=False)
+            counts = counts[counts > 0]
+            buckets = {str(value): int(n) for value, n in counts.items()}
+            low, high = min(buckets), max(buckets)
+            distinct = pd.Series(list(buckets))
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            buckets = present.dt.year.value_counts(sort=False).to_dict()
+            low, high = present.min(), present.max()
+        elif pd.api.types.is_integer_dtype(values):
+            numbers = present.to_numpy(dtype="int64")
+            low, high = numbers.min(), numbers.max()
+            if high - low < self.BINCOUNT_RANGE:
+                # NOTE: counting every value is a single pass for counters & years
+                counts = np.bincount(numbers - low)
+                numbers = np.flatnonzero(counts) + low
+                buckets = self._power_of_2_buckets(numbers, counts[numbers - low])
+            else:
+                buckets = self._power_of_2_buckets(numbers)
+            distinct = pd.Series(numbers)
+        elif pd.api.types.is_float_dtype(values):
+            numbers = present.to_numpy(dtype="float64")
+            low, high = numbers.min(), numbers.max()
+            buckets = self._power_of_2_buckets(numbers)
+        else:
+            buckets = {}
+            low, high = present.min(), present.max()
+
+        histogram = profile["histogram"]
+        for bucket, count in buckets.items():
+            histogram[str(bucket)] = histogram.get(str(bucket), 0) + int(count)
+        if profile["min_value"] is None or low < profile["min_value"]:
+            profile["min_value"] = low
+        if profile["max_value"] is None or high > profile["max_value"]:
+            profile["max_value"] = high
+        hashes = pd.util.hash_pandas_object(distinct, index=False).to_numpy()
+        profile["sketch"] = self._merge_sketch(profile["sketch"], hashes)
+
+    @staticmethod
+    def _power_of_2_buckets(
+        numbers: np.ndarray, weights: np.ndarray = None
+    ) -> dict[str, int]:
+        """
+        counts numbers per signed power of 2 bucket, eg. 5 > "4", -3 > "-2", 0 > "0"
+
+        Args:
+            numbers (np.ndarray): numbers to count
+            weights (np.ndarray): optional number of occurrences of every number
+
+        Returns:
+            dict[str, int]: bucket > count
+        """
+        if weights is None:
+            weights = np.ones(len(numbers), dtype=np.int64)
+        # NOTE: frexp gives the binary exponent directly, |x| is in [2^(e-1), 2^e)
+        _, exponents = np.frexp(numbers.astype("float64"))
+        buckets = {}
+        for sign, selected in [(1, numbers > 0), (-1, numbers < 0)]:
+            if selected.any():
+                first = exponents[selected].min()
+                counts = np.bincount(exponents[selected] - first, weights[selected])
+                for offset in np.flatnonzero(counts):
+                    bucket = sign * 2.0 ** (int(offset + first) - 1)
+                    buckets[f"{bucket:g}"] = int(counts[offset])
+        n_zero = int(weights[numbers == 0].sum())
+        if n_zero:
+            buckets["0"] = n_zero
+        return buckets
+
+    @classmethod
+    def _merge_sketch(cls, sketch: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        """keeps the SKETCH_SIZE smallest distinct hashes of the sketch & the new hashes"""
+        if len(sketch) >= cls.SKETCH_SIZE:
+            # NOTE: hashes above the current k-th smallest can never enter the sketch
+            hashes = hashes[hashes < sketch[-1]]
+        # NOTE: a hash table instead of sorting every hash, then only the k smallest are sorted
+        hashes = pd.unique(hashes)
+        if len(hashes) > cls.SKETCH_SIZE:
+            hashes = np.partition(hashes, cls.SKETCH_SIZE - 1)[: cls.SKETCH_SIZE]
+        return np.unique(np.concatenate([sketch, hashes]))[: cls.SKETCH_SIZE]
+
+    @classmethod
+    def estimate_distinct(cls, sketch: np.ndarray) -> int:
+        """estimates the number of distinct values from a k-minimum-values sketch"""
+        if len(sketch) < cls.SKETCH_SIZE:
+            return len(sketch)
+        return int((cls.SKETCH_SIZE - 1) / (float(sketch[-1]) / 2**64))
+
+    def merge(self, other: "ColumnProfiler") -> None:
+        """
+        adds the profile of another chunk or partition of the same dataset
+
+        Args:
+            other (ColumnProfiler): profile to merge into this one
+        """
+        for column, theirs in other.columns.items():
+            ours = self._column(column)
+            ours["dtype"] = ours["dtype"] or theirs["dtype"]
+            for counter in [
+                "rows",
+                "null_count",
+                "negatives_masked",
+                "values_coerced",
+                "future_dates_dropped",
+                "duplicates_dropped",
+            ]:
+                ours[counter] += theirs[counter]
+            for bucket, count in theirs["histogram"].items():
+                ours["histogram"][bucket] = ours["histogram"].get(bucket, 0) + count
+            if theirs["min_value"] is not None and (
+                ours["min_value"] is None or theirs["min_value"] < ours["min_value"]
+            ):
+                ours["min_value"] = theirs["min_value"]
+            if theirs["max_value"] is not None and (
+                ours["max_value"] is None or theirs["max_value"] > ours["max_value"]
+            ):
+                ours["max_value"] = theirs["max_value"]
+            ours["sketch"] = self._merge_sketch(ours["sketch"], theirs["sketch"])
+
+    def to_frame(self, run_id: str) -> pd.DataFrame:
+        """
+        one row per profiled column
+
+        Args:
+            run_id (str): identifier of the pipeline run
+
+        Returns:
+            pd.DataFrame: profile in the layout of PROFILE_TABLE
+        """
+        rows = []
+        for column, profile in self.columns.items():
+            rows.append(
+                {
+                    "run_id": run_id,
+                    "profiled_at": datetime.now(),
+                    "dataset": self.dataset,
+                    "column_name": column,
+                    "dtype": profile["dtype"],
+                    "rows": profile["rows"],
+                    "null_count": profile["null_count"],
+                    "negatives_masked": profile["negatives_masked"],
+                    "values_coerced": profile["values_coerced"],
+                    "future_dates_dropped": profile["future_dates_dropped"],
+                    "duplicates_dropped": profile["duplicates_dropped"],
+                    "distinct_estimate": (
+                        self.estimate_distinct(profile["sketch"])
+                        if column != ROW_COLUMN
+                        else None
+                    ),
+                    "min_value": _to_text(profile["min_value"]),
+                    "max_value": _to_text(profile["max_value"]),
+                    "histogram": (
+                        json.dumps(profile["histogram"])
+                        if profile["histogram"]
+                        else None
+                    ),
+                }
+            )
+        return pd.DataFrame(rows)
+
+    def save(self, conn: duckdb.DuckDBPyConnection, run_id: str) -> None:
+        """
+        appends the profile of this run to PROFILE_TABLE, saves of concurrently
+        ingested datasets are serialized
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): duckdb connection
+            run_id (str): identifier of the pipeline run
+        """
+        profile_df = self.to_frame(run_id)
+        with self.SAVE_LOCK:
+            self._save(conn, profile_df)
+        self.logger.info(
+            f"saved the profile of {len(profile_df)} columns of {self.dataset}"
+        )
+
+    @staticmethod
+    def _save(conn: duckdb.DuckDBPyConnection, profile_df: pd.DataFrame) -> None:
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PROFILE_TABLE} (
+            run_id VARCHAR,
+            profiled_at TIMESTAMP,
+            dataset VARCHAR,
+            column_name VARCHAR,
+            dtype VARCHAR,
+            rows BIGINT,
+            null_count BIGINT,
+            negatives_masked BIGINT,
+            values_coerced BIGINT,
+            future_dates_dropped BIGINT,
+            duplicates_dropped BIGINT,
+            distinct_estimate BIGINT,
+            min_value VARCHAR,
+            max_value VARCHAR,
+            histogram JSON
+        );
+        """)
+        conn.execute(f"INSERT INTO {PROFILE_TABLE} SELECT * FROM profile_df")
+
+
+def _to_text(value) -> str | None:
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,140 @@
+"""module for sharing one read-only duckdb connection between the dashboard sessions"""
+
+from contextlib import ExitStack, contextmanager
+import logging
+import os
+import threading
+from typing import Iterator
+
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+
+class _OpenSnapshot:
+    """read-only connection on a snapshot & the number of queries running on it"""
+
+    def __init__(self, conn: duckdb.DuckDBPyConnection, stack: ExitStack):
+        self.conn = conn
+        # NOTE: closing the stack closes the connection & releases the snapshot's lock
+        self.stack = stack
+        query = "SELECT path FROM duckdb_databases() WHERE database_name = current_database()"
+        (self.path,) = conn.execute(query).fetchone()
+        self.users = 0
+
+    def close(self) -> None:
+        self.stack.close()
+
+
+class ConnectionManager:
+    """
+    process-wide query layer of the dashboard
+
+    every session & thread queries one read-only connection on the latest
+    published snapshot through a cursor opened for the query, so reruns
+    neither reopen the database nor reload its catalog, the threads &
+    memory_limit settings bound what all sessions together may use
+
+    once pipeline.py publishes a new snapshot the following queries run on
+    it, the previous connection is closed when its last query finishes
+    """
+
+    def __init__(
+        self,
+        snapshots: SnapshotManager,
+        threads: int = 4,
+        memory_limit: str = "1GB",
+        use_arrow: bool = True,
+    ):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.snapshots = snapshots
+        self.config = {"threads": threads, "memory_limit": memory_limit}
+        # NOTE: results are fetched as arrow so strings are not re-materialised as python objects
+        self.use_arrow = use_arrow
+        self.lock = threading.Lock()
+        self.snapshot: _OpenSnapshot | None = None
+
+    @contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """
+        cursor on the latest published snapshot, the cursor is closed & the
+        snapshot released when the block exits
+
+        Yields:
+            duckdb.DuckDBPyConnection: read-only cursor
+
+        Raises:
+            ValueError: If no snapshot has been published
+        """
+        snapshot = self._acquire()
+        try:
+            # NOTE: duckdb connections must not be shared between threads, cursors may,
+            # streamlit reruns on new threads so cursors live only as long as the query
+            cursor = snapshot.conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        finally:
+            self._release(snapshot)
+
+    def fetch_arrow(self, query: str, params: list = None) -> pa.Table:
+        with self.cursor() as cursor:
+            result = cursor.execute(query, params).arrow()
+            # NOTE: newer duckdb versions return a RecordBatchReader instead of a Table
+            if isinstance(result, pa.RecordBatchReader):
+                result = result.read_all()
+        return result
+
+    def fetch_df(self, query: str, params: list = None) -> pd.DataFrame:
+        if not self.use_arrow:
+            with self.cursor() as cursor:
+                return cursor.execute(query, params).df()
+        # NOTE: only strings stay arrow backed, numbers & timestamps convert to numpy without a copy
+        return self.fetch_arrow(query, params).to_pandas(
+            types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_string(t) else None
+        )
+
+    def fetch_one(self, query: str, params: list = None) -> tuple | None:
+        with self.cursor() as cursor:
+            return cursor.execute(query, params).fetchone()
+
+    def database(self) -> str:
+        """path of the snapshot queries currently run on, changes with every publish"""
+        snapshot = self._acquire()
+        try:
+            return snapshot.path
+        finally:
+            self._release(snapshot)
+
+    def close(self) -> None:
+        """closes the connection, queries afterwards open the latest snapshot again"""
+        with self.lock:
+            snapshot, self.snapshot = self.snapshot, None
+            if snapshot is not None and snapshot.users == 0:
+                snapshot.close()
+
+    def _acquire(self) -> _OpenSnapshot:
+        path = self.snapshots.current()
+        with self.lock:
+            if self.snapshot is None or self.snapshot.path != path:
+                self._open()
+            self.snapshot.users += 1
+            return self.snapshot
+
+    def _open(self) -> None:
+        """opens the latest snapshot, the previous one is closed once unused"""
+        stack = ExitStack()
+        conn = stack.enter_context(self.snapshots.reader(self.config))
+        previous, self.snapshot = self.snapshot, _OpenSnapshot(conn, stack)
+        self.logger.info(f"opened snapshot {self.snapshot.path}")
+        if previous is not None and previous.users == 0:
+            previous.close()
+
+    def _release(self, snapshot: _OpenSnapshot) -> None:
+        with self.lock:
+            snapshot.users -= 1
+            if snapshot is not self.snapshot and snapshot.users == 0:
+                snapshot.close()
@@ -1,111 +1,280 @@
 """module for dataframe operations"""
 
-from datetime import datetime
+import json
 import logging
 import os
 import re
+import time
+
+from src.pages.blood_donation_pipeline.src.column_profiler import (
+    ROW_COLUMN,
+    ColumnProfiler,
+)
+from src.pages.blood_donation_pipeline.src.date_parser import DateParser
+from src.pages.blood_donation_pipeline.src.deduplicator import Deduplicator
 
 import pandas as pd
 
+# NOTE: not available on windows, memory deltas are reported as None there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# NOTE: name > (step, applies, row_local), filled by the @cleaning_step decorator below
+CLEANING_STEPS = {}
+
+
+def cleaning_step(name: str, applies=None, row_local: bool = True):
+    """
+    registers a DataFrameCleaner method as a cleaning step
+
+    a step receives the dataframe & the mask of rows kept so far, modifies the
+    dataframe in place & returns the (narrowed) mask, `applies` decides if the
+    step is relevant to a dataframe, irrelevant steps are skipped entirely
+
+    Args:
+        name (str): name used to configure the step, eg. in DATAFRAME_SCHEMAS
+        applies: optional method (self, df) -> bool
+        row_local (bool): whether every row is cleaned independently of the
+            others, only these steps can run on row partitions in parallel
+    """
+
+    def decorator(step):
+        CLEANING_STEPS[name] = (step, applies, row_local)
+        return step
+
+    return decorator
+
 
 class DataFrameCleaner:
-    def __init__(self):
+    DEFAULT_STEPS = [
+        "format_columns",
+        "validate_int",
+        "validate_date",
+        "drop_dupes",
+        "profile",
+    ]
+
+    def __init__(
+        self,
+        steps: list[str] = None,
+        deduplicator: Deduplicator = None,
+        profiler: ColumnProfiler = None,
+    ):
         self.logger = logging.getLogger(os.path.basename(__file__))
+        self.steps = steps or self.DEFAULT_STEPS
+        # NOTE: shared across clean_dataframe calls to drop duplicates across chunks
+        self.deduplicator = deduplicator
+        # NOTE: shared across clean_dataframe calls so date formats are detected once
+        self.date_parser = DateParser()
+        # NOTE: shared across clean_dataframe calls to profile every chunk of a dataset
+        self.profiler = profiler
+        unknown_steps = [step for step in self.steps if step not in CLEANING_STEPS]
+        if unknown_steps:
+            raise ValueError(f"Unknown cleaning steps: {unknown_steps}")
+        self.metrics: list[dict] = []
 
     def clean_dataframe(
-        self, df: pd.DataFrame, date_column: list[str] = None
+        self, df: pd.DataFrame, date_column: list[str] = None, steps: list[str] = None
     ) -> pd.DataFrame:
         """
-        cleans the dataframe using various functions
+        cleans the dataframe in a single pass, every step either modifies a
+        column in place or narrows one shared mask of rows to keep, the rows
+        are only filtered (copied) once at the end
+
+        the metrics of every step are appended to self.metrics & logged as json
 
         Args:
             df (pd.DataFrame): pandas dataframe
             date_column (str): date column to be validated
+            steps (list[str]): subset of the steps to run, defaults to self.steps
 
         Returns:
             pd.DataFrame: pandas dataframe
         """
         self.logger.info("Starting dataframe cleaning process")
-        self.date_columns: list[str] = date_column
+        self.date_columns: list[str] = date_column or []
 
-        cleaning_methods = [
-            self._format_columns,
-            self._validate_int,
-            self._validate_date,
-            self._drop_dupes,
-        ]
+        keep = pd.Series(True, index=df.index)
+        for name in self.steps if steps is None else steps:
+            step, applies, _ = CLEANING_STEPS[name]
+            if applies is not None and not applies(self, df):
+                self.logger.debug(f"skipping cleaning step: {name}")
+                continue
+            self.logger.debug(f"applying cleaning step: {name}")
+            keep = self._run_step(name, step, df, keep)
 
-        for method in cleaning_methods:
-            self.logger.debug(f"applying cleaning method: {method}")
-            df = method(df)
+        if not keep.all():
+            df = df[keep]
 
         self.logger.info("Dataframe cleaning process completed")
         return df
 
-    def _format_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _run_step(
+        self, name: str, step, df: pd.DataFrame, keep: pd.Series
+    ) -> pd.Series:
+        """runs a single step, recording its wall time, row counts & memory delta"""
+        self._nulled = 0
+        rows_in = int(keep.sum())
+        peak_before = self._peak_memory()
+        start = time.perf_counter()
+
+        keep = step(self, df, keep)
+
+        rows_out = int(keep.sum())
+        peak_after = self._peak_memory()
+        metric = {
+            "step": name,
+            "seconds": round(time.perf_counter() - start, 6),
+            "rows_in": rows_in,
+            "rows_out": rows_out,
+            "rows_dropped": rows_in - rows_out,
+            "values_nulled": self._nulled,
+            "peak_memory_delta_bytes": (
+                peak_after - peak_before if peak_before is not None else None
+            ),
+        }
+        self.metrics.append(metric)
+        self.logger.info(f"cleaning step metrics: {json.dumps(metric)}")
+        return keep
+
+    @staticmethod
+    def _peak_memory() -> int | None:
+        """peak resident memory of the process in bytes"""
+        if resource is None:
+            return None
+        # NOTE: ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _has_int_columns(self, df: pd.DataFrame) -> bool:
+        return any(pd.api.types.is_integer_dtype(dtype) for dtype in df.dtypes)
+
+    def _has_date_columns(self, df: pd.DataFrame) -> bool:
+        return any(date in df.columns for date in self.date_columns)
+
+    def _has_profiler(self, df: pd.DataFrame) -> bool:
+        return self.profiler is not None
+
+    @cleaning_step("format_columns")
+    def _format_columns(self, df: pd.DataFrame, keep: pd.Series) -> pd.Series:
         """
         converts CamelCase into snake_case using regex
 
         Args:
-            column (str): column to be passed
+            df (pd.DataFrame): pandas dataframe, columns are renamed in place
+            keep (pd.Series): boolean mask of rows kept so far
 
-        Output:
-            returns the cleaned column name
+        Returns:
+            pd.Series: boolean mask of rows kept so far
 
         Example:
             - vendorID > vendor_id
             - TypeApheresisPlatelet > type_apheresis_platelet
         """
         self.logger.info("formatting columns to use snake_case case type")
-        df.columns = [
-            re.sub(r"(?<!^)([A-Z]+)", r"_\1", col).lower().strip() for col in df.columns
-        ]
-        return df
+        df.columns = [self.to_snake_case(col) for col in df.columns]
+        return keep
+
+    @staticmethod
+    def to_snake_case(column: str) -> str:
+        """converts a single CamelCase column name into snake_case"""
+        return re.sub(r"(?<!^)([A-Z]+)", r"_\1", column).lower().strip()
 
-    def _validate_int(self, df: pd.DataFrame) -> pd.DataFrame:
+    @cleaning_step("validate_int", applies=_has_int_columns)
+    def _validate_int(self, df: pd.DataFrame, keep: pd.Series) -> pd.Series:
         """
-        replaces any negative int values with NaN
+        replaces any negative int values with NaN, columns without negative
+        values are left untouched
 
         Args:
-            df (pd.DataFrame): pandas dataframe
+            df (pd.DataFrame): pandas dataframe, columns are replaced in place
+            keep (pd.Series): boolean mask of rows kept so far
 
         Returns:
-            pd.DataFrame: pandas dataframe
+            pd.Series: boolean mask of rows kept so far
         """
         self.logger.info("validating integer columns")
         for col in df.columns:
             if pd.api.types.is_integer_dtype(df[col]):
                 self.logger.debug(f"validating column: {col}")
-                df[col] = df[col].mask(df[col] < 0)
-        return df
+                negative = df[col] < 0
+                n_negative = int(negative.sum())
+                if n_negative:
+                    df[col] = df[col].mask(negative)
+                    self._nulled += n_negative
+                    if self.profiler is not None:
+                        self.profiler.add_count(col, "negatives_masked", n_negative)
+        return keep
 
-    def _validate_date(self, df: pd.DataFrame) -> pd.DataFrame:
+    @cleaning_step("validate_date", applies=_has_date_columns)
+    def _validate_date(self, df: pd.DataFrame, keep: pd.Series) -> pd.Series:
         """
-        converts the column to datetime else NaT
+        converts the column to datetime else NaT & drops rows with future,
+        missing or invalid dates
 
         Args:
-            df (pd.DataFrame): pandas dataframe
+            df (pd.DataFrame): pandas dataframe, date columns are converted in place
+            keep (pd.Series): boolean mask of rows kept so far
 
         Returns:
-            pd.DataFrame: pandas dataframe
+            pd.Series: boolean mask narrowed to rows with valid past dates
         """
         self.logger.info("validating date columns")
         for date in self.date_columns:
             if date in df.columns:
                 self.logger.debug(f"converting column: {date} to datetime data type")
-                df[date] = pd.to_datetime(df[date], errors="coerce")
-                df = df[df[date] <= datetime.now()]
-        return df
+                df[date], n_coerced = self.date_parser.parse(df[date], date)
+                self._nulled += n_coerced
+                future = self.date_parser.is_future(df[date])
+                if self.profiler is not None:
+                    self.profiler.add_count(date, "values_coerced", n_coerced)
+                    self.profiler.add_count(
+                        date, "future_dates_dropped", int((future & keep).sum())
+                    )
+                keep &= df[date].notna() & ~future
+        return keep
 
-    def _drop_dupes(self, df: pd.DataFrame) -> pd.DataFrame:
+    @cleaning_step("drop_dupes", row_local=False)
+    def _drop_dupes(self, df: pd.DataFrame, keep: pd.Series) -> pd.Series:
         """
         drops duplicate rows from a dataframe
 
+        NOTE: identical rows share the same date validity, so finding duplicates
+        on the unfiltered dataframe keeps the same rows as filtering first, with
+        a deduplicator only the kept rows are hashed against earlier chunks
+
         Args:
             df (pd.DataFrame): pandas dataframe
+            keep (pd.Series): boolean mask of rows kept so far
 
         Returns:
-            pd.DataFrame: _description_
+            pd.Series: boolean mask narrowed to the first occurrence of every row
         """
         self.logger.info("dropping duplicates")
-        return df.drop_duplicates()
+        if self.deduplicator is not None:
+            dupes = self.deduplicator.find_dupes(df, keep)
+        else:
+            dupes = df.duplicated()
+        if self.profiler is not None:
+            self.profiler.add_count(
+                ROW_COLUMN, "duplicates_dropped", int((dupes & keep).sum())
+            )
+        return keep & ~dupes
+
+    @cleaning_step("profile", applies=_has_profiler)
+    def _profile(self, df: pd.DataFrame, keep: pd.Series) -> pd.Series:
+        """
+        profiles the kept rows before they are filtered, the counters of the
+        other steps were recorded while they ran, see ColumnProfiler
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            keep (pd.Series): boolean mask of rows kept so far
+
+        Returns:
+            pd.Series: boolean mask of rows kept so far
+        """
+        self.logger.info("profiling columns")
+        self.profiler.observe(df, keep)
+        return keep
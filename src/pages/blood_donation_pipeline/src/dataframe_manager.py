@@ -3,21 +3,83 @@
 import logging
 import os
 from pathlib import Path
+import shutil
+import tempfile
+from typing import Iterator
+import urllib.request
+
+from src.pages.blood_donation_pipeline.src.dataframe_schemas import DATAFRAME_SCHEMAS
+from src.pages.blood_donation_pipeline.src.http_cache import HttpCache
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 
 class DataFrameManager:
-    def __init__(self, path_to_df: str):
+    # NOTE: checked in order, magic bytes win over the headers & the extension
+    MAGIC_BYTES = {b"PAR1": "parquet", b"\x1f\x8b": "csv_gzip"}
+    CONTENT_TYPES = {
+        "application/vnd.apache.parquet": "parquet",
+        "application/x-parquet": "parquet",
+        "text/csv": "csv",
+        "application/csv": "csv",
+        "application/gzip": "csv_gzip",
+    }
+    EXTENSIONS = {
+        ".parquet": "parquet",
+        ".pq": "parquet",
+        ".csv": "csv",
+        ".gz": "csv_gzip",
+    }
+    SNIFF_SIZE = 4096
+    # NOTE: remote files larger than this are spooled to disk instead of memory
+    SPOOL_SIZE = 64 * 1024 * 1024
+
+    def __init__(
+        self,
+        path_to_df: str,
+        http_cache: HttpCache = None,
+        dtype_backend: str = None,
+    ):
         self.logger = logging.getLogger(os.path.basename(__file__))
         self.file_path = path_to_df
         self.path = Path(path_to_df)
         self.name = self.path.name.split(".")[0].replace("-", "_")
-        self.df = self._initialize_df()
+        self.source = path_to_df
+        self.content_type = None
+        self.changed = True
+        if http_cache is not None and self._is_url(path_to_df):
+            cache_entry = http_cache.fetch(path_to_df)
+            self.source = cache_entry["body_path"]
+            self.content_type = cache_entry.get("content_type")
+            self.changed = cache_entry["changed"]
+        # NOTE: "pyarrow" keeps strings & dates in arrow memory instead of numpy objects
+        self.dtype_backend = dtype_backend
+        self.schema = DATAFRAME_SCHEMAS.get(self.name)
+        self._schema_checked = False
+        self._df = None
+
+    @property
+    def df(self) -> pd.DataFrame:
+        # NOTE: read lazily so unchanged cached files are never parsed
+        if self._df is None:
+            self._df = self._initialize_df()
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame) -> None:
+        self._df = df
+
+    @staticmethod
+    def _is_url(path: str) -> bool:
+        return path.startswith(("http://", "https://"))
 
     def _initialize_df(self) -> pd.DataFrame:
         """
-        reads a csv/parquet via URL/file
+        reads a csv/parquet via URL/file, the source is fetched once & its
+        format is detected before parsing
 
         Returns:
             pd.DataFrame: pandas dataframe
@@ -26,28 +88,269 @@ class DataFrameManager:
             ValueError: If the file format is not supported
         """
         self.logger.info("starting process to initlaize a dataframe")
-        last_exception = None
-        readers = [self.read_csv, self.read_parquet]
+        readers = {
+            "csv": self.read_csv,
+            "csv_gzip": self.read_csv_gzip,
+            "parquet": self.read_parquet,
+        }
 
-        for reader in readers:
+        with self._open_source() as buffer:
+            file_format = self._detect_source_format(buffer)
+            self.logger.info(f"reading {self.name} as {file_format}")
+            kwargs = self._read_kwargs(buffer, file_format)
             try:
-                df = reader(self.file_path)
-                return df
-            except Exception as e:
-                self.logger.info(f"error reading dataframe: {e}, using next reader")
-                last_exception = e
-        self.logger.info(f"failed to read using readers provided: {last_exception}")
+                df = readers[file_format](buffer, **kwargs)
+            except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeError):
+                # NOTE: malformed files are not schema drift, these subclass ValueError
+                raise
+            except (ValueError, TypeError) as e:
+                if not kwargs.get("dtype"):
+                    raise
+                raise ValueError(
+                    f"{self.name} does not match its declared schema: {e}"
+                ) from e
+        return self._apply_schema(df)
+
+    def iter_batches(self, batch_size: int) -> Iterator[pd.DataFrame]:
+        """
+        reads the source in batches of at most batch_size rows, parquet files
+        are read row group by row group & csv files chunk by chunk, so peak
+        memory is bounded by the batch size instead of the file size
+
+        Args:
+            batch_size (int): maximum number of rows per batch
+
+        Yields:
+            pd.DataFrame: pandas dataframe of the next batch
+
+        Raises:
+            ValueError: If the file format is not supported
+        """
+        self.logger.info(f"streaming {self.name} in batches of {batch_size} rows")
+        with self._open_source() as buffer:
+            file_format = self._detect_source_format(buffer)
+            if file_format == "parquet":
+                parquet_file = pq.ParquetFile(buffer)
+                types_mapper = (
+                    pd.ArrowDtype if self.dtype_backend == "pyarrow" else None
+                )
+                for batch in parquet_file.iter_batches(batch_size=batch_size):
+                    yield self._apply_schema(batch.to_pandas(types_mapper=types_mapper))
+            else:
+                compression = "gzip" if file_format == "csv_gzip" else None
+                with pd.read_csv(
+                    buffer,
+                    chunksize=batch_size,
+                    compression=compression,
+                    **self._read_kwargs(buffer, file_format),
+                ) as reader:
+                    for batch in reader:
+                        yield self._apply_schema(batch)
+
+    def _read_kwargs(self, buffer, file_format: str) -> dict:
+        """keyword arguments shared by every reader: declared schema & dtype backend"""
+        kwargs = self._csv_schema_kwargs(buffer, file_format)
+        if self.dtype_backend is not None:
+            kwargs["dtype_backend"] = self.dtype_backend
+        return kwargs
+
+    def _csv_schema_kwargs(self, buffer, file_format: str) -> dict:
+        """
+        builds the dtype/parse_dates arguments of pd.read_csv from the declared
+        schema, only columns present in the csv header are declared
+
+        NOTE: integers are left to _apply_schema, the csv parser builds nullable
+        integers from strings & is several times slower than casting parsed numbers
+
+        Args:
+            buffer: opened source, rewound after reading the header
+            file_format (str): detected format of the source
+
+        Returns:
+            dict: keyword arguments for the reader
+        """
+        if self.schema is None or file_format == "parquet":
+            return {}
+        compression = "gzip" if file_format == "csv_gzip" else None
+        columns = pd.read_csv(buffer, nrows=0, compression=compression).columns
+        buffer.seek(0)
+        return {
+            "dtype": {
+                column: dtype
+                for column, dtype in self._declared_dtypes().items()
+                if column in columns and not pd.api.types.is_integer_dtype(dtype)
+                # NOTE: the csv parser cannot build arrow dtypes, cast by _apply_schema
+                and not isinstance(dtype, pd.ArrowDtype)
+            },
+            "parse_dates": [date for date in self.schema["dates"] if date in columns],
+        }
+
+    def _declared_dtypes(self) -> dict:
+        """
+        declared dtypes of the schema, mapped to their arrow equivalents under
+        the pyarrow dtype backend so the cast keeps the columns arrow backed
+
+        Returns:
+            dict: column name & dtype of every declared column
+        """
+        dtypes = self.schema["dtype"]
+        if self.dtype_backend != "pyarrow":
+            return dtypes
+        return {column: self._arrow_dtype(dtype) for column, dtype in dtypes.items()}
+
+    @staticmethod
+    def _arrow_dtype(dtype) -> pd.ArrowDtype:
+        """arrow equivalent of a numpy/pandas dtype, categories become dictionaries"""
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, pd.ArrowDtype):
+            return dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            return pd.ArrowDtype(pa.dictionary(pa.int32(), pa.string()))
+        if isinstance(dtype, pd.StringDtype):
+            return pd.ArrowDtype(pa.string())
+        # NOTE: nullable extension dtypes, eg. Int32, expose their numpy counterpart
+        return pd.ArrowDtype(pa.from_numpy_dtype(getattr(dtype, "numpy_dtype", dtype)))
+
+    def _apply_schema(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        casts columns that were not declared at parse time (eg. parquet) to
+        their declared dtype & reports undeclared, missing or drifted columns
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+
+        Returns:
+            pd.DataFrame: pandas dataframe
+
+        Raises:
+            ValueError: If a column cannot be cast to its declared dtype
+        """
+        if self.schema is None:
+            if not self._schema_checked:
+                self.logger.warning(f"no schema declared for {self.name}")
+                self._schema_checked = True
+            return df
+
+        dtypes = self._declared_dtypes()
+        dates = self.schema["dates"]
+        if not self._schema_checked:
+            declared = [*dtypes, *dates]
+            unknown = [column for column in df.columns if column not in declared]
+            missing = [column for column in declared if column not in df.columns]
+            if unknown:
+                self.logger.warning(f"undeclared columns in {self.name}: {unknown}")
+            if missing:
+                self.logger.warning(
+                    f"declared columns missing from {self.name}: {missing}"
+                )
+            self._schema_checked = True
+
+        try:
+            casts = {
+                column: dtype
+                for column, dtype in dtypes.items()
+                if column in df.columns and df[column].dtype != dtype
+            }
+            if casts:
+                df = df.astype(casts)
+        except (ValueError, TypeError) as e:
+            raise ValueError(
+                f"{self.name} does not match its declared schema: {e}"
+            ) from e
+
+        for date in dates:
+            if date in df.columns and not pd.api.types.is_datetime64_any_dtype(
+                df[date]
+            ):
+                try:
+                    df[date] = pd.to_datetime(df[date])
+                except (ValueError, TypeError):
+                    # NOTE: left for DataFrameCleaner to coerce, but reported as drift
+                    self.logger.warning(f"{self.name}.{date} has unparsable dates")
+        return df
+
+    def _detect_source_format(self, buffer) -> str:
+        """detects the format of an opened source & rewinds it"""
+        file_format = self.detect_format(
+            buffer.read(self.SNIFF_SIZE), self.content_type, self.file_path
+        )
+        buffer.seek(0)
+        return file_format
+
+    def _open_source(self):
+        """
+        opens the source as a seekable binary buffer, remote files are
+        downloaded exactly once
+
+        Returns:
+            a binary file object positioned at the start of the file
+        """
+        if not self._is_url(self.source):
+            return open(self.source, "rb")
+
+        self.logger.info(f"downloading {self.source}")
+        buffer = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE)
+        with urllib.request.urlopen(self.source) as response:
+            self.content_type = response.headers.get("Content-Type")
+            shutil.copyfileobj(response, buffer)
+        buffer.seek(0)
+        return buffer
+
+    @classmethod
+    def detect_format(
+        cls, head: bytes, content_type: str = None, file_path: str = ""
+    ) -> str:
+        """
+        detects the file format using the magic bytes, Content-Type & extension
+
+        Args:
+            head (bytes): first bytes of the file
+            content_type (str): Content-Type header of the response, if any
+            file_path (str): path/url of the file
+
+        Returns:
+            str: one of csv, csv_gzip or parquet
+
+        Raises:
+            ValueError: If the file format is not supported
+        """
+        for magic, file_format in cls.MAGIC_BYTES.items():
+            if head.startswith(magic):
+                return file_format
+
+        if content_type:
+            mime_type = content_type.split(";")[0].strip().lower()
+            if mime_type in cls.CONTENT_TYPES:
+                return cls.CONTENT_TYPES[mime_type]
+
+        extension = Path(file_path.split("?")[0]).suffix.lower()
+        if extension in cls.EXTENSIONS:
+            return cls.EXTENSIONS[extension]
+
+        # NOTE: extensionless text/plain & octet-stream responses, eg. raw github files
+        try:
+            first_line = head.decode("utf-8").splitlines()[0]
+        except (UnicodeDecodeError, IndexError):
+            first_line = ""
+        if "," in first_line and not first_line.lstrip().startswith("<"):
+            return "csv"
+
         raise ValueError(
-            f"Failed to read the file as any supported format. Last error: {last_exception}"
+            f"Unsupported file format (Content-Type: {content_type}, path: {file_path}),"
+            " supported formats are csv, gzipped csv & parquet"
         )
 
     @staticmethod
-    def read_csv(path: Path) -> pd.DataFrame:
-        return pd.read_csv(path)
+    def read_csv(path: Path, **kwargs) -> pd.DataFrame:
+        return pd.read_csv(path, **kwargs)
 
     @staticmethod
-    def read_parquet(path: Path) -> pd.DataFrame:
-        return pd.read_parquet(path)
+    def read_csv_gzip(path: Path, **kwargs) -> pd.DataFrame:
+        return pd.read_csv(path, compression="gzip", **kwargs)
+
+    @staticmethod
+    def read_parquet(path: Path, **kwargs) -> pd.DataFrame:
+        return pd.read_parquet(path, **kwargs)
 
     def write_df_to_file(
         self,
@@ -55,7 +358,29 @@ class DataFrameManager:
         file_type: str = "csv",
         index: bool = False,
         compress: bool = False,
+        compression: str = None,
+        partition_cols: list[str] = None,
+        row_group_size: int = None,
+        chunksize: int = None,
     ) -> None:
+        """
+        writes the dataframe to a csv/xlsx/parquet file
+
+        Args:
+            output_path (str): path of the file (or dataset folder when partitioned)
+            file_type (str): csv, xlsx or parquet
+            index (bool): whether the index is written
+            compress (bool): gzip compression, kept for backwards compatibility
+            compression (str): explicit codec, eg. zstd/snappy/gzip for parquet
+            partition_cols (list[str]): parquet only, hive partition columns, "year"
+                is derived from the dataset's declared date column if missing
+            row_group_size (int): parquet only, maximum rows per row group
+            chunksize (int): csv only, rows written at a time, the source is
+                streamed batch by batch if the dataframe was never loaded
+
+        Raises:
+            ValueError: If the file type is not supported
+        """
         self.logger.info("starting process to write dataframe to a file")
         if output_path is None:
             output_path = self.file_path.rsplit(".", 1)[0] + f"_modified.{file_type}"
@@ -69,20 +394,82 @@ class DataFrameManager:
         if file_type not in writer:
             self.logger.info(".extension format to write dataframe to not supported")
             raise ValueError("Supported types are csv, xlsx/excel & parquet")
-        writer[file_type](output_path, index, compress)
+        if compression is None and compress:
+            compression = "gzip"
+        writer[file_type](
+            output_path,
+            index,
+            compression,
+            partition_cols=partition_cols,
+            row_group_size=row_group_size,
+            chunksize=chunksize,
+        )
         self.logger.info("Dataframe writing process completed")
 
-    def _write_csv(self, output, index, compress):
+    def _write_csv(self, output, index, compression, chunksize=None, **kwargs):
         self.logger.info("writing dataframe to a csv file")
-        compression = "gzip" if compress else None
-        self.df.to_csv(output, index=index, compression=compression)
+        if chunksize is None or self._df is not None:
+            self.df.to_csv(
+                output, index=index, compression=compression, chunksize=chunksize
+            )
+            return
 
-    def _write_xlsx(self, output, index, compress):
+        # NOTE: streamed straight from the source so the file is never held in memory
+        for i, batch in enumerate(self.iter_batches(chunksize)):
+            batch.to_csv(
+                output,
+                index=index,
+                compression=compression,
+                mode="w" if i == 0 else "a",
+                header=i == 0,
+            )
+
+    def _write_xlsx(self, output, index, compression, **kwargs):
         self.logger.info("writing dataframe to an xlsx file")
         # NOTE: no compression option for excel
         self.df.to_excel(output, index=index)
 
-    def _write_parquet(self, output, index, compress):
+    def _write_parquet(
+        self,
+        output,
+        index,
+        compression,
+        partition_cols=None,
+        row_group_size=None,
+        **kwargs,
+    ):
         self.logger.info("writing dataframe to a parquet file")
-        compression = "gzip" if compress else None
-        self.df.to_parquet(output, index=index, compression=compression)
+        df = self.df
+        if partition_cols and "year" in partition_cols and "year" not in df.columns:
+            if self.schema is None:
+                raise ValueError(
+                    f"no date column declared to derive year for {self.name}"
+                )
+            df = df.assign(year=pd.to_datetime(df[self.schema["dates"][0]]).dt.year)
+
+        table = pa.Table.from_pandas(df, preserve_index=index)
+        if not partition_cols:
+            pq.write_table(
+                table,
+                output,
+                compression=compression or "none",
+                row_group_size=row_group_size,
+                write_statistics=True,
+            )
+            return
+
+        # NOTE: hive partitions + row group statistics let duckdb prune files & row groups
+        self.logger.info(f"partitioning parquet dataset by {partition_cols}")
+        file_options = ds.ParquetFileFormat().make_write_options(
+            compression=compression or "none", write_statistics=True
+        )
+        ds.write_dataset(
+            table,
+            output,
+            format="parquet",
+            partitioning=partition_cols,
+            partitioning_flavor="hive",
+            file_options=file_options,
+            max_rows_per_group=row_group_size or 1024 * 1024,
+            existing_data_behavior="delete_matching",
+        )
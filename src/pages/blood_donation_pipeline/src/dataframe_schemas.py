@@ -0,0 +1,71 @@
+"""
+declared dtypes for every dataset, keyed by DataFrameManager.name
+
+an optional "cleaning_steps" list overrides DataFrameCleaner.DEFAULT_STEPS for a dataset
+& an optional "dedup_keys" list restricts deduplication of streamed batches to those columns
+"""
+
+# NOTE: counters are nullable signed ints because DataFrameCleaner masks negative values with NA
+DONATION_COUNTERS = {
+    column: "Int32"
+    for column in [
+        "daily",
+        "blood_a",
+        "blood_b",
+        "blood_o",
+        "blood_ab",
+        "location_centre",
+        "location_mobile",
+        "type_wholeblood",
+        "type_apheresis_platelet",
+        "type_apheresis_plasma",
+        "type_other",
+        "social_civilian",
+        "social_student",
+        "social_policearmy",
+        "donations_new",
+        "donations_regular",
+        "donations_irregular",
+    ]
+}
+
+NEW_DONOR_COUNTERS = {
+    column: "Int32"
+    for column in [
+        "17-24",
+        "25-29",
+        "30-34",
+        "35-39",
+        "40-44",
+        "45-49",
+        "50-54",
+        "55-59",
+        "60-64",
+        "other",
+        "total",
+    ]
+}
+
+DATAFRAME_SCHEMAS = {
+    "donations_state": {
+        "dtype": {"state": "category", **DONATION_COUNTERS},
+        "dates": ["date"],
+    },
+    "donations_facility": {
+        "dtype": {"hospital": "category", **DONATION_COUNTERS},
+        "dates": ["date"],
+    },
+    "newdonors_state": {
+        "dtype": {"state": "category", **NEW_DONOR_COUNTERS},
+        "dates": ["date"],
+    },
+    "newdonors_facility": {
+        "dtype": {"hospital": "category", **NEW_DONOR_COUNTERS},
+        "dates": ["date"],
+    },
+    "ds_data_granular": {
+        "dtype": {"donor_id": "string", "birth_date": "Int16"},
+        "dates": ["visit_date"],
+        "dedup_keys": ["donor_id", "visit_date"],
+    },
+}
@@ -0,0 +1,115 @@
+"""module for fast, format aware date parsing"""
+
+import logging
+import os
+
+import pandas as pd
+
+
+class DateParser:
+    """
+    parses date columns with an explicit format detected once per column from a
+    sample, the detected formats are cached so later chunks of the same
+    dataset skip detection & pandas never falls back to element-wise parsing,
+    every distinct value is only parsed once
+    """
+
+    # NOTE: checked in order, day-first formats come before month-first ones
+    CANDIDATE_FORMATS = [
+        "%Y-%m-%d",
+        "%Y-%m-%d %H:%M:%S",
+        "%Y-%m-%dT%H:%M:%S",
+        "%Y/%m/%d",
+        "%d/%m/%Y",
+        "%d-%m-%Y",
+        "%m/%d/%Y",
+        "%Y%m%d",
+    ]
+    SAMPLE_SIZE = 1000
+    # NOTE: share of the sample a format has to parse, invalid values are expected
+    MIN_MATCH_RATE = 0.5
+
+    def __init__(self):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.formats: dict[str, str | None] = {}
+
+    def infer_format(self, values: pd.Series) -> str | None:
+        """
+        detects the format of a column of date strings from a random sample
+
+        Args:
+            values (pd.Series): column of date strings
+
+        Returns:
+            str | None: strftime format, None if no candidate format fits
+        """
+        sample = values.sample(
+            min(len(values), self.SAMPLE_SIZE), random_state=0
+        ).dropna()
+        if sample.empty:
+            return None
+
+        best_format, best_rate = None, 0.0
+        for date_format in self.CANDIDATE_FORMATS:
+            parsed = pd.to_datetime(sample, format=date_format, errors="coerce")
+            rate = parsed.notna().mean()
+            if rate > best_rate:
+                best_format, best_rate = date_format, rate
+            if rate == 1.0:
+                break
+        return best_format if best_rate >= self.MIN_MATCH_RATE else None
+
+    def parse(self, values: pd.Series, column: str) -> tuple[pd.Series, int]:
+        """
+        converts a column to datetime, invalid values become NaT
+
+        Args:
+            values (pd.Series): column to convert
+            column (str): name of the column, used as the format cache key
+
+        Returns:
+            tuple[pd.Series, int]: converted column & number of values coerced to NaT
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values, 0
+
+        if column not in self.formats:
+            self.formats[column] = self.infer_format(values)
+            self.logger.info(
+                f"detected date format of {column}: {self.formats[column]}"
+            )
+
+        n_null = int(values.isna().sum())
+        # NOTE: pandas only caches conversions when the head of the column is
+        # repetitive, parsing the distinct values once & mapping them back by
+        # code is much faster for columns with a few thousand distinct dates
+        codes, uniques = pd.factorize(values)
+        parsed_uniques = pd.DatetimeIndex(
+            pd.to_datetime(
+                pd.Series(uniques), format=self.formats[column], errors="coerce"
+            )
+        )
+        parsed = pd.Series(
+            parsed_uniques.take(codes, allow_fill=True, fill_value=pd.NaT),
+            index=values.index,
+            name=values.name,
+        )
+        n_coerced = int(parsed.isna().sum()) - n_null
+        if n_coerced:
+            self.logger.info(f"coerced {n_coerced} invalid values of {column} to NaT")
+        return parsed, n_coerced
+
+    @staticmethod
+    def is_future(values: pd.Series) -> pd.Series:
+        """
+        flags dates later than now using a single vectorised comparison, NaT is
+        not flagged, missing & invalid dates are dropped by the caller
+
+        Args:
+            values (pd.Series): datetime column
+
+        Returns:
+            pd.Series: boolean mask of future dates
+        """
+        now = pd.Timestamp.now(tz=values.dt.tz)
+        return values > now
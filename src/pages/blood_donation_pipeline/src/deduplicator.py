@@ -0,0 +1,69 @@
+"""module for hash based deduplication across the chunks of a streamed dataset"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class Deduplicator:
+    """
+    drops rows whose key was already seen, in the same dataframe or in a
+    previous chunk
+
+    every row is reduced to a 64-bit hash of its key columns, only the sorted
+    array of seen hashes is kept so memory grows by 8 bytes per distinct key
+    instead of with the width of the rows
+
+    NOTE: two different keys sharing a 64-bit hash would be treated as duplicates,
+    for the ~10M rows of ds_data_granular the chance is around 1 in 300 million
+
+    NOTE: the seen keys are not kept across runs, streamed datasets are fully
+    reloaded so every run must keep the first occurrence of every key again
+    """
+
+    def __init__(self, keys: list[str] = None):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.keys = keys
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def find_dupes(self, df: pd.DataFrame, keep: pd.Series = None) -> pd.Series:
+        """
+        finds rows whose key was already seen & remembers the keys of the others
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            keep (pd.Series): optional boolean mask, only these rows are
+                considered & remembered
+
+        Returns:
+            pd.Series: boolean mask of duplicate rows
+        """
+        columns = self.keys or list(df.columns)
+        # NOTE: categorize=False as keys such as donor_id are mostly distinct
+        hashes = pd.util.hash_pandas_object(
+            df[columns], index=False, categorize=False
+        ).to_numpy()
+        candidates = np.ones(len(df), dtype=bool) if keep is None else keep.to_numpy()
+
+        candidate_hashes = hashes[candidates]
+        is_dupe = pd.Series(candidate_hashes).duplicated().to_numpy()
+        if len(self.seen):
+            is_dupe = is_dupe | self._is_seen(candidate_hashes)
+        self.seen = np.sort(np.concatenate([self.seen, candidate_hashes[~is_dupe]]))
+
+        dupes = np.zeros(len(df), dtype=bool)
+        dupes[candidates] = is_dupe
+        return pd.Series(dupes, index=df.index)
+
+    def _is_seen(self, hashes: np.ndarray) -> np.ndarray:
+        """binary searches the hashes in the sorted seen array"""
+        # NOTE: probing in sorted order keeps the binary searches cache friendly
+        order = np.argsort(hashes)
+        sorted_hashes = hashes[order]
+        positions = np.searchsorted(self.seen, sorted_hashes)
+        positions[positions == len(self.seen)] = 0
+        is_seen = np.empty(len(hashes), dtype=bool)
+        is_seen[order] = self.seen[positions] == sorted_hashes
+        return is_seen
@@ -0,0 +1,59 @@
+"""module for deferring the bookkeeping of a run until its snapshot is published"""
+
+import logging
+import os
+import threading
+from typing import Callable
+
+
+class DeferredCommits:
+    """
+    queue of the calls recording what a run has loaded, eg. HttpCache.commit &
+    WatermarkStore.set, safe to share between the pipeline's ingest threads
+
+    the calls only run once the run's snapshot is published, a run failing
+    before that leaves the cache & watermarks as they were, so the next run
+    ingests the same data again instead of skipping what was never published
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.lock = threading.Lock()
+        self.pending: list[tuple[Callable, tuple]] = []
+
+    def add(self, func: Callable, *args) -> None:
+        """
+        queues a call until apply
+
+        Args:
+            func (Callable): function recording what was loaded
+            *args: arguments of the call
+        """
+        with self.lock:
+            self.pending.append((func, args))
+
+    def apply(self) -> int:
+        """
+        runs the queued calls in the order they were added
+
+        Returns:
+            int: number of calls run
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for func, args in pending:
+            func(*args)
+        self.logger.info(f"applied {len(pending)} deferred commits")
+        return len(pending)
+
+    def discard(self) -> int:
+        """
+        drops the queued calls without running them
+
+        Returns:
+            int: number of calls dropped
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        self.logger.info(f"discarded {len(pending)} deferred commits")
+        return len(pending)
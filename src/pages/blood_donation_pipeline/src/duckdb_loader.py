@@ -0,0 +1,135 @@
+"""module for loading raw files straight into duckdb without going through pandas"""
+
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterator
+import urllib.request
+
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+
+import duckdb
+
+SIGNED_INT_TYPES = ["TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT"]
+
+
+class DuckDBLoader:
+    """
+    loads a csv/parquet into a duckdb table using duckdb's parallel readers,
+    applying the same rules as DataFrameCleaner as sql expressions:
+
+    - CamelCase columns are renamed to snake_case
+    - negative integers are replaced with NULL
+    - date columns are cast to timestamps, rows with future, missing or invalid dates are dropped
+    - duplicate rows are dropped
+    """
+
+    def __init__(self, duckdb_conn: duckdb.DuckDBPyConnection):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.conn = duckdb_conn
+
+    def load(
+        self,
+        path_to_df: str,
+        name: str,
+        date_columns: list[str] = None,
+        content_type: str = None,
+    ) -> str:
+        """
+        creates or replaces the table `name` with the cleaned contents of the file
+
+        Args:
+            path_to_df (str): local path or url of the csv/parquet
+            name (str): name of the table to create
+            date_columns (list[str]): date columns to be validated
+            content_type (str): Content-Type of the file, if known
+
+        Returns:
+            str: name of the created table
+
+        Raises:
+            ValueError: If the file format is not supported
+        """
+        self.logger.info(f"loading {name} into duckdb")
+        date_columns = date_columns or []
+
+        with self._local_copy(path_to_df) as local_path:
+            with open(local_path, "rb") as f:
+                file_format = DataFrameManager.detect_format(
+                    f.read(DataFrameManager.SNIFF_SIZE), content_type, path_to_df
+                )
+            reader = self._reader(local_path, file_format)
+            columns = self.conn.execute(f"DESCRIBE SELECT * FROM {reader}").fetchall()
+
+            select_list = []
+            filters = []
+            for column, column_type, *_ in columns:
+                expression = self._clean_expression(column, column_type, date_columns)
+                select_list.append(expression)
+                if DataFrameCleaner.to_snake_case(column) in date_columns:
+                    # NOTE: NULL compares as unknown, so invalid dates are dropped too
+                    filters.append(
+                        f"TRY_CAST({quote(column)} AS TIMESTAMP)"
+                        " <= current_localtimestamp()"
+                    )
+
+            where = f"WHERE {' AND '.join(filters)}" if filters else ""
+            query = f"""
+            CREATE OR REPLACE TABLE {quote(name)} AS
+            SELECT DISTINCT {', '.join(select_list)}
+            FROM {reader}
+            {where};
+            """
+            self.conn.execute(query)
+        self.logger.info(f"loaded {name} into duckdb")
+        return name
+
+    @staticmethod
+    def _clean_expression(
+        column: str, column_type: str, date_columns: list[str]
+    ) -> str:
+        """builds the select expression applying the cleaning rules to a column"""
+        new_name = DataFrameCleaner.to_snake_case(column)
+        if new_name in date_columns:
+            return f"TRY_CAST({quote(column)} AS TIMESTAMP) AS {quote(new_name)}"
+        if column_type in SIGNED_INT_TYPES:
+            return (
+                f"CASE WHEN {quote(column)} < 0 THEN NULL ELSE {quote(column)} END"
+                f" AS {quote(new_name)}"
+            )
+        return f"{quote(column)} AS {quote(new_name)}"
+
+    @staticmethod
+    def _reader(local_path: str, file_format: str) -> str:
+        path = local_path.replace("'", "''")
+        if file_format == "parquet":
+            return f"read_parquet('{path}')"
+        compression = "gzip" if file_format == "csv_gzip" else "none"
+        return f"read_csv('{path}', auto_detect = true, compression = '{compression}')"
+
+    @contextmanager
+    def _local_copy(self, path_to_df: str) -> Iterator[str]:
+        """
+        yields a local path of the file, urls are downloaded once into a
+        temporary file that is removed afterwards
+        """
+        if not path_to_df.startswith(("http://", "https://")):
+            yield path_to_df
+            return
+
+        self.logger.info(f"downloading {path_to_df}")
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            with urllib.request.urlopen(path_to_df) as response:
+                shutil.copyfileobj(response, tmp)
+        try:
+            yield tmp.name
+        finally:
+            os.remove(tmp.name)
+
+
+def quote(identifier: str) -> str:
+    """quotes a duckdb identifier, eg. the 17-24 age group column"""
+    return '"' + identifier.replace('"', '""') + '"'
@@ -1,281 +1,184 @@
-granular_average_months_between_donations_query = """
-WITH next_visit AS (
+from src.pages.blood_donation_pipeline.src.dataframe_schemas import (
+    DONATION_COUNTERS,
+    NEW_DONOR_COUNTERS,
+)
+
+# NOTE: (code, label, lowest age) of every age band, 80+ includes 80 in every datamart,
+# the donations by age group datamart still only counts visits up to the age of 80
+AGE_BANDS = [
+    (1, "<20", None),
+    (2, "20-29", 20),
+    (3, "30-39", 30),
+    (4, "40-49", 40),
+    (5, "50-59", 50),
+    (6, "60-69", 60),
+    (7, "70-79", 70),
+    (8, "80+", 80),
+]
+
+AGE_BAND_CODE = "\n".join(
+    ["CASE"]
+    + [
+        f"            WHEN age_on_visit < {AGE_BANDS[i + 1][2]} THEN {code}"
+        for i, (code, _, _) in enumerate(AGE_BANDS[:-1])
+    ]
+    + [f"            WHEN age_on_visit >= {AGE_BANDS[-1][2]} THEN {AGE_BANDS[-1][0]}"]
+    + ["        END"]
+)
+
+
+def age_band_label(code_column: str) -> str:
+    """CASE mapping an age band code column to its label"""
+    whens = "\n".join(
+        f"            WHEN {code} THEN '{label}'" for code, label, _ in AGE_BANDS
+    )
+    return f"CASE {code_column}\n{whens}\n        END"
+
+
+# NOTE: ds_data_granular is scanned & window sorted once here, every datamart below
+# reads this table instead of recomputing ages, age bands & the next visit itself,
+# visits without a date are left out as NULL sorts first & would be a donor's first visit
+granular_visits_enriched_select = f"""
+WITH visits AS (
     SELECT
-        birth_date,
+        donor_id,
+        visit_date AS visit_timestamp,
         DATE(visit_date) AS visit_date,
-        LEAD(DATE(visit_date)) OVER(PARTITION BY donor_id ORDER BY visit_date) AS next_visit_date
+        EXTRACT(YEAR FROM visit_date) - birth_date AS age_on_visit
     FROM
         blood_donation_pipeline_v2.ds_data_granular
+    WHERE
+        visit_date IS NOT NULL
 ),
 
-age_and_days AS (
+age_bands AS (
     SELECT
-        DATE_DIFF(visit_date, next_visit_date, DAY) AS days_between_visit,
-        EXTRACT(YEAR FROM visit_date) - birth_date AS age_on_visit
-    FROM    
-        next_visit
+        *,
+        {AGE_BAND_CODE} AS age_band_code
+    FROM
+        visits
 ),
 
-age_groups AS (
+donor_visits AS (
     SELECT
-        *,
-        CASE
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_visit >= 80 THEN '80+'
-        END AS age_group,
-        CASE
-            WHEN age_on_visit < 20 THEN 1
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN 2
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN 3
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN 4
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN 5
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN 6
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN 7
-            WHEN age_on_visit >= 80 THEN 8
-        END AS age_group_order
+        donor_id,
+        visit_date,
+        LEAD(visit_date) OVER donor_window AS next_visit_date,
+        ROW_NUMBER() OVER donor_window AS visit_seq,
+        FIRST_VALUE(visit_date) OVER donor_window AS first_visit_date,
+        FIRST_VALUE(age_band_code) OVER donor_window AS first_age_band_code,
+        age_on_visit,
+        age_band_code
     FROM
-        age_and_days
-    WHERE
-        CASE
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_visit >= 80 THEN '80+'
-        END IS NOT NULL
+        age_bands
+    WINDOW
+        donor_window AS (PARTITION BY donor_id ORDER BY visit_timestamp)
 )
 
+SELECT
+    donor_id,
+    visit_date,
+    next_visit_date,
+    DATE_DIFF(next_visit_date, visit_date, DAY) AS gap_days,
+    visit_seq,
+    first_visit_date,
+    age_on_visit,
+    age_band_code,
+    {age_band_label("age_band_code")} AS age_band_label,
+    first_age_band_code,
+    {age_band_label("first_age_band_code")} AS first_age_band_label
+FROM
+    donor_visits
+"""
+
+granular_visits_enriched_query = f"""
+CREATE OR REPLACE TABLE blood_donation_pipeline_v2.granular_visits_enriched AS
+{granular_visits_enriched_select};
+"""
 
+# NOTE: CEIL(AVG(gap_days) / 30) equals the former ABS(FLOOR(AVG(visit - next) / 30))
+granular_average_months_between_donations_query = """
 SELECT
-    age_group,
-    ABS(FLOOR(AVG(days_between_visit) / 30)) AS average_months_between_visits
+    age_band_label AS age_group,
+    CEIL(AVG(gap_days) / 30) AS average_months_between_visits
 FROM
-    age_groups
+    blood_donation_pipeline_v2.granular_visits_enriched
 WHERE
-    age_group IS NOT NULL
+    age_band_code >= 2
 GROUP BY
-    age_group,
-    age_group_order
+    age_band_label,
+    age_band_code
 ORDER BY
-    age_group_order;
+    age_band_code;
 """
 
 
 granular_average_months_before_churn_query_v2 = """
-WITH next_visit AS (
+WITH rolling_sum_of_total_visits AS (
     SELECT
-        donor_id,
-        birth_date,
-        DATE(visit_date) AS visit_date,
-        LEAD(DATE(visit_date)) OVER(PARTITION BY donor_id ORDER BY visit_date) AS next_visit_date
-    FROM
-        blood_donation_pipeline_v2.ds_data_granular
-),
-
-age_and_days AS (
-    SELECT
-        donor_id,
+        age_band_code,
+        age_band_label,
         visit_date,
-        next_visit_date,
-        ABS(DATE_DIFF(visit_date, next_visit_date, DAY)) AS days_between_visit,
-        EXTRACT(YEAR FROM visit_date) - birth_date AS age_on_visit
-    FROM    
-        next_visit
-),
-
-age_groups AS (
-    SELECT
-        *,
-        CASE
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_visit > 80 THEN '80+'
-        END AS age_group,
-        CASE
-            WHEN age_on_visit < 20 THEN 1
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN 2
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN 3
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN 4
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN 5
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN 6
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN 7
-            WHEN age_on_visit > 80 THEN 8
-        END AS age_group_order
-    FROM
-        age_and_days
-    WHERE
-        CASE
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_visit > 80 THEN '80+'
-        END IS NOT NULL
-),
-
-rolling_sum_of_total_visits AS (
-    SELECT
-        *,
-        SUM(days_between_visit) OVER(PARTITION BY donor_id ORDER BY visit_date) AS rolling_total_days_between_visit
-    FROM
-        age_groups
-),
-
-days_before_churn AS (
-    SELECT
-        *,
-        DATE_DIFF(DATE(CONCAT(EXTRACT(YEAR FROM visit_date) + 2, '-12-31')), visit_date, DAY) AS days_before_next_churn
-    FROM
-        rolling_sum_of_total_visits
-),
-
-churns AS (
-    SELECT
-        *,
-        IF(days_between_visit > days_before_next_churn, 1, 0) AS is_churn
+        gap_days,
+        SUM(gap_days) OVER(PARTITION BY donor_id ORDER BY visit_date) AS rolling_total_days_between_visit
     FROM
-        days_before_churn
+        blood_donation_pipeline_v2.granular_visits_enriched
     WHERE
-        IF(days_between_visit > days_before_next_churn, 1, 0) = 1
+        age_band_code >= 2
 )
 
 
 SELECT
-    age_group,
+    age_band_label AS age_group,
     FLOOR(AVG(rolling_total_days_between_visit / 30)) AS average_months_to_churn
 FROM
-    churns
+    rolling_sum_of_total_visits
+WHERE
+    gap_days > DATE_DIFF(DATE(EXTRACT(YEAR FROM visit_date) + 2, 12, 31), visit_date, DAY)
 GROUP BY
-    age_group,
-    age_group_order
+    age_band_label,
+    age_band_code
 ORDER BY
-    age_group_order;
+    age_band_code;
 """
 
 granular_average_donations_by_age_group_query = """
-WITH age AS (
-    SELECT
-        donor_id,
-        visit_date,
-        EXTRACT(YEAR FROM visit_date) - birth_date AS age_on_visit
-    FROM
-        blood_donation_pipeline_v2.ds_data_granular
-),
-
-age_groups AS (
-    SELECT
-        *,
-        CASE
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_visit > 80 THEN '80+'
-        END AS age_group,
-        CASE
-            WHEN age_on_visit < 20 THEN 1
-            WHEN age_on_visit BETWEEN 20 AND 29 THEN 2
-            WHEN age_on_visit BETWEEN 30 AND 39 THEN 3
-            WHEN age_on_visit BETWEEN 40 AND 49 THEN 4
-            WHEN age_on_visit BETWEEN 50 AND 59 THEN 5
-            WHEN age_on_visit BETWEEN 60 AND 69 THEN 6
-            WHEN age_on_visit BETWEEN 70 AND 79 THEN 7
-            WHEN age_on_visit > 80 THEN 8
-        END AS age_group_order
-    FROM
-        age
-    WHERE
-        age_on_visit >= 20 AND age_on_visit <= 80
-),
-
-n_donations_by_age_group_and_donor AS (
+WITH n_donations_by_age_group_and_donor AS (
     SELECT
         donor_id,
-        age_group,
-        age_group_order,
+        age_band_code,
+        age_band_label,
         COUNT(*) AS n_donations
     FROM
-        age_groups
+        blood_donation_pipeline_v2.granular_visits_enriched
+    WHERE
+        age_band_code >= 2 AND age_on_visit <= 80
     GROUP BY
         donor_id,
-        age_group,
-        age_group_order
+        age_band_code,
+        age_band_label
 )
 
 SELECT
-    age_group,
+    age_band_label AS age_group,
     ROUND(AVG(n_donations), 2) AS avg_donations
 FROM
     n_donations_by_age_group_and_donor
 GROUP BY
-    age_group,
-    age_group_order
+    age_band_label,
+    age_band_code
 ORDER BY
-    age_group_order;
+    age_band_code;
 """
 granular_cohorts_query = """
-WITH first_year_donation AS (
+WITH cohorts AS (
     SELECT
-        donor_id,
-        EXTRACT(YEAR FROM MIN(visit_date)) AS first_donation_year,
-        EXTRACT(YEAR FROM MIN(visit_date)) - birth_date AS age_on_first_donation
-    FROM
-        blood_donation_pipeline_v2.ds_data_granular
-    GROUP BY
-        donor_id,
-        birth_date
-),
-age_group_assignment AS (
-    SELECT
-        donor_id,
-        first_donation_year,
-        CASE
-            WHEN age_on_first_donation < 20 THEN '<20'
-            WHEN age_on_first_donation BETWEEN 20 AND 29 THEN '20-29'
-            WHEN age_on_first_donation BETWEEN 30 AND 39 THEN '30-39'
-            WHEN age_on_first_donation BETWEEN 40 AND 49 THEN '40-49'
-            WHEN age_on_first_donation BETWEEN 50 AND 59 THEN '50-59'
-            WHEN age_on_first_donation BETWEEN 60 AND 69 THEN '60-69'
-            WHEN age_on_first_donation BETWEEN 70 AND 79 THEN '70-79'
-            WHEN age_on_first_donation >= 80 THEN '80+'
-        END AS age_group
-    FROM
-        first_year_donation
-),
-yearly_donations AS (
-    SELECT
-        aga.donor_id,
-        aga.first_donation_year,
-        aga.age_group,
-        EXTRACT(YEAR FROM ds.visit_date) AS donation_year
-    FROM
-        blood_donation_pipeline_v2.ds_data_granular ds
-    JOIN
-        age_group_assignment aga ON ds.donor_id = aga.donor_id
-),
-cohorts AS (
-    SELECT
-        first_donation_year,
-        donation_year,
-        age_group,
+        EXTRACT(YEAR FROM first_visit_date) AS first_donation_year,
+        EXTRACT(YEAR FROM visit_date) AS donation_year,
+        first_age_band_label AS age_group,
         COUNT(DISTINCT donor_id) AS n_donors
     FROM
-        yearly_donations
+        blood_donation_pipeline_v2.granular_visits_enriched
     GROUP BY
         first_donation_year,
         donation_year,
@@ -283,11 +186,13 @@ cohorts AS (
 ),
 initial_cohort_size AS (
     SELECT
-        first_donation_year,
-        age_group,
-        COUNT(DISTINCT donor_id) AS initial_donors
+        EXTRACT(YEAR FROM first_visit_date) AS first_donation_year,
+        first_age_band_label AS age_group,
+        COUNT(*) AS initial_donors
     FROM
-        age_group_assignment
+        blood_donation_pipeline_v2.granular_visits_enriched
+    WHERE
+        visit_seq = 1
     GROUP BY
         first_donation_year,
         age_group
@@ -330,6 +235,88 @@ SELECT
 FROM
     retention_by_nth_year
 """
+# NOTE: grain > bigquery date part, every period is labelled by its first day
+ROLLUP_GRAINS = {"year": "YEAR", "month": "MONTH", "week": "ISOWEEK"}
+
+
+def rollup_query(table: str, key: str, counters: list[str]) -> str:
+    """
+    sums the daily counters of a table per key & period at every grain of ROLLUP_GRAINS
+
+    Args:
+        table (str): table with a row per date & key, eg. donations_state
+        key (str): column identifying the entity, eg. state
+        counters (list[str]): columns to sum
+
+    Returns:
+        str: bigquery sql with a grain, period & key column followed by the sums
+    """
+    # NOTE: duckdb sums integers into HUGEINT, bigquery into INT64
+    sums = ",\n    ".join(
+        f"CAST(SUM(`{column}`) AS INT64) AS `{column}`" for column in counters
+    )
+    selects = [f"""
+SELECT
+    '{grain}' AS grain,
+    DATE_TRUNC(DATE(date), {part}) AS period,
+    {key},
+    {sums}
+FROM
+    blood_donation_pipeline_v2.{table}
+WHERE
+    date IS NOT NULL
+GROUP BY
+    period,
+    {key}
+""" for grain, part in ROLLUP_GRAINS.items()]
+    return "UNION ALL".join(selects) + f"ORDER BY\n    grain,\n    {key},\n    period\n"
+
+
+donations_state_rollup_query = rollup_query(
+    "donations_state", "state", list(DONATION_COUNTERS)
+)
+donations_facility_rollup_query = rollup_query(
+    "donations_facility", "hospital", list(DONATION_COUNTERS)
+)
+newdonors_state_rollup_query = rollup_query(
+    "newdonors_state", "state", list(NEW_DONOR_COUNTERS)
+)
+newdonors_facility_rollup_query = rollup_query(
+    "newdonors_facility", "hospital", list(NEW_DONOR_COUNTERS)
+)
+
+# NOTE: built from the granular datamarts above once they are written, so the dashboard
+# reads every age band in one query instead of a query per datamart & selection
+granular_age_group_metrics_query = """
+SELECT
+    age_group,
+    b.average_months_between_visits,
+    c.average_months_to_churn,
+    d.avg_donations
+FROM
+    blood_donation_pipeline_v2.granular_average_months_between_donations_query b
+FULL OUTER JOIN
+    blood_donation_pipeline_v2.granular_average_months_before_churn_query_v2 c
+    USING (age_group)
+FULL OUTER JOIN
+    blood_donation_pipeline_v2.granular_average_donations_by_age_group_query d
+    USING (age_group)
+ORDER BY
+    age_group
+"""
+
+granular_retention_curve_query = """
+SELECT
+    age_group,
+    nth_year,
+    average_retention_rate
+FROM
+    blood_donation_pipeline_v2.granular_cohorts_query
+ORDER BY
+    age_group,
+    nth_year
+"""
+
 # granular_cohorts_query = """
 # WITH first_year_donation AS (
 #     SELECT
@@ -0,0 +1,107 @@
+"""module for caching downloaded files using conditional http requests"""
+
+import hashlib
+import json
+import logging
+import os
+from urllib.error import HTTPError
+import urllib.request
+
+
+class HttpCache:
+    """
+    persistent download cache, every url is stored as a body file & a json entry
+    containing its ETag, Last-Modified & sha256 content hash
+
+    a url is considered changed until the pipeline commits its current hash,
+    so a failed clean/upload is retried on the next run even if the
+    upstream file did not change
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    TIMEOUT = 60
+
+    def __init__(self, cache_folder: str):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def fetch(self, url: str) -> dict:
+        """
+        downloads the url into the cache, sending If-None-Match/If-Modified-Since
+        when the url has been downloaded before
+
+        Args:
+            url (str): url of the file to download
+
+        Returns:
+            dict: cache entry, body_path points to the local copy of the file &
+            changed is False when the content matches the last committed hash
+        """
+        entry = self._load_entry(url)
+        request = urllib.request.Request(url)
+        if entry and os.path.exists(entry["body_path"]):
+            if entry.get("etag"):
+                request.add_header("If-None-Match", entry["etag"])
+            if entry.get("last_modified"):
+                request.add_header("If-Modified-Since", entry["last_modified"])
+        else:
+            entry = {"url": url, "body_path": self._path(url, "body")}
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.TIMEOUT) as response:
+                self.logger.info(f"downloading {url} into the http cache")
+                entry["sha256"] = self._download(response, entry["body_path"])
+                entry["etag"] = response.headers.get("ETag")
+                entry["last_modified"] = response.headers.get("Last-Modified")
+                entry["content_type"] = response.headers.get("Content-Type")
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            self.logger.info(f"{url} not modified, using cached copy")
+
+        self._save_entry(url, entry)
+        entry["changed"] = entry["sha256"] != entry.get("committed_sha256")
+        return entry
+
+    def commit(self, url: str) -> None:
+        """
+        marks the currently cached content of the url as processed
+
+        Args:
+            url (str): url that was cleaned & uploaded successfully
+        """
+        entry = self._load_entry(url)
+        if entry is None:
+            return
+        entry["committed_sha256"] = entry["sha256"]
+        self._save_entry(url, entry)
+
+    def _download(self, response, body_path: str) -> str:
+        """streams the response body into body_path & returns its sha256"""
+        sha256 = hashlib.sha256()
+        tmp_path = f"{body_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            while chunk := response.read(self.CHUNK_SIZE):
+                sha256.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, body_path)
+        return sha256.hexdigest()
+
+    def _path(self, url: str, extension: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_folder, f"{key}.{extension}")
+
+    def _load_entry(self, url: str) -> dict | None:
+        entry_path = self._path(url, "json")
+        if not os.path.exists(entry_path):
+            return None
+        with open(entry_path) as f:
+            return json.load(f)
+
+    def _save_entry(self, url: str, entry: dict) -> None:
+        entry_path = self._path(url, "json")
+        tmp_path = f"{entry_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({k: v for k, v in entry.items() if k != "changed"}, f)
+        os.replace(tmp_path, entry_path)
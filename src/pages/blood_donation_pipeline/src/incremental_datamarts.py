@@ -0,0 +1,301 @@
+"""module for maintaining the cohort & churn datamarts incrementally in duckdb"""
+
+import logging
+import os
+import re
+
+from src.pages.blood_donation_pipeline.src.sql_dialect import (
+    apply_bigquery_settings,
+    bigquery_to_duckdb,
+)
+import src.pages.blood_donation_pipeline.src.gbq_queries as gbqq
+
+import duckdb
+import pandas as pd
+
+ENRICHED_TABLE = "granular_visits_enriched"
+# NOTE: the datamarts kept by IncrementalDatamarts, named like the tables of pipeline.main
+COHORTS_TABLE = "granular_cohorts_query"
+CHURN_TABLE = "granular_average_months_before_churn_query_v2"
+
+
+class IncrementalDatamarts:
+    """
+    keeps the cohort & churn datamarts up to date from per-donor state, so a
+    refresh only recomputes the donors with new visits instead of every
+    donor's whole history
+
+    - granular_visits_enriched: the rows of touched donors are replaced
+    - donor_state: first donation year & age group, last visit, total gap days
+      & number of churns of every donor
+    - donor_cohort_years: every year a donor donated in, with their cohort
+    - donor_churns: rolling gap days & number of churns per donor & age band
+    - cohort_sizes & churn_totals: sums of the two tables above per cohort &
+      per age band, updated with the difference between the old & new rows of
+      the touched donors
+
+    the datamarts are then re-aggregated from cohort_sizes & churn_totals,
+    which only have a row per cohort year & age band
+    """
+
+    STATE_TABLES = [
+        "donor_state",
+        "donor_cohort_years",
+        "donor_churns",
+        "cohort_sizes",
+        "churn_totals",
+    ]
+
+    def __init__(self, duckdb_conn: duckdb.DuckDBPyConnection, dataset: str):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.conn = duckdb_conn
+        self.dataset = dataset
+
+    def refresh(self, since: pd.Timestamp = None) -> int:
+        """
+        updates the state of the donors with visits after `since` & rewrites
+        the cohort & churn datamarts
+
+        Args:
+            since (pd.Timestamp): visits after this date are new, None rebuilds
+                the state of every donor
+
+        Returns:
+            int: number of donors recomputed
+        """
+        apply_bigquery_settings(self.conn)
+        rebuild = since is None or not self.has_state()
+        if rebuild:
+            self.logger.info("rebuilding the state of every donor")
+            self.conn.execute("""
+            CREATE OR REPLACE TEMP TABLE touched_donors AS
+            SELECT DISTINCT donor_id FROM ds_data_granular;
+            """)
+            self._create_state_tables()
+        else:
+            self.conn.execute(
+                """
+                CREATE OR REPLACE TEMP TABLE touched_donors AS
+                SELECT DISTINCT donor_id FROM ds_data_granular WHERE visit_date > ?;
+                """,
+                [since],
+            )
+        query = "SELECT COUNT(*) FROM touched_donors"
+        (n_donors,) = self.conn.execute(query).fetchone()
+        self.logger.info(f"refreshing the datamarts of {n_donors} donors")
+
+        self._refresh_enriched(rebuild)
+        self._refresh_donors()
+        self._write_datamarts()
+        return n_donors
+
+    def has_state(self) -> bool:
+        """whether every state table exists, ie. a refresh can be incremental"""
+        query = "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name IN ?"
+        (n_tables,) = self.conn.execute(
+            query, [self.STATE_TABLES + [ENRICHED_TABLE]]
+        ).fetchone()
+        return n_tables == len(self.STATE_TABLES) + 1
+
+    def _refresh_enriched(self, rebuild: bool) -> None:
+        """replaces the enriched visits of the touched donors"""
+        if rebuild:
+            self.conn.execute(
+                bigquery_to_duckdb(gbqq.granular_visits_enriched_query, self.dataset)
+            )
+            return
+
+        # NOTE: the enrichment windows are per donor, so the touched donors' visits are enough
+        self.conn.execute("""
+        CREATE OR REPLACE TEMP VIEW touched_visits AS
+        SELECT * FROM ds_data_granular
+        WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+        """)
+        select = re.sub(
+            r"\bds_data_granular\b",
+            "touched_visits",
+            bigquery_to_duckdb(gbqq.granular_visits_enriched_select, self.dataset),
+        )
+        self.conn.execute(f"""
+        DELETE FROM {ENRICHED_TABLE}
+        WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+        INSERT INTO {ENRICHED_TABLE} {select};
+        """)
+
+    def _create_state_tables(self) -> None:
+        self.conn.execute("""
+        CREATE OR REPLACE TABLE donor_state (
+            donor_id VARCHAR PRIMARY KEY,
+            first_donation_year BIGINT,
+            first_age_group VARCHAR,
+            last_visit_date DATE,
+            total_gap_days BIGINT,
+            n_churns BIGINT,
+            churned BOOLEAN
+        );
+        CREATE OR REPLACE TABLE donor_cohort_years (
+            donor_id VARCHAR,
+            first_donation_year BIGINT,
+            age_group VARCHAR,
+            donation_year BIGINT
+        );
+        CREATE OR REPLACE TABLE donor_churns (
+            donor_id VARCHAR,
+            age_band_code INTEGER,
+            age_group VARCHAR,
+            rolling_days BIGINT,
+            n_churns BIGINT
+        );
+        CREATE OR REPLACE TABLE cohort_sizes (
+            first_donation_year BIGINT,
+            donation_year BIGINT,
+            age_group VARCHAR,
+            n_donors BIGINT,
+            PRIMARY KEY (first_donation_year, donation_year, age_group)
+        );
+        CREATE OR REPLACE TABLE churn_totals (
+            age_band_code INTEGER PRIMARY KEY,
+            age_group VARCHAR,
+            rolling_days BIGINT,
+            n_churns BIGINT
+        );
+        """)
+
+    def _refresh_donors(self) -> None:
+        """recomputes the per-donor tables of the touched donors & applies the difference"""
+        self.conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE touched_enriched AS
+        SELECT * FROM {ENRICHED_TABLE}
+        WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+
+        -- NOTE: visits or cohorts without a date or age group never reach the datamarts
+        CREATE OR REPLACE TEMP TABLE new_cohort_years AS
+        SELECT DISTINCT
+            donor_id,
+            EXTRACT(YEAR FROM first_visit_date) AS first_donation_year,
+            first_age_band_label AS age_group,
+            EXTRACT(YEAR FROM visit_date) AS donation_year
+        FROM touched_enriched
+        WHERE first_visit_date IS NOT NULL
+            AND visit_date IS NOT NULL
+            AND first_age_band_label IS NOT NULL;
+
+        -- NOTE: the rolling totals & churn rule of granular_average_months_before_churn_query_v2
+        CREATE OR REPLACE TEMP TABLE new_churns AS
+        WITH rolling_sum_of_total_visits AS (
+            SELECT
+                donor_id,
+                age_band_code,
+                age_band_label,
+                visit_date,
+                gap_days,
+                SUM(gap_days) OVER (PARTITION BY donor_id ORDER BY visit_date) AS rolling_days
+            FROM touched_enriched
+            WHERE age_band_code >= 2
+        )
+        SELECT
+            donor_id,
+            age_band_code,
+            ANY_VALUE(age_band_label) AS age_group,
+            SUM(rolling_days) AS rolling_days,
+            COUNT(*) AS n_churns
+        FROM rolling_sum_of_total_visits
+        WHERE gap_days > date_diff(
+            'day', visit_date, make_date(EXTRACT(YEAR FROM visit_date) + 2, 12, 31)
+        )
+        GROUP BY donor_id, age_band_code;
+
+        CREATE OR REPLACE TEMP TABLE cohort_delta AS
+        SELECT first_donation_year, donation_year, age_group, SUM(n) AS n_donors
+        FROM (
+            SELECT first_donation_year, donation_year, age_group, -1 AS n
+            FROM donor_cohort_years
+            WHERE donor_id IN (SELECT donor_id FROM touched_donors)
+            UNION ALL
+            SELECT first_donation_year, donation_year, age_group, 1 AS n
+            FROM new_cohort_years
+        )
+        GROUP BY first_donation_year, donation_year, age_group
+        HAVING SUM(n) <> 0;
+
+        CREATE OR REPLACE TEMP TABLE churn_delta AS
+        SELECT
+            age_band_code,
+            ANY_VALUE(age_group) AS age_group,
+            SUM(rolling_days) AS rolling_days,
+            SUM(n_churns) AS n_churns
+        FROM (
+            SELECT age_band_code, age_group, -rolling_days AS rolling_days, -n_churns AS n_churns
+            FROM donor_churns
+            WHERE donor_id IN (SELECT donor_id FROM touched_donors)
+            UNION ALL
+            SELECT age_band_code, age_group, rolling_days, n_churns
+            FROM new_churns
+        )
+        GROUP BY age_band_code;
+
+        INSERT INTO cohort_sizes SELECT * FROM cohort_delta
+        ON CONFLICT (first_donation_year, donation_year, age_group)
+        DO UPDATE SET n_donors = n_donors + EXCLUDED.n_donors;
+        DELETE FROM cohort_sizes WHERE n_donors = 0;
+
+        INSERT INTO churn_totals SELECT * FROM churn_delta
+        ON CONFLICT (age_band_code) DO UPDATE SET
+            rolling_days = rolling_days + EXCLUDED.rolling_days,
+            n_churns = n_churns + EXCLUDED.n_churns;
+        DELETE FROM churn_totals WHERE n_churns = 0;
+
+        DELETE FROM donor_cohort_years WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+        INSERT INTO donor_cohort_years SELECT * FROM new_cohort_years;
+        DELETE FROM donor_churns WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+        INSERT INTO donor_churns SELECT * FROM new_churns;
+
+        DELETE FROM donor_state WHERE donor_id IN (SELECT donor_id FROM touched_donors);
+        INSERT INTO donor_state
+        SELECT
+            e.donor_id,
+            EXTRACT(YEAR FROM ANY_VALUE(e.first_visit_date)) AS first_donation_year,
+            ANY_VALUE(e.first_age_band_label) AS first_age_group,
+            MAX(e.visit_date) AS last_visit_date,
+            COALESCE(SUM(e.gap_days), 0) AS total_gap_days,
+            COALESCE(ANY_VALUE(c.n_churns), 0) AS n_churns,
+            COALESCE(ANY_VALUE(c.n_churns), 0) > 0 AS churned
+        FROM touched_enriched e
+        LEFT JOIN (
+            SELECT donor_id, SUM(n_churns) AS n_churns FROM new_churns GROUP BY donor_id
+        ) c ON c.donor_id = e.donor_id
+        GROUP BY e.donor_id;
+        """)
+
+    def _write_datamarts(self) -> None:
+        """re-aggregates the cohort & churn datamarts from the per cohort & age band sums"""
+        self.conn.execute(f"""
+        CREATE OR REPLACE TABLE {COHORTS_TABLE} AS
+        WITH cohort_retention AS (
+            SELECT
+                c.age_group,
+                c.donation_year - c.first_donation_year + 1 AS nth_year,
+                ROUND((c.n_donors / CAST(i.n_donors AS DOUBLE)) * 100, 2) AS retention_rate
+            FROM cohort_sizes c
+            JOIN cohort_sizes i
+                ON i.first_donation_year = c.first_donation_year
+                AND i.age_group = c.age_group
+                AND i.donation_year = i.first_donation_year
+            WHERE c.donation_year >= c.first_donation_year
+        )
+        SELECT
+            age_group,
+            nth_year,
+            ROUND(AVG(retention_rate), 2) AS average_retention_rate
+        FROM cohort_retention
+        WHERE nth_year <= 10
+        GROUP BY age_group, nth_year
+        ORDER BY age_group, nth_year;
+
+        CREATE OR REPLACE TABLE {CHURN_TABLE} AS
+        SELECT
+            age_group,
+            FLOOR(rolling_days / (30 * n_churns)) AS average_months_to_churn
+        FROM churn_totals
+        ORDER BY age_band_code;
+        """)
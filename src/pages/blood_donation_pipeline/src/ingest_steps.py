@@ -0,0 +1,105 @@
+"""module for the steps of ingesting a dataset shared by pipeline.py & its tests"""
+
+import logging
+import os
+
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+from src.pages.blood_donation_pipeline.src.deferred_commits import DeferredCommits
+from src.pages.blood_donation_pipeline.src.parallel_cleaner import ParallelCleaner
+from src.pages.blood_donation_pipeline.src.uploaders import Uploader
+from src.pages.blood_donation_pipeline.src.watermark_store import (
+    WatermarkStore,
+    rows_after,
+)
+
+import duckdb
+import pandas as pd
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def has_table(duckdb_conn: duckdb.DuckDBPyConnection, table: str) -> bool:
+    """whether the duckdb database has a table named table"""
+    query = "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?"
+    return duckdb_conn.execute(query, [table]).fetchone()[0] > 0
+
+
+def is_up_to_date(
+    df_manager: DataFrameManager,
+    local_conn: duckdb.DuckDBPyConnection = None,
+    full_refresh: bool = False,
+) -> bool:
+    """
+    whether ingesting a dataset can be skipped, its source has not changed
+    since the last published run & no full refresh is asked for
+
+    NOTE: the datamart backend is chosen per run, a run computing the datamarts
+    locally also needs the local copy a previous bigquery run never made
+
+    Args:
+        df_manager (DataFrameManager): manager of the (cached) source file
+        local_conn (duckdb.DuckDBPyConnection): database the datamarts are
+            computed in, None when they are computed in bigquery
+        full_refresh (bool): whether every table is rebuilt regardless of cache
+
+    Returns:
+        bool: whether the dataset can be skipped
+    """
+    if df_manager.changed or full_refresh:
+        return False
+    if local_conn is not None and not has_table(local_conn, df_manager.name):
+        logger.info(f"{df_manager.name} has no local copy, reloading it")
+        return False
+    return True
+
+
+def refresh_incremental(
+    df: pd.DataFrame,
+    df_name: str,
+    date_column: str,
+    df_cleaner: DataFrameCleaner | ParallelCleaner,
+    uploaders: list[Uploader],
+    watermarks: WatermarkStore,
+    commits: DeferredCommits,
+    lookback_days: int,
+    date_columns: list[str],
+) -> int:
+    """
+    appends the rows newer than the high-water mark minus the lookback window,
+    rows inside the lookback window are deleted first so corrections replace
+    them, the high-water mark only advances once the run is published
+
+    Args:
+        df (pd.DataFrame): pandas dataframe of the whole source file
+        df_name (str): name of the dataset & of its tables
+        date_column (str): date column used as the high-water mark
+        df_cleaner (DataFrameCleaner | ParallelCleaner): cleaner used for the new rows
+        uploaders (list[Uploader]): uploaders of the tables, eg. the warehouse &
+            the local copy, the first one stages the rows for all of them
+        watermarks (WatermarkStore): high-water marks of the tables
+        commits (DeferredCommits): commits applied once the run is published
+        lookback_days (int): days before the high-water mark that are reloaded
+        date_columns (list[str]): date columns validated by the cleaner
+
+    Returns:
+        int: number of rows appended
+
+    Raises:
+        Exception: the error of the first failed load or delete
+    """
+    cutoff = watermarks.get(df_name) - pd.Timedelta(days=lookback_days)
+    logger.info(f"incrementally refreshing {df_name} from {cutoff}")
+
+    cleaned_df = df_cleaner.clean_dataframe(
+        rows_after(df, date_column, cutoff), date_columns
+    )
+    for uploader in uploaders:
+        uploader.delete_since(df_name, date_column, cutoff)
+    path = uploaders[0].stage(cleaned_df, df_name)
+    for uploader in uploaders:
+        uploader.load_file(path, df_name, "append")
+    for uploader in uploaders:
+        uploader.wait(df_name)
+    commits.add(watermarks.advance, df_name, cleaned_df[date_column].max())
+    return len(cleaned_df)
@@ -0,0 +1,162 @@
+"""module for cleaning dataframes on a pool of processes"""
+
+from concurrent.futures import Executor
+import logging
+import math
+import os
+
+from src.pages.blood_donation_pipeline.src.column_profiler import ColumnProfiler
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import (
+    CLEANING_STEPS,
+    DataFrameCleaner,
+)
+
+import pandas as pd
+import pyarrow as pa
+
+
+class ParallelCleaner:
+    """
+    runs the row local steps of a DataFrameCleaner on row partitions in a
+    process pool, the remaining steps (eg. drop_dupes) run in the calling
+    process on the concatenated partitions so the result is identical to
+    DataFrameCleaner.clean_dataframe
+
+    the pool is meant to be shared by every dataset being ingested, so small
+    datasets are cleaned in parallel with each other & large datasets are
+    additionally split into partitions of `partition_rows` rows
+
+    partitions are sent to & from the workers as arrow ipc streams instead of
+    pickled dataframes
+    """
+
+    def __init__(
+        self,
+        cleaner: DataFrameCleaner,
+        executor: Executor,
+        partition_rows: int = 1_000_000,
+    ):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.cleaner = cleaner
+        self.executor = executor
+        self.partition_rows = partition_rows
+
+        # NOTE: only the leading row local steps can run on partitions, every
+        # step after the first non row local one has to see all rows
+        steps = list(cleaner.steps)
+        n_local = 0
+        while n_local < len(steps) and CLEANING_STEPS[steps[n_local]][2]:
+            n_local += 1
+        self.partition_steps = steps[:n_local]
+        self.final_steps = steps[n_local:]
+
+    def clean_dataframe(
+        self, df: pd.DataFrame, date_column: list[str] = None
+    ) -> pd.DataFrame:
+        """
+        cleans the dataframe, see DataFrameCleaner.clean_dataframe
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            date_column (str): date column to be validated
+
+        Returns:
+            pd.DataFrame: pandas dataframe
+        """
+        if not self.partition_steps:
+            return self.cleaner.clean_dataframe(df, date_column)
+
+        formats = self._date_formats(df, date_column or [])
+        n_partitions = max(1, math.ceil(len(df) / self.partition_rows))
+        self.logger.info(f"cleaning {len(df)} rows in {n_partitions} partitions")
+
+        futures = [
+            self.executor.submit(
+                clean_partition,
+                to_ipc(
+                    df.iloc[i * self.partition_rows : (i + 1) * self.partition_rows]
+                ),
+                self.partition_steps,
+                date_column,
+                formats,
+                self.cleaner.profiler is not None,
+            )
+            for i in range(n_partitions)
+        ]
+        partitions = []
+        for i, future in enumerate(futures):
+            payload, metrics, profiler = future.result()
+            partitions.append(from_ipc(payload))
+            self.cleaner.metrics.extend(
+                {**metric, "partition": i} for metric in metrics
+            )
+            if profiler is not None:
+                self.cleaner.profiler.merge(profiler)
+
+        cleaned_df = partitions[0] if n_partitions == 1 else pd.concat(partitions)
+        if self.final_steps:
+            cleaned_df = self.cleaner.clean_dataframe(
+                cleaned_df, date_column, steps=self.final_steps
+            )
+        return cleaned_df
+
+    def _date_formats(
+        self, df: pd.DataFrame, date_column: list[str]
+    ) -> dict[str, str | None]:
+        """
+        detects the date formats on the whole dataframe, like the serial path
+        does, so every partition parses its dates with the same format
+        """
+        parser = self.cleaner.date_parser
+        for column in df.columns:
+            name = DataFrameCleaner.to_snake_case(column)
+            if (
+                name in date_column
+                and name not in parser.formats
+                and not pd.api.types.is_datetime64_any_dtype(df[column])
+            ):
+                parser.formats[name] = parser.infer_format(df[column])
+        return dict(parser.formats)
+
+
+def clean_partition(
+    payload: bytes,
+    steps: list[str],
+    date_column: list[str],
+    formats: dict[str, str | None],
+    profile: bool = False,
+) -> tuple[bytes, list[dict], ColumnProfiler | None]:
+    """
+    cleans a single partition inside a worker process
+
+    Args:
+        payload (bytes): partition as an arrow ipc stream
+        steps (list[str]): row local steps to run
+        date_column (list[str]): date columns to be validated
+        formats (dict[str, str | None]): date formats detected by the parent
+        profile (bool): whether to profile the partition for the parent's profiler
+
+    Returns:
+        tuple[bytes, list[dict], ColumnProfiler | None]: cleaned partition as an
+            arrow ipc stream, step metrics & profile of the partition
+    """
+    cleaner = DataFrameCleaner(
+        steps=steps, profiler=ColumnProfiler("partition") if profile else None
+    )
+    cleaner.date_parser.formats.update(formats)
+    cleaned_df = cleaner.clean_dataframe(from_ipc(payload), date_column)
+    return to_ipc(cleaned_df), cleaner.metrics, cleaner.profiler
+
+
+def to_ipc(df: pd.DataFrame) -> bytes:
+    """serialises a dataframe, including its index & dtypes, as an arrow ipc stream"""
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_ipc(payload: bytes) -> pd.DataFrame:
+    """deserialises a dataframe written by to_ipc"""
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
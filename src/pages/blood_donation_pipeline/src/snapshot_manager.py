@@ -0,0 +1,204 @@
+"""module for publishing duckdb snapshots from the pipeline to the dashboard"""
+
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+from typing import Iterator
+
+import duckdb
+
+# NOTE: not available on windows, snapshots are then only collected by age, see collect_garbage
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class SnapshotManager:
+    """
+    every pipeline run builds a new duckdb file `<name>-<run id>.duckdb` & then
+    publishes it by atomically replacing the pointer file `<name>.current`
+    with the snapshot's file name, published snapshots are never written again
+
+    readers follow the pointer & hold a shared lock on the snapshot they
+    opened, so a refresh never locks them out nor shows them half rebuilt
+    tables, snapshots other than the current one are deleted once no reader
+    or builder holds their lock
+    """
+
+    # NOTE: snapshots kept besides the current one when file locks are unavailable
+    KEEP_WITHOUT_LOCKS = 2
+
+    def __init__(self, folder: str, name: str):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.folder = folder
+        self.name = name
+        self.pointer_path = os.path.join(folder, f"{name}.current")
+        # NOTE: the single file used before snapshots, the base of the first snapshot
+        self.legacy_path = os.path.join(folder, f"{name}.duckdb")
+        self.build_lock = None
+        os.makedirs(folder, exist_ok=True)
+
+    def current(self) -> str | None:
+        """
+        path of the published snapshot
+
+        Returns:
+            str | None: path of the snapshot, None if nothing was published
+        """
+        if os.path.exists(self.pointer_path):
+            with open(self.pointer_path) as f:
+                return os.path.join(self.folder, f.read().strip())
+        if os.path.exists(self.legacy_path):
+            return self.legacy_path
+        return None
+
+    def begin(self, run_id: str) -> str:
+        """
+        creates the snapshot of a run as a copy of the current one, so tables
+        kept incrementally carry over, & locks it until it is published
+
+        Args:
+            run_id (str): identifier of the pipeline run
+
+        Returns:
+            str: path of the new snapshot, to be opened for writing
+        """
+        path = os.path.join(self.folder, f"{self.name}-{run_id}.duckdb")
+        self.build_lock = self._lock(path, shared=False)
+        current = self.current()
+        if current is not None:
+            self.logger.info(f"copying snapshot {current} into {path}")
+            shutil.copyfile(current, path)
+        return path
+
+    def publish(self, path: str) -> None:
+        """
+        points readers at a snapshot, its connections must be closed first so
+        the whole database is checkpointed into the file
+
+        Args:
+            path (str): path of the snapshot returned by begin
+        """
+        tmp_path = f"{self.pointer_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(os.path.basename(path))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        self.logger.info(f"published snapshot {path}")
+        if self.build_lock is not None:
+            self._unlock(self.build_lock)
+            self.build_lock = None
+
+    def discard(self, path: str) -> None:
+        """
+        deletes a snapshot that will not be published, eg. after a failed run,
+        its connections must be closed first
+
+        Args:
+            path (str): path of the snapshot returned by begin
+        """
+        for file_path in [path, f"{path}.wal"]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self.logger.info(f"discarded snapshot {path}")
+        if self.build_lock is not None:
+            self._unlock(self.build_lock, remove=True)
+            self.build_lock = None
+
+    @contextmanager
+    def reader(self, config: dict = None) -> Iterator[duckdb.DuckDBPyConnection]:
+        """
+        opens the current snapshot read-only & holds it until the block exits
+
+        Args:
+            config (dict): duckdb settings of the connection, eg. threads
+
+        Yields:
+            duckdb.DuckDBPyConnection: read-only connection
+
+        Raises:
+            ValueError: If no snapshot has been published
+        """
+        while True:
+            path = self.current()
+            if path is None:
+                raise ValueError(f"no snapshot of {self.name} in {self.folder}")
+            lock = self._lock(path, shared=True)
+            # NOTE: the snapshot may have been collected between reading the pointer & locking
+            if os.path.exists(path):
+                break
+            self._unlock(lock, remove=True)
+
+        conn = duckdb.connect(path, read_only=True, config=config or {})
+        try:
+            yield conn
+        finally:
+            conn.close()
+            self._unlock(lock)
+
+    def collect_garbage(self) -> list[str]:
+        """
+        deletes the snapshots that are neither current nor held by a reader
+        or a running build
+
+        Returns:
+            list[str]: paths of the deleted snapshots
+        """
+        current = self.current()
+        prefix = f"{self.name}-"
+        snapshots = sorted(
+            os.path.join(self.folder, f)
+            for f in os.listdir(self.folder)
+            if f.startswith(prefix) and f.endswith(".duckdb")
+        )
+        snapshots = [path for path in snapshots if path != current]
+        if fcntl is None:
+            # NOTE: run ids sort chronologically, the newest old snapshots may still be read
+            snapshots = snapshots[: -self.KEEP_WITHOUT_LOCKS]
+
+        deleted = []
+        for path in snapshots:
+            lock = self._lock(path, shared=False, blocking=False)
+            if lock is None:
+                continue
+            try:
+                for file_path in [path, f"{path}.wal"]:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                deleted.append(path)
+            finally:
+                self._unlock(lock, remove=True)
+        if deleted:
+            self.logger.info(f"deleted {len(deleted)} old snapshots")
+        return deleted
+
+    def _lock(self, path: str, shared: bool, blocking: bool = True):
+        """
+        locks the lock file of a snapshot
+
+        Returns:
+            file object holding the lock, None if it is held & blocking is False
+        """
+        f = open(f"{path}.lock", "a")
+        if fcntl is None:
+            return f
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    @staticmethod
+    def _unlock(lock, remove: bool = False) -> None:
+        if remove and os.path.exists(lock.name):
+            os.remove(lock.name)
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
@@ -0,0 +1,145 @@
+"""module for translating the bigquery sql of gbq_queries into duckdb sql"""
+
+import re
+
+import duckdb
+
+# NOTE: bigquery type > duckdb type, only matched as whole words
+TYPES = {"FLOAT64": "DOUBLE", "INT64": "BIGINT", "BOOL": "BOOLEAN"}
+
+# NOTE: bigquery date parts named differently in duckdb, duckdb weeks start on monday
+DATE_PARTS = {"ISOWEEK": "week", "ISOYEAR": "isoyear"}
+
+# NOTE: duckdb settings matching bigquery behaviour the sql itself cannot express,
+# bigquery sorts NULLs first in ascending & last in descending order
+BIGQUERY_SETTINGS = {"default_null_order": "nulls_first_on_asc_last_on_desc"}
+
+
+def bigquery_to_duckdb(query: str, dataset: str = None) -> str:
+    """
+    translates the bigquery constructs used by the datamarts into duckdb sql
+
+    - DATE_DIFF(end, start, PART) > date_diff('part', start, end)
+    - DATE(expression) > CAST(expression AS DATE)
+    - DATE(year, month, day) > make_date(year, month, day)
+    - DATE_TRUNC(date, PART) > CAST(date_trunc('part', date) AS DATE)
+    - IF(condition, a, b) > CASE WHEN condition THEN a ELSE b END
+    - FLOAT64/INT64/BOOL > DOUBLE/BIGINT/BOOLEAN
+    - `dataset.table` > table, the tables live in the local database
+    - `column` > "column", eg. the 17-24 age group column
+
+    Args:
+        query (str): bigquery standard sql
+        dataset (str): bigquery dataset prefix to strip from table names
+
+    Returns:
+        str: duckdb sql
+
+    Raises:
+        ValueError: If a translated function call has unbalanced parentheses or
+            truncates to a date part duckdb does not have, eg. sunday weeks
+    """
+    if dataset is not None:
+        query = re.sub(rf"`?\b{re.escape(dataset)}\.(\w+)`?", r"\1", query)
+    query = re.sub(r"`([^`]+)`", r'"\1"', query)
+    for bigquery_type, duckdb_type in TYPES.items():
+        query = re.sub(rf"\b{bigquery_type}\b", duckdb_type, query)
+    return _rewrite_calls(query)
+
+
+def apply_bigquery_settings(conn: duckdb.DuckDBPyConnection) -> None:
+    """
+    applies BIGQUERY_SETTINGS to a duckdb connection
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): duckdb connection running translated sql
+    """
+    for setting, value in BIGQUERY_SETTINGS.items():
+        conn.execute(f"SET {setting} = '{value}'")
+
+
+def _date_diff(args: list[str]) -> str:
+    end, start, part = args
+    return f"date_diff('{part.strip().lower()}', {start.strip()}, {end.strip()})"
+
+
+def _date(args: list[str]) -> str:
+    if len(args) == 3:
+        year, month, day = (arg.strip() for arg in args)
+        return f"make_date({year}, {month}, {day})"
+    (expression,) = args
+    return f"CAST({expression.strip()} AS DATE)"
+
+
+def _date_trunc(args: list[str]) -> str:
+    expression, part = args
+    part = part.strip().upper()
+    if part == "WEEK" or part.startswith("WEEK("):
+        raise ValueError(f"{part} has no duckdb equivalent, use ISOWEEK")
+    part = DATE_PARTS.get(part, part.lower())
+    # NOTE: duckdb truncates dates to timestamps, bigquery keeps dates
+    return f"CAST(date_trunc('{part}', {expression.strip()}) AS DATE)"
+
+
+def _if(args: list[str]) -> str:
+    condition, if_true, if_false = args
+    return (
+        f"CASE WHEN {condition.strip()} THEN {if_true.strip()}"
+        f" ELSE {if_false.strip()} END"
+    )
+
+
+# NOTE: function name > rewrite of its (already translated) arguments
+REWRITES = {
+    "DATE_DIFF": _date_diff,
+    "DATE_TRUNC": _date_trunc,
+    "DATE": _date,
+    "IF": _if,
+}
+CALL_PATTERN = re.compile(rf"\b({'|'.join(REWRITES)})\s*\(", re.IGNORECASE)
+
+
+def _rewrite_calls(query: str) -> str:
+    """rewrites every call in REWRITES, innermost arguments first"""
+    output = []
+    position = 0
+    while match := CALL_PATTERN.search(query, position):
+        output.append(query[position : match.start()])
+        args, end = _split_arguments(query, match.end())
+        rewrite = REWRITES[match.group(1).upper()]
+        output.append(rewrite([_rewrite_calls(arg) for arg in args]))
+        position = end
+    output.append(query[position:])
+    return "".join(output)
+
+
+def _split_arguments(query: str, start: int) -> tuple[list[str], int]:
+    """
+    splits the arguments of a call on top level commas, respecting nested
+    parentheses & string literals
+
+    Returns:
+        tuple[list[str], int]: arguments & position after the closing parenthesis
+    """
+    args = []
+    depth = 0
+    quote = None
+    arg_start = start
+    for i in range(start, len(query)):
+        char = query[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            if depth == 0:
+                args.append(query[arg_start:i])
+                return args, i + 1
+            depth -= 1
+        elif char == "," and depth == 0:
+            args.append(query[arg_start:i])
+            arg_start = i + 1
+    raise ValueError(f"unbalanced parentheses in: {query[start - 20 : start + 40]}")
@@ -0,0 +1,127 @@
+"""module for sorting duckdb tables by the keys the dashboard & datamarts filter on"""
+
+import logging
+import os
+
+from src.pages.blood_donation_pipeline.src.duckdb_loader import quote
+
+import duckdb
+
+# NOTE: the dominant filter keys of every table, the entity first, then the date
+CLUSTER_KEYS = {
+    "donations_state": ["state", "date"],
+    "newdonors_state": ["state", "date"],
+    "donations_facility": ["hospital", "date"],
+    "newdonors_facility": ["hospital", "date"],
+    # NOTE: donor first, so the per-donor windows of the enrichment read sorted input
+    "ds_data_granular": ["donor_id", "visit_date"],
+    "granular_visits_enriched": ["donor_id", "visit_date"],
+    "granular_average_donations_by_age_group_query": ["age_group"],
+    "granular_cohorts_query": ["age_group", "nth_year"],
+    "granular_average_months_before_churn_query_v2": ["age_group"],
+    "granular_average_months_between_donations_query": ["age_group"],
+    "granular_age_group_metrics": ["age_group"],
+    "granular_retention_curve": ["age_group", "nth_year"],
+    "donations_state_rollup": ["grain", "state", "period"],
+    "donations_facility_rollup": ["grain", "hospital", "period"],
+    "newdonors_state_rollup": ["grain", "state", "period"],
+    "newdonors_facility_rollup": ["grain", "hospital", "period"],
+}
+
+
+class TableClusterer:
+    """
+    rewrites tables sorted by their filter keys
+
+    duckdb keeps the min & max of every column per row group (~122k rows), a
+    sorted table has narrow, non-overlapping ranges on its leading keys, so
+    equality & range filters on them skip the row groups that cannot match,
+    the statistics are rebuilt by the rewrite & refreshed with ANALYZE
+
+    the row count of a rewritten table is kept in its comment, which duckdb
+    drops when the table is replaced but keeps through inserts & deletes, so
+    incrementally maintained tables are only rewritten once the rows added
+    since their last rewrite pass recluster_fraction of the table
+
+    tables missing from the database are skipped
+    """
+
+    COMMENT_PREFIX = "clustered rows: "
+    # NOTE: appended rows only widen the ranges of the last row groups
+    RECLUSTER_FRACTION = 0.1
+
+    def __init__(
+        self,
+        duckdb_conn: duckdb.DuckDBPyConnection,
+        cluster_keys: dict[str, list[str]] = None,
+        recluster_fraction: float = RECLUSTER_FRACTION,
+    ):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.conn = duckdb_conn
+        self.cluster_keys = CLUSTER_KEYS if cluster_keys is None else cluster_keys
+        self.recluster_fraction = recluster_fraction
+
+    def cluster(self, table: str, force: bool = False) -> bool:
+        """
+        sorts a table by its cluster keys, unless it is still sorted but for
+        less than recluster_fraction of rows added since
+
+        Args:
+            table (str): name of a table of cluster_keys
+            force (bool): rewrites the table even if it is still sorted
+
+        Returns:
+            bool: whether the table existed & was rewritten
+
+        Raises:
+            ValueError: If the table has no cluster keys
+        """
+        if table not in self.cluster_keys:
+            raise ValueError(f"no cluster keys for table {table}")
+        query = "SELECT comment FROM duckdb_tables() WHERE table_name = ?"
+        result = self.conn.execute(query, [table]).fetchone()
+        if result is None:
+            return False
+
+        (rows,) = self.conn.execute(f"SELECT COUNT(*) FROM {quote(table)}").fetchone()
+        clustered_rows = self._clustered_rows(result[0])
+        if (
+            not force
+            and clustered_rows is not None
+            and rows - clustered_rows <= self.recluster_fraction * rows
+        ):
+            self.logger.info(
+                f"{table} is still clustered, {rows - clustered_rows} rows added since"
+            )
+            return False
+
+        keys = ", ".join(quote(key) for key in self.cluster_keys[table])
+        # NOTE: insertion order is preserved, the ordered select is the physical order
+        self.conn.execute(f"""
+        CREATE OR REPLACE TABLE {quote(table)} AS
+        SELECT * FROM {quote(table)} ORDER BY {keys};
+        ANALYZE {quote(table)};
+        COMMENT ON TABLE {quote(table)} IS '{self.COMMENT_PREFIX}{rows}';
+        """)
+        self.logger.info(f"clustered {table} by {keys}")
+        return True
+
+    @classmethod
+    def _clustered_rows(cls, comment: str | None) -> int | None:
+        """row count of the table when it was last rewritten, None if it was replaced since"""
+        if not comment or not comment.startswith(cls.COMMENT_PREFIX):
+            return None
+        return int(comment[len(cls.COMMENT_PREFIX) :])
+
+    def cluster_all(self, tables: list[str] = None) -> list[str]:
+        """
+        sorts tables by their cluster keys
+
+        Args:
+            tables (list[str]): names of the tables, None for every table of cluster_keys
+
+        Returns:
+            list[str]: names of the tables rewritten
+        """
+        tables = list(self.cluster_keys) if tables is None else tables
+        return [table for table in tables if self.cluster(table)]
@@ -0,0 +1,42 @@
+"""module for running independent tasks concurrently without one failure stopping the rest"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+from typing import Callable, Iterable
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def run_all(
+    func: Callable[[str], object],
+    items: Iterable[str],
+    max_workers: int,
+    name: str = "task",
+) -> dict[str, Exception]:
+    """
+    calls func on every item using a bounded thread pool, a failing item is
+    logged & does not stop the remaining items
+
+    Args:
+        func (Callable[[str], object]): function called with every item
+        items (Iterable[str]): items to process, eg. urls
+        max_workers (int): maximum number of items processed concurrently
+        name (str): name of the task in logs & thread names
+
+    Returns:
+        dict[str, Exception]: every failed item & the error it raised
+    """
+    failures = {}
+    with ThreadPoolExecutor(
+        max_workers=max(1, max_workers), thread_name_prefix=name
+    ) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                logger.info(f"{name} of {item} done: {future.result()}")
+            except Exception as e:
+                logger.exception(f"{name} of {item} failed: {e}")
+                failures[item] = e
+    return failures
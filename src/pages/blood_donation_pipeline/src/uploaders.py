@@ -0,0 +1,357 @@
+"""module for uploading cleaned dataframes to bigquery or to a local stand-in"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from src.pages.blood_donation_pipeline.src.duckdb_loader import quote
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# NOTE: only needed by BigQueryUploader, the local stand-ins run without google-cloud-bigquery
+try:
+    from google.api_core import exceptions as google_exceptions
+    from google.cloud import bigquery
+except ImportError:
+    google_exceptions = None
+    bigquery = None
+
+IF_EXISTS = ["replace", "append", "fail"]
+
+
+class Uploader:
+    """
+    stages dataframes as zstd compressed parquet files & loads them into
+    tables on a thread pool
+
+    loads of different tables run in parallel while the jobs of a single
+    table run in the order they were submitted, a failed job fails the jobs
+    queued after it on the same table, jobs failing with a transient error
+    are retried with exponential backoff
+
+    subclasses implement the destination: load & delete_rows_since
+    """
+
+    MAX_ATTEMPTS = 5
+    BACKOFF_SECONDS = 1.0
+    COMPRESSION = "zstd"
+
+    def __init__(self, staging_folder: str = None, max_workers: int = 4):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        # NOTE: a temporary staging folder is owned by the uploader & removed on close
+        self.owns_staging_folder = staging_folder is None
+        self.staging_folder = staging_folder or tempfile.mkdtemp(prefix="uploads-")
+        os.makedirs(self.staging_folder, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="upload"
+        )
+        self.lock = threading.Lock()
+        self.last_jobs: dict[str, Future] = {}
+        self.pending: dict[str, list[Future]] = {}
+        self.file_numbers = itertools.count()
+
+    def upload(self, df: pd.DataFrame, table: str, if_exists: str) -> Future:
+        """
+        stages a dataframe & queues its load
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            table (str): name of the destination table
+            if_exists (str): replace/append/fail, behaviour when the table exists
+
+        Returns:
+            Future: completes once the table has been loaded
+
+        Raises:
+            ValueError: If if_exists is not one of IF_EXISTS
+        """
+        return self.load_file(self.stage(df, table), table, if_exists)
+
+    def stage(self, df: pd.DataFrame, table: str) -> str:
+        """
+        writes a dataframe into a compressed parquet file of the staging folder
+
+        Args:
+            df (pd.DataFrame): pandas dataframe
+            table (str): name of the destination table
+
+        Returns:
+            str: path of the staged file
+        """
+        path = os.path.join(
+            self.staging_folder, f"{table}-{next(self.file_numbers):05d}.parquet"
+        )
+        # NOTE: bigquery & duckdb timestamps are microseconds, pandas' are nanoseconds
+        pq.write_table(
+            pa.Table.from_pandas(df, preserve_index=False),
+            path,
+            compression=self.COMPRESSION,
+            coerce_timestamps="us",
+            allow_truncated_timestamps=True,
+        )
+        return path
+
+    def load_file(self, path: str, table: str, if_exists: str) -> Future:
+        """
+        queues the load of a staged parquet file
+
+        Args:
+            path (str): path of the parquet file
+            table (str): name of the destination table
+            if_exists (str): replace/append/fail, behaviour when the table exists
+
+        Returns:
+            Future: completes once the table has been loaded
+
+        Raises:
+            ValueError: If if_exists is not one of IF_EXISTS
+        """
+        if if_exists not in IF_EXISTS:
+            raise ValueError(f"if_exists must be one of {IF_EXISTS}, not {if_exists}")
+        return self._submit(table, self.load, path, table, if_exists)
+
+    def delete_since(
+        self, table: str, date_column: str, cutoff: pd.Timestamp
+    ) -> Future:
+        """
+        queues the deletion of the rows of a table newer than the cutoff
+
+        Args:
+            table (str): name of the table
+            date_column (str): date column to compare against the cutoff
+            cutoff (pd.Timestamp): rows with a later date are deleted
+
+        Returns:
+            Future: completes once the rows have been deleted
+        """
+        return self._submit(table, self.delete_rows_since, table, date_column, cutoff)
+
+    def wait(self, table: str = None) -> None:
+        """
+        waits for the queued jobs of a table, or of every table
+
+        Args:
+            table (str): name of the table, None for every table
+
+        Raises:
+            Exception: the error of the first failed job
+        """
+        with self.lock:
+            tables = [table] if table is not None else list(self.pending)
+            futures = [f for t in tables for f in self.pending.pop(t, [])]
+        errors = [f.exception() for f in futures]
+        with self.lock:
+            # NOTE: jobs queued from now on do not inherit the failures waited on here
+            for t in tables:
+                if self.last_jobs.get(t) in futures:
+                    del self.last_jobs[t]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def close(self) -> None:
+        """waits for every queued job, then stops the thread pool"""
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+            if self.owns_staging_folder:
+                shutil.rmtree(self.staging_folder, ignore_errors=True)
+
+    def load(self, path: str, table: str, if_exists: str) -> None:
+        """loads a parquet file into a table of the destination"""
+        raise NotImplementedError
+
+    def delete_rows_since(
+        self, table: str, date_column: str, cutoff: pd.Timestamp
+    ) -> None:
+        """deletes the rows of a table of the destination newer than the cutoff"""
+        raise NotImplementedError
+
+    def is_retryable(self, error: Exception) -> bool:
+        """whether a failed job may succeed when retried"""
+        return isinstance(error, OSError)
+
+    def _submit(self, table: str, job, *args) -> Future:
+        with self.lock:
+            future = self.executor.submit(
+                self._run, table, self.last_jobs.get(table), job, *args
+            )
+            self.last_jobs[table] = future
+            self.pending.setdefault(table, []).append(future)
+        return future
+
+    def _run(self, table: str, previous: Future | None, job, *args):
+        # NOTE: the pool starts jobs in submission order, so the previous job of the
+        # table is already running or done & waiting for it cannot deadlock
+        if previous is not None:
+            previous.result()
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                return job(*args)
+            except Exception as e:
+                if attempt == self.MAX_ATTEMPTS or not self.is_retryable(e):
+                    raise
+                delay = self.BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(1, 2)
+                self.logger.warning(
+                    f"{job.__name__} of {table} failed on attempt {attempt}: {e},"
+                    f" retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+
+class BigQueryUploader(Uploader):
+    """loads the staged parquet files into a bigquery dataset using load jobs"""
+
+    WRITE_DISPOSITIONS = {
+        "replace": "WRITE_TRUNCATE",
+        "append": "WRITE_APPEND",
+        "fail": "WRITE_EMPTY",
+    }
+
+    def __init__(self, project_id: str, dataset: str, **kwargs):
+        if bigquery is None:
+            raise ImportError("BigQueryUploader requires google-cloud-bigquery")
+        super().__init__(**kwargs)
+        self.project_id = project_id
+        self.dataset = dataset
+        self.client = bigquery.Client(project=project_id)
+
+    def load(self, path: str, table: str, if_exists: str) -> None:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=self.WRITE_DISPOSITIONS[if_exists],
+        )
+        with open(path, "rb") as f:
+            job = self.client.load_table_from_file(
+                f,
+                f"{self.project_id}.{self.dataset}.{table}",
+                job_config=job_config,
+            )
+        job.result()
+        self.logger.info(f"loaded {job.output_rows} rows into {self.dataset}.{table}")
+
+    def delete_rows_since(
+        self, table: str, date_column: str, cutoff: pd.Timestamp
+    ) -> None:
+        query = f"""
+        DELETE FROM `{self.project_id}.{self.dataset}.{table}`
+        WHERE {date_column} > '{cutoff:%Y-%m-%d %H:%M:%S}';
+        """
+        self.client.query(query).result()
+
+    def is_retryable(self, error: Exception) -> bool:
+        # NOTE: bigquery reports rate limits as 403 with the rateLimitExceeded reason
+        if isinstance(error, google_exceptions.Forbidden):
+            return any(e.get("reason") == "rateLimitExceeded" for e in error.errors)
+        return isinstance(
+            error,
+            (
+                google_exceptions.ServerError,
+                google_exceptions.TooManyRequests,
+                ConnectionError,
+            ),
+        )
+
+
+class ParquetUploader(Uploader):
+    """
+    local stand-in for bigquery, every table is a folder of parquet files
+    named part-00000.parquet, part-00001.parquet, ...
+    """
+
+    def __init__(self, folder: str, **kwargs):
+        super().__init__(**kwargs)
+        self.folder = folder
+
+    def table_path(self, table: str) -> str:
+        """folder holding the parquet files of a table"""
+        return os.path.join(self.folder, table)
+
+    def load(self, path: str, table: str, if_exists: str) -> None:
+        table_path = self.table_path(table)
+        parts = self._parts(table_path)
+        if parts and if_exists == "fail":
+            raise ValueError(f"table {table} already exists")
+        if if_exists == "replace":
+            for part in parts:
+                os.remove(os.path.join(table_path, part))
+            parts = []
+        os.makedirs(table_path, exist_ok=True)
+        self._add_part(path, table_path, len(parts))
+
+    def delete_rows_since(
+        self, table: str, date_column: str, cutoff: pd.Timestamp
+    ) -> None:
+        table_path = self.table_path(table)
+        parts = self._parts(table_path)
+        if not parts:
+            return
+        column = ds.field(date_column)
+        kept = ds.dataset(
+            [os.path.join(table_path, part) for part in parts], format="parquet"
+        ).to_table(filter=(column <= pa.scalar(cutoff)) | column.is_null())
+        # NOTE: dot files are skipped by parquet readers of the folder
+        tmp_path = os.path.join(table_path, ".rewrite.tmp")
+        pq.write_table(kept, tmp_path, compression=self.COMPRESSION)
+        for part in parts[1:]:
+            os.remove(os.path.join(table_path, part))
+        os.replace(tmp_path, os.path.join(table_path, parts[0]))
+
+    @staticmethod
+    def _parts(table_path: str) -> list[str]:
+        if not os.path.isdir(table_path):
+            return []
+        return sorted(f for f in os.listdir(table_path) if f.startswith("part-"))
+
+    @staticmethod
+    def _add_part(path: str, table_path: str, number: int) -> None:
+        # NOTE: copied under a temporary name first so a table never has half a part
+        tmp_path = os.path.join(table_path, f".part-{number:05d}.tmp")
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, os.path.join(table_path, f"part-{number:05d}.parquet"))
+
+
+class DuckDBUploader(Uploader):
+    """loads the staged parquet files into the tables of a duckdb database"""
+
+    def __init__(self, duckdb_conn: duckdb.DuckDBPyConnection, **kwargs):
+        super().__init__(**kwargs)
+        self.conn = duckdb_conn
+
+    def load(self, path: str, table: str, if_exists: str) -> None:
+        # NOTE: a cursor per job, duckdb connections must not be shared between threads
+        conn = self.conn.cursor()
+        source = f"read_parquet('{path.replace(chr(39), chr(39) * 2)}')"
+        exists = conn.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table]
+        ).fetchone()[0]
+        if exists and if_exists == "fail":
+            raise ValueError(f"table {table} already exists")
+        if if_exists == "replace" or not exists:
+            conn.execute(
+                f"CREATE OR REPLACE TABLE {quote(table)} AS SELECT * FROM {source}"
+            )
+        else:
+            conn.execute(f"INSERT INTO {quote(table)} BY NAME SELECT * FROM {source}")
+
+    def delete_rows_since(
+        self, table: str, date_column: str, cutoff: pd.Timestamp
+    ) -> None:
+        self.conn.cursor().execute(
+            f"DELETE FROM {quote(table)} WHERE {quote(date_column)} > ?", [cutoff]
+        )
+
+    def is_retryable(self, error: Exception) -> bool:
+        # NOTE: concurrent writers to one database can conflict on commit
+        return isinstance(error, (OSError, duckdb.TransactionException))
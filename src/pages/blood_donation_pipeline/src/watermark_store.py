@@ -0,0 +1,97 @@
+"""module for persisting the high-water mark of incrementally refreshed tables"""
+
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+
+
+class WatermarkStore:
+    """
+    json file mapping a table name to the latest date already loaded into it,
+    safe to share between the pipeline's ingest threads
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(os.path.basename(__file__))
+        self.path = path
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> pd.Timestamp | None:
+        """
+        returns the high-water mark of a table
+
+        Args:
+            name (str): name of the table
+
+        Returns:
+            pd.Timestamp | None: latest loaded date, None if the table was never loaded
+        """
+        with self.lock:
+            watermark = self._load().get(name)
+        return pd.Timestamp(watermark) if watermark else None
+
+    def set(self, name: str, watermark: pd.Timestamp) -> None:
+        """
+        stores the high-water mark of a table
+
+        Args:
+            name (str): name of the table
+            watermark (pd.Timestamp): latest loaded date
+        """
+        if pd.isnull(watermark):
+            return
+        self.logger.info(f"setting high-water mark of {name} to {watermark}")
+        with self.lock:
+            watermarks = self._load()
+            watermarks[name] = pd.Timestamp(watermark).isoformat()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(watermarks, f, indent=4)
+            os.replace(tmp_path, self.path)
+
+    def advance(self, name: str, loaded: pd.Timestamp) -> pd.Timestamp | None:
+        """
+        moves the high-water mark of a table forward to the latest date loaded
+        by an incremental refresh, it never moves back & is left as is when
+        nothing was loaded
+
+        Args:
+            name (str): name of the table
+            loaded (pd.Timestamp): latest date of the rows loaded, NaT if none
+
+        Returns:
+            pd.Timestamp | None: the high-water mark after the refresh
+        """
+        watermark = self.get(name)
+        if pd.isnull(loaded) or (watermark is not None and loaded <= watermark):
+            return watermark
+        self.set(name, loaded)
+        return pd.Timestamp(loaded)
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def rows_after(
+    df: pd.DataFrame, date_column: str, cutoff: pd.Timestamp
+) -> pd.DataFrame:
+    """
+    rows of a raw dataframe dated after the cutoff, ie. the rows reloaded by an
+    incremental refresh, rows whose date cannot be parsed are left out
+
+    Args:
+        df (pd.DataFrame): pandas dataframe of the whole source file
+        date_column (str): column compared against the cutoff
+        cutoff (pd.Timestamp): high-water mark minus the lookback window
+
+    Returns:
+        pd.DataFrame: pandas dataframe of the rows after the cutoff
+    """
+    dates = pd.to_datetime(df[date_column], errors="coerce")
+    return df[dates > cutoff]
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+from src.pages.blood_donation_pipeline.src.column_profiler import (
+    PROFILE_TABLE,
+    ColumnProfiler,
+)
+
+
+@pytest.fixture
+def sample_dataframe():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "donor_id": rng.integers(0, 50_000, 200_000).astype(str),
+            "visit_date": pd.Timestamp("2010-01-01")
+            + pd.to_timedelta(rng.integers(0, 3650, 200_000), unit="D"),
+            "hospital": pd.Categorical(rng.choice(["a", "b"], 200_000)),
+        }
+    )
+
+
+def test_distinct_estimate_is_close(sample_dataframe):
+    profiler = ColumnProfiler("sample")
+    profiler.observe(sample_dataframe, pd.Series(True, index=sample_dataframe.index))
+
+    profile = profiler.to_frame("run").set_index("column_name")
+    exact = sample_dataframe["donor_id"].nunique()
+    assert abs(profile.loc["donor_id", "distinct_estimate"] - exact) < 0.1 * exact
+    assert profile.loc["hospital", "distinct_estimate"] == 2
+
+
+def test_merged_partitions_match_a_single_profile(sample_dataframe):
+    keep = pd.Series(True, index=sample_dataframe.index)
+    whole = ColumnProfiler("sample")
+    whole.observe(sample_dataframe, keep)
+    merged = ColumnProfiler("sample")
+    for partition in np.array_split(np.arange(len(sample_dataframe)), 3):
+        part = ColumnProfiler("sample")
+        part.observe(sample_dataframe.iloc[partition], keep.iloc[partition])
+        merged.merge(part)
+
+    columns = ["rows", "null_count", "distinct_estimate", "min_value", "max_value"]
+    pd.testing.assert_frame_equal(
+        merged.to_frame("run")[columns + ["histogram"]],
+        whole.to_frame("run")[columns + ["histogram"]],
+    )
+
+
+def test_save_appends_a_run(sample_dataframe):
+    profiler = ColumnProfiler("sample")
+    profiler.observe(sample_dataframe, pd.Series(True, index=sample_dataframe.index))
+    conn = duckdb.connect()
+    profiler.save(conn, "run-1")
+    profiler.save(conn, "run-2")
+
+    runs = conn.execute(
+        f"SELECT run_id, COUNT(*) FROM {PROFILE_TABLE} GROUP BY ALL ORDER BY 1"
+    ).fetchall()
+    assert runs == [("run-1", 4), ("run-2", 4)]
+
+
+def test_concurrent_saves_of_datasets():
+    df = pd.DataFrame({"daily": [1, 2, 3]})
+    conn = duckdb.connect()
+    # NOTE: every save starts at once, like the ingest workers of pipeline.py
+    barrier = threading.Barrier(8)
+
+    def save(dataset: str) -> None:
+        profiler = ColumnProfiler(dataset)
+        profiler.observe(df, pd.Series(True, index=df.index))
+        cursor = conn.cursor()
+        barrier.wait()
+        profiler.save(cursor, "run")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(save, [f"dataset_{i}" for i in range(8)]))
+
+    (datasets,) = conn.execute(
+        f"SELECT COUNT(DISTINCT dataset) FROM {PROFILE_TABLE}"
+    ).fetchone()
+    assert datasets == 8
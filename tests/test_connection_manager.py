@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import threading
+import weakref
+
+import duckdb
+import pytest
+from src.pages.blood_donation_pipeline.src.connection_manager import ConnectionManager
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
+
+NAME = "blood_donation_pipeline_v2"
+
+
+def build(snapshots: SnapshotManager, run_id: str, value: int) -> str:
+    path = snapshots.begin(run_id)
+    with duckdb.connect(path) as conn:
+        conn.execute("CREATE OR REPLACE TABLE t AS SELECT ? AS value", [value])
+    snapshots.publish(path)
+    return path
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+    build(snapshots, "1", 1)
+    return snapshots
+
+
+@pytest.fixture
+def manager(snapshots):
+    manager = ConnectionManager(snapshots, threads=2, memory_limit="256MB")
+    yield manager
+    manager.close()
+
+
+def test_connection_settings_are_applied(manager):
+    (threads,) = manager.fetch_one("SELECT current_setting('threads')")
+
+    assert threads == 2
+
+
+def test_threads_share_one_connection(manager):
+    query = "SELECT value + ? AS value FROM t"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda i: manager.fetch_df(query, [i])["value"][0], range(64))
+        )
+
+    assert results == [i + 1 for i in range(64)]
+    assert manager.snapshot.users == 0
+
+
+def test_queries_follow_published_snapshots(manager, snapshots):
+    first = manager.database()
+
+    with manager.cursor() as cursor:
+        second = build(snapshots, "2", 2)
+        assert manager.fetch_one("SELECT value FROM t") == (2,)
+        assert manager.database() == second
+        # NOTE: a query started before the publish keeps its snapshot open
+        assert cursor.execute("SELECT value FROM t").fetchone() == (1,)
+        assert snapshots.collect_garbage() == []
+
+    assert snapshots.collect_garbage() == [first]
+    assert manager.fetch_one("SELECT value FROM t") == (2,)
+
+
+def test_superseded_snapshots_are_not_kept_by_idle_threads(manager, snapshots):
+    def query():
+        with manager.cursor() as cursor:
+            cursor.execute("SELECT value FROM t").fetchone()
+            return cursor
+
+    with ThreadPoolExecutor(max_workers=1) as idle:
+        # NOTE: the thread queries the first snapshot once, then stays idle
+        cursor = idle.submit(query).result()
+        first = weakref.ref(manager.snapshot)
+
+        build(snapshots, "2", 2)
+        assert manager.fetch_one("SELECT value FROM t") == (2,)
+        gc.collect()
+
+        assert first() is None, "the superseded snapshot is still referenced"
+        with pytest.raises(duckdb.ConnectionException):
+            cursor.execute("SELECT value FROM t")
+        assert idle.submit(manager.fetch_one, "SELECT value FROM t").result() == (2,)
+
+
+def test_short_lived_threads_leave_no_open_cursors(manager):
+    cursors = []
+
+    def rerun():
+        # NOTE: streamlit runs every rerun on a new script thread
+        with manager.cursor() as cursor:
+            cursor.execute("SELECT value FROM t").fetchone()
+            cursors.append(cursor)
+
+    for _ in range(200):
+        thread = threading.Thread(target=rerun)
+        thread.start()
+        thread.join()
+
+    def is_open(cursor) -> bool:
+        try:
+            cursor.execute("SELECT 1")
+        except duckdb.ConnectionException:
+            return False
+        return True
+
+    assert len(cursors) == 200
+    assert sum(map(is_open, cursors)) == 0, "cursors of finished threads left open"
+    assert manager.snapshot.users == 0
@@ -1,7 +1,11 @@
+import json
+
 import numpy as np
 import pandas as pd
 import pytest
-from modules.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.column_profiler import ColumnProfiler
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.deduplicator import Deduplicator
 
 
 @pytest.fixture
@@ -46,10 +50,17 @@ def test_clean_dataframe_validate_date(sample_dataframe):
     cleaned_df = cleaner.clean_dataframe(sample_dataframe, DATE_COL)
 
     print(cleaned_df.head())
-    assert pd.isnull(
-        # .at is similar to accessing an index of a list (in this case the index of a row)
-        cleaned_df.at[1, "some_date_column"]
-    ), "Invalid date was not coerced to NaT."
+    assert 1 not in cleaned_df.index, "row with an invalid date was not dropped"
+    assert cleaned_df["some_date_column"].notna().all(), "NaT dates were kept"
+
+
+def test_clean_dataframe_drops_future_and_unparseable_dates(sample_dataframe):
+    sample_dataframe.loc[2, "SomeDateColumn"] = "2999-01-01"
+    sample_dataframe.loc[3, "SomeDateColumn"] = None
+    cleaner = DataFrameCleaner()
+    cleaned_df = cleaner.clean_dataframe(sample_dataframe, DATE_COL)
+
+    assert list(cleaned_df.index) == [0, 4], "future or unparseable dates were kept"
 
 
 def test_clean_dataframe_drop_dupes(sample_dataframe):
@@ -60,6 +71,76 @@ def test_clean_dataframe_drop_dupes(sample_dataframe):
     )
     cleaned_df = cleaner.clean_dataframe(duplicated_df, DATE_COL)
 
+    # the row with an invalid date is dropped as well
     assert (
-        cleaned_df.shape[0] == sample_dataframe.shape[0]
+        cleaned_df.shape[0] == sample_dataframe.shape[0] - 1
     ), "Duplicate rows were not properly dropped."
+
+
+def test_clean_dataframe_step_metrics(sample_dataframe):
+    cleaner = DataFrameCleaner(profiler=ColumnProfiler("sample"))
+    cleaner.clean_dataframe(sample_dataframe, DATE_COL)
+
+    metrics = {metric["step"]: metric for metric in cleaner.metrics}
+    assert list(metrics) == DataFrameCleaner.DEFAULT_STEPS, "steps were not recorded"
+    assert metrics["validate_int"]["values_nulled"] == 2, "negatives not counted"
+    assert metrics["validate_date"]["values_nulled"] == 1, "coerced dates not counted"
+
+
+def test_clean_dataframe_skips_irrelevant_steps(sample_dataframe):
+    cleaner = DataFrameCleaner()
+    cleaner.clean_dataframe(sample_dataframe, ["visit_date"])
+
+    steps = [metric["step"] for metric in cleaner.metrics]
+    assert "validate_date" not in steps, "date validation ran without date columns"
+
+
+def test_clean_dataframe_configured_steps(sample_dataframe):
+    cleaner = DataFrameCleaner(steps=["format_columns"])
+    cleaned_df = cleaner.clean_dataframe(sample_dataframe, DATE_COL)
+
+    assert cleaned_df["vendor_id"].min() < 0, "unconfigured step was applied"
+
+
+def test_clean_dataframe_drop_dupes_across_chunks(sample_dataframe):
+    # nullable ints like the declared schemas, so every chunk hashes with the same dtype
+    sample_dataframe = sample_dataframe.astype({"VendorID": "Int64"})
+    cleaner = DataFrameCleaner(deduplicator=Deduplicator())
+    first_chunk = cleaner.clean_dataframe(sample_dataframe.iloc[:3].copy(), DATE_COL)
+    second_chunk = cleaner.clean_dataframe(sample_dataframe.copy(), DATE_COL)
+
+    assert list(first_chunk.index) == [0, 2]
+    assert list(second_chunk.index) == [
+        3,
+        4,
+    ], "rows of the first chunk were not dropped from the second"
+
+
+def test_clean_dataframe_caches_date_format(sample_dataframe):
+    cleaner = DataFrameCleaner()
+    cleaner.clean_dataframe(sample_dataframe.copy(), DATE_COL)
+    cleaned_df = cleaner.clean_dataframe(sample_dataframe.copy(), DATE_COL)
+
+    assert cleaner.date_parser.formats == {"some_date_column": "%Y-%m-%d"}
+    assert list(cleaned_df.index) == [0, 2, 3, 4]
+    date_metrics = [m for m in cleaner.metrics if m["step"] == "validate_date"]
+    assert [m["values_nulled"] for m in date_metrics] == [1, 1]
+
+
+def test_clean_dataframe_profile(sample_dataframe):
+    profiler = ColumnProfiler("sample")
+    cleaner = DataFrameCleaner(profiler=profiler)
+    cleaner.clean_dataframe(sample_dataframe.iloc[:3].copy(), DATE_COL)
+    cleaner.clean_dataframe(sample_dataframe.iloc[3:].copy(), DATE_COL)
+
+    profile = profiler.to_frame("run").set_index("column_name")
+    vendor_id = profile.loc["vendor_id"]
+    assert vendor_id["negatives_masked"] == 2
+    assert vendor_id["null_count"] == 2
+    assert vendor_id["distinct_estimate"] == 2
+    assert (vendor_id["min_value"], vendor_id["max_value"]) == ("1", "3")
+    assert json.loads(vendor_id["histogram"]) == {"1": 1, "2": 1}
+    some_date = profile.loc["some_date_column"]
+    assert some_date["values_coerced"] == 1
+    assert json.loads(some_date["histogram"]) == {"2021": 4}
+    assert profile.loc["*", "rows"] == 4
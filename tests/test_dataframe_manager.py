@@ -0,0 +1,197 @@
+import json
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pytest
+from src.pages.blood_donation_pipeline.src.column_profiler import (
+    PROFILE_TABLE,
+    ColumnProfiler,
+)
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+
+
+@pytest.fixture
+def sample_dataframe():
+    data = {
+        "date": ["2024-01-01", "2024-01-02"],
+        "state": ["Johor", "Kedah"],
+        "daily": [10, 20],
+    }
+    return pd.DataFrame(data)
+
+
+def test_detect_format_parquet_magic_bytes():
+    # magic bytes win over a misleading content type & extension
+    file_format = DataFrameManager.detect_format(
+        b"PAR1\x15\x04", "text/csv", "https://dub.sh/data.csv"
+    )
+
+    assert file_format == "parquet", "parquet magic bytes were not detected"
+
+
+def test_detect_format_extensionless_csv():
+    file_format = DataFrameManager.detect_format(
+        b"date,state,daily\n2024-01-01,Johor,10\n",
+        "text/plain; charset=utf-8",
+        "https://dub.sh/ds-data-granular",
+    )
+
+    assert file_format == "csv", "extensionless csv was not detected"
+
+
+def test_detect_format_unsupported():
+    with pytest.raises(ValueError):
+        DataFrameManager.detect_format(b"<!DOCTYPE html>", "text/html", "index")
+
+
+@pytest.mark.parametrize("file_type", ["csv", "parquet"])
+def test_initialize_df_reads_detected_format(tmp_path, sample_dataframe, file_type):
+    # written without an extension so only the magic bytes/contents can be used
+    path = tmp_path / "donations_state"
+    if file_type == "csv":
+        sample_dataframe.to_csv(path, index=False)
+    else:
+        sample_dataframe.to_parquet(path, index=False)
+
+    df = DataFrameManager(str(path)).df
+
+    assert df.shape == sample_dataframe.shape, "dataframe was not read correctly"
+
+
+@pytest.mark.parametrize("file_type", ["csv", "parquet"])
+def test_iter_batches_bounded_by_batch_size(tmp_path, sample_dataframe, file_type):
+    df = pd.concat([sample_dataframe] * 5, ignore_index=True)
+    path = tmp_path / f"donations_state.{file_type}"
+    if file_type == "csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False, row_group_size=4)
+
+    batches = list(DataFrameManager(str(path)).iter_batches(batch_size=3))
+
+    assert all(len(batch) <= 3 for batch in batches), "batch exceeded batch size"
+    assert sum(len(batch) for batch in batches) == len(df), "rows were lost"
+
+
+def test_schema_applied_at_parse_time(tmp_path, sample_dataframe):
+    path = tmp_path / "donations_state.csv"
+    sample_dataframe.to_csv(path, index=False)
+
+    df = DataFrameManager(str(path)).df
+
+    assert isinstance(df["state"].dtype, pd.CategoricalDtype), "state not category"
+    assert df["daily"].dtype == "Int32", "daily not declared as Int32"
+    assert pd.api.types.is_datetime64_any_dtype(df["date"]), "date not parsed"
+
+
+@pytest.mark.parametrize("file_type", ["csv", "parquet"])
+def test_schema_keeps_pyarrow_backend(tmp_path, sample_dataframe, file_type):
+    path = tmp_path / f"donations_state.{file_type}"
+    if file_type == "csv":
+        sample_dataframe.to_csv(path, index=False)
+    else:
+        sample_dataframe.to_parquet(path, index=False)
+
+    df = DataFrameManager(str(path), dtype_backend="pyarrow").df
+
+    assert df["daily"].dtype == pd.ArrowDtype(pa.int32()), "daily not int32[pyarrow]"
+    assert pa.types.is_dictionary(df["state"].dtype.pyarrow_dtype), "state not arrow"
+    assert pd.api.types.is_datetime64_any_dtype(df["date"]), "date not parsed"
+    assert df["daily"].tolist() == [10, 20]
+
+
+def test_pyarrow_backed_dataset_is_cleaned_and_profiled(tmp_path, sample_dataframe):
+    path = tmp_path / "donations_state.csv"
+    pd.concat([sample_dataframe, sample_dataframe.iloc[[0]]]).to_csv(path, index=False)
+    df_manager = DataFrameManager(str(path), dtype_backend="pyarrow")
+    profiler = ColumnProfiler(df_manager.name)
+    cleaner = DataFrameCleaner(
+        steps=df_manager.schema.get("cleaning_steps"), profiler=profiler
+    )
+
+    cleaned_df = cleaner.clean_dataframe(df_manager.df, ["date"])
+    conn = duckdb.connect()
+    profiler.save(conn, "run")
+
+    assert len(cleaned_df) == 2, "duplicate row was not dropped"
+    profile = profiler.to_frame("run").set_index("column_name")
+    assert json.loads(profile.loc["state", "histogram"]) == {"Johor": 1, "Kedah": 1}
+    assert (profile.loc["daily", "min_value"], profile.loc["daily", "max_value"]) == (
+        "10",
+        "20",
+    )
+    (rows,) = conn.execute(f"SELECT COUNT(*) FROM {PROFILE_TABLE}").fetchone()
+    assert rows == len(profile)
+
+
+def test_schema_drift_raises(tmp_path, sample_dataframe):
+    path = tmp_path / "donations_state.csv"
+    sample_dataframe.assign(daily=["ten", "twenty"]).to_csv(path, index=False)
+
+    with pytest.raises(ValueError):
+        DataFrameManager(str(path)).df
+
+
+def test_malformed_csv_is_not_reported_as_drift(tmp_path):
+    path = tmp_path / "donations_state.csv"
+    path.write_text("date,state,daily\n2024-01-01,Johor,10\n2024-01-02,Kedah,20,30\n")
+
+    with pytest.raises(pd.errors.ParserError) as error:
+        DataFrameManager(str(path)).df
+
+    assert "declared schema" not in str(error.value)
+
+
+def test_parse_time_cast_failure_is_reported_as_drift(tmp_path, sample_dataframe):
+    path = tmp_path / "donations_state.csv"
+    sample_dataframe.to_csv(path, index=False)
+    df_manager = DataFrameManager(str(path))
+    df_manager.schema = {"dtype": {"state": "float64"}, "dates": []}
+
+    with pytest.raises(ValueError, match="declared schema"):
+        df_manager.df
+
+
+def test_write_parquet_partitioned_by_year(tmp_path):
+    df = pd.DataFrame(
+        {
+            "date": ["2023-12-31", "2024-01-01", "2024-06-30"],
+            "state": ["Johor", "Kedah", "Johor"],
+            "daily": [10, 20, 30],
+        }
+    )
+    path = tmp_path / "donations_state.csv"
+    df.to_csv(path, index=False)
+    output = tmp_path / "donations_state"
+
+    DataFrameManager(str(path)).write_df_to_file(
+        str(output), file_type="parquet", partition_cols=["year"]
+    )
+
+    partitions = sorted(p.name for p in output.iterdir())
+    assert partitions == ["year=2023", "year=2024"], "not hive partitioned by year"
+    dataset = pd.read_parquet(output).sort_values("daily")
+    assert dataset["daily"].tolist() == [10, 20, 30], "rows were lost"
+    assert dataset["year"].astype(int).tolist() == [2023, 2024, 2024]
+
+
+def test_write_csv_in_chunks(tmp_path):
+    df = pd.DataFrame(
+        {
+            "date": pd.date_range("2024-01-01", periods=10).astype(str),
+            "state": ["Johor", "Kedah"] * 5,
+            "daily": range(10),
+        }
+    )
+    path = tmp_path / "donations_state.csv"
+    df.to_csv(path, index=False)
+    output = tmp_path / "output.csv"
+
+    DataFrameManager(str(path)).write_df_to_file(str(output), chunksize=3)
+
+    written = pd.read_csv(output)
+    assert len(written) == len(df), "rows were lost or duplicated"
+    assert written.columns.tolist() == df.columns.tolist(), "header repeated"
+    assert written["daily"].tolist() == list(range(10))
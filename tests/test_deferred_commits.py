@@ -0,0 +1,32 @@
+import pandas as pd
+from src.pages.blood_donation_pipeline.src.deferred_commits import DeferredCommits
+from src.pages.blood_donation_pipeline.src.task_runner import run_all
+from src.pages.blood_donation_pipeline.src.watermark_store import WatermarkStore
+
+
+def test_watermarks_only_move_once_applied(tmp_path):
+    store = WatermarkStore(str(tmp_path / "watermarks.json"))
+    commits = DeferredCommits()
+
+    def ingest(name: str) -> str:
+        commits.add(store.set, name, pd.Timestamp("2024-01-31"))
+        return name
+
+    run_all(ingest, ["donations_state", "newdonors_state"], max_workers=2)
+
+    assert store.get("donations_state") is None, "committed before publish"
+    assert commits.apply() == 2
+    assert store.get("donations_state") == pd.Timestamp("2024-01-31")
+    assert store.get("newdonors_state") == pd.Timestamp("2024-01-31")
+    assert commits.apply() == 0, "commits were applied twice"
+
+
+def test_failed_run_discards_its_commits(tmp_path):
+    store = WatermarkStore(str(tmp_path / "watermarks.json"))
+    store.set("donations_state", pd.Timestamp("2024-01-10"))
+    commits = DeferredCommits()
+    commits.add(store.advance, "donations_state", pd.Timestamp("2024-01-31"))
+
+    assert commits.discard() == 1
+    assert commits.apply() == 0
+    assert store.get("donations_state") == pd.Timestamp("2024-01-10")
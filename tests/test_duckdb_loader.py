@@ -0,0 +1,55 @@
+import duckdb
+import pandas as pd
+import pytest
+from src.pages.blood_donation_pipeline.src.duckdb_loader import DuckDBLoader
+
+
+@pytest.fixture
+def sample_csv(tmp_path):
+    data = {
+        "VendorID": [1, 2, 3, -1, 1],
+        "SomeDateColumn": [
+            "2021-01-01",
+            "not a date",
+            "2021-03-01",
+            "2999-04-01",
+            "2021-01-01",
+        ],
+        "DuplicateColumn": [1, 1, 2, 3, 1],
+    }
+    path = tmp_path / "sample.csv"
+    pd.DataFrame(data).to_csv(path, index=False)
+    return str(path)
+
+
+DATE_COL = ["some_date_column"]
+
+
+def test_load_applies_cleaning_rules(sample_csv):
+    conn = duckdb.connect()
+    DuckDBLoader(conn).load(sample_csv, "sample", DATE_COL)
+    df = conn.execute("SELECT * FROM sample ORDER BY vendor_id").df()
+
+    assert list(df.columns) == [
+        "vendor_id",
+        "some_date_column",
+        "duplicate_column",
+    ], "columns names were not formatted correctly"
+    # future & invalid dates dropped, duplicate of the first row dropped
+    assert df["vendor_id"].tolist() == [1, 3], "rows were not filtered correctly"
+    assert df["some_date_column"].notna().all(), "invalid date was kept"
+
+
+def test_load_masks_negative_int(tmp_path):
+    path = tmp_path / "sample.csv"
+    pd.DataFrame({"VendorID": [1, -1]}).to_csv(path, index=False)
+    conn = duckdb.connect()
+    DuckDBLoader(conn).load(str(path), "sample")
+
+    assert conn.execute("SELECT MIN(vendor_id) FROM sample").fetchone()[0] >= 0
+    assert (
+        conn.execute("SELECT COUNT(*) FROM sample WHERE vendor_id IS NULL").fetchone()[
+            0
+        ]
+        == 1
+    )
@@ -0,0 +1,76 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+from src.pages.blood_donation_pipeline.src.http_cache import HttpCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    """serves server.body with an ETag, answering 304 to a matching If-None-Match"""
+
+    def do_GET(self):
+        etag = f'"{hash(self.server.body)}"'
+        self.server.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.body = b"date,daily\n2024-01-01,1\n"
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/donations_state.csv"
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_not_modified_uses_the_cached_copy(tmp_path, server, url):
+    cache = HttpCache(str(tmp_path))
+    first = cache.fetch(url)
+    second = cache.fetch(url)
+
+    # NOTE: the second request is conditional & answered with a 304
+    assert server.requests[0] is None
+    assert server.requests[1] == first["etag"]
+    assert read(second["body_path"]) == server.body
+    assert second["content_type"] == "text/csv"
+
+
+def test_url_is_changed_until_committed(tmp_path, server, url):
+    cache = HttpCache(str(tmp_path))
+    assert cache.fetch(url)["changed"]
+
+    # NOTE: a run failing before commit retries the unchanged file on the next run
+    assert cache.fetch(url)["changed"]
+
+    cache.commit(url)
+    assert not cache.fetch(url)["changed"]
+
+    server.body = b"date,daily\n2024-01-01,1\n2024-01-02,2\n"
+    entry = cache.fetch(url)
+    assert entry["changed"]
+    assert read(entry["body_path"]) == server.body
@@ -0,0 +1,31 @@
+import duckdb
+import pandas as pd
+import pytest
+from src.pages.blood_donation_pipeline.src.dataframe_manager import DataFrameManager
+from src.pages.blood_donation_pipeline.src.ingest_steps import is_up_to_date
+
+
+@pytest.fixture
+def unchanged(tmp_path):
+    path = tmp_path / "donations_state.csv"
+    pd.DataFrame({"date": ["2024-01-01"], "state": ["Johor"], "daily": [1]}).to_csv(
+        path, index=False
+    )
+    df_manager = DataFrameManager(str(path))
+    # NOTE: as if the http cache answered 304 Not Modified
+    df_manager.changed = False
+    return df_manager
+
+
+def test_unchanged_dataset_is_skipped(unchanged):
+    assert is_up_to_date(unchanged)
+    assert not is_up_to_date(unchanged, full_refresh=True)
+
+
+def test_dataset_without_local_copy_is_reloaded(unchanged):
+    # NOTE: the previous run computed the datamarts in bigquery, so nothing was mirrored
+    conn = duckdb.connect()
+    assert not is_up_to_date(unchanged, conn)
+
+    conn.execute("CREATE TABLE donations_state AS SELECT 1 AS daily")
+    assert is_up_to_date(unchanged, conn)
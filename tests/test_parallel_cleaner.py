@@ -0,0 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+from src.pages.blood_donation_pipeline.src.column_profiler import ColumnProfiler
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.deduplicator import Deduplicator
+from src.pages.blood_donation_pipeline.src.parallel_cleaner import (
+    ParallelCleaner,
+    from_ipc,
+    to_ipc,
+)
+
+
+@pytest.fixture
+def sample_dataframe():
+    data = {
+        "VendorID": pd.array([1, 2, 3, -1, -2, 1, 2, 3], dtype="Int64"),
+        "SomeDateColumn": [
+            "2021-01-01",
+            "not a date",
+            "2021-03-01",
+            "2999-04-01",
+            "2021-05-01",
+            "2021-01-01",
+            "not a date",
+            "2021-03-02",
+        ],
+        "Category": pd.Categorical(["a", "b", "a", "b", "a", "a", "b", "a"]),
+    }
+    return pd.DataFrame(data, index=range(10, 18))
+
+
+DATE_COL = ["some_date_column"]
+
+
+def test_ipc_round_trip_keeps_index_and_dtypes(sample_dataframe):
+    pd.testing.assert_frame_equal(from_ipc(to_ipc(sample_dataframe)), sample_dataframe)
+
+
+@pytest.mark.parametrize("deduplicate", [False, True])
+def test_parallel_clean_matches_serial(sample_dataframe, deduplicate):
+    def cleaner():
+        return DataFrameCleaner(deduplicator=Deduplicator() if deduplicate else None)
+
+    serial_df = cleaner().clean_dataframe(sample_dataframe.copy(), DATE_COL)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        parallel_cleaner = ParallelCleaner(cleaner(), executor, partition_rows=3)
+        parallel_df = parallel_cleaner.clean_dataframe(
+            sample_dataframe.copy(), DATE_COL
+        )
+
+    pd.testing.assert_frame_equal(parallel_df, serial_df)
+    assert parallel_cleaner.partition_steps == [
+        "format_columns",
+        "validate_int",
+        "validate_date",
+    ]
+    partitions = {m.get("partition") for m in parallel_cleaner.cleaner.metrics}
+    assert partitions == {0, 1, 2, None}, "partition metrics were not collected"
+
+
+def test_parallel_profile_matches_serial(sample_dataframe):
+    serial_cleaner = DataFrameCleaner(profiler=ColumnProfiler("sample"))
+    serial_cleaner.clean_dataframe(sample_dataframe.copy(), DATE_COL)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        parallel_cleaner = ParallelCleaner(
+            DataFrameCleaner(profiler=ColumnProfiler("sample")),
+            executor,
+            partition_rows=3,
+        )
+        parallel_cleaner.clean_dataframe(sample_dataframe.copy(), DATE_COL)
+
+    columns = ["column_name", "rows", "null_count", "negatives_masked"]
+    columns += ["values_coerced", "future_dates_dropped", "duplicates_dropped"]
+    pd.testing.assert_frame_equal(
+        parallel_cleaner.cleaner.profiler.to_frame("run")[columns]
+        .sort_values("column_name")
+        .reset_index(drop=True),
+        serial_cleaner.profiler.to_frame("run")[columns]
+        .sort_values("column_name")
+        .reset_index(drop=True),
+    )
@@ -0,0 +1,37 @@
+import pandas as pd
+from benchmarks import synthetic_data
+from benchmarks.regression_suite import compare
+
+
+def test_synthetic_data_is_seeded():
+    pd.testing.assert_frame_equal(
+        synthetic_data.ds_data_granular(1000), synthetic_data.ds_data_granular(1000)
+    )
+    assert not synthetic_data.donations_facility(1000).equals(
+        synthetic_data.donations_facility(1000, seed=1)
+    )
+
+
+def test_compare_flags_regressions_over_tolerance():
+    baselines = {
+        "a/100k/parse": {"seconds": 1.0, "peak_mib": 100.0},
+        "a/100k/clean": {"seconds": 1.0, "peak_mib": 100.0},
+    }
+    results = {
+        "a/100k/parse": {"seconds": 1.2, "peak_mib": 130.0},
+        "a/100k/clean": {"seconds": 1.5, "peak_mib": 100.0},
+        "a/1M/parse": {"seconds": 100.0, "peak_mib": 100.0},
+    }
+
+    regressions = compare(results, baselines, time_tolerance=0.3, memory_tolerance=0.2)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a/100k/parse peak_mib")
+    assert regressions[1].startswith("a/100k/clean seconds")
+
+
+def test_compare_ignores_noise_below_the_floor():
+    baselines = {"a/100k/clean/format_columns": {"seconds": 0.0001}}
+    results = {"a/100k/clean/format_columns": {"seconds": 0.005}}
+
+    assert compare(results, baselines, time_tolerance=0.3, memory_tolerance=0.2) == []
@@ -0,0 +1,96 @@
+import os
+
+import duckdb
+import pytest
+from src.pages.blood_donation_pipeline.src.snapshot_manager import SnapshotManager
+
+NAME = "blood_donation_pipeline_v2"
+
+
+def build(snapshots: SnapshotManager, run_id: str, value: int) -> str:
+    path = snapshots.begin(run_id)
+    with duckdb.connect(path) as conn:
+        conn.execute("CREATE OR REPLACE TABLE t AS SELECT ? AS value", [value])
+    snapshots.publish(path)
+    return path
+
+
+def read_value(snapshots: SnapshotManager) -> int:
+    with snapshots.reader() as conn:
+        return conn.execute("SELECT value FROM t").fetchone()[0]
+
+
+def test_reader_without_snapshot_raises(tmp_path):
+    with pytest.raises(ValueError):
+        with SnapshotManager(str(tmp_path), NAME).reader():
+            pass
+
+
+def test_readers_see_the_latest_published_snapshot(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+    build(snapshots, "1", 1)
+    assert read_value(snapshots) == 1
+
+    path = snapshots.begin("2")
+    with duckdb.connect(path) as conn:
+        # NOTE: the new snapshot starts as a copy of the published one
+        assert conn.execute("SELECT value FROM t").fetchone()[0] == 1
+        conn.execute("UPDATE t SET value = 2")
+        # NOTE: unpublished changes are invisible to readers
+        assert read_value(snapshots) == 1
+    snapshots.publish(path)
+
+    assert read_value(snapshots) == 2
+
+
+def test_legacy_database_is_the_first_base(tmp_path):
+    with duckdb.connect(str(tmp_path / f"{NAME}.duckdb")) as conn:
+        conn.execute("CREATE TABLE t AS SELECT 7 AS value")
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+
+    assert read_value(snapshots) == 7
+    build(snapshots, "1", 8)
+    assert read_value(snapshots) == 8
+
+
+def test_garbage_collection_skips_snapshots_being_read(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+    first = build(snapshots, "1", 1)
+
+    with snapshots.reader() as conn:
+        second = build(snapshots, "2", 2)
+        third = build(snapshots, "3", 3)
+
+        assert snapshots.collect_garbage() == [second]
+        # NOTE: the open reader keeps its snapshot across publishes
+        assert conn.execute("SELECT value FROM t").fetchone()[0] == 1
+
+    assert snapshots.collect_garbage() == [first]
+    assert not os.path.exists(first) and not os.path.exists(second)
+    assert snapshots.current() == third
+    assert read_value(snapshots) == 3
+
+
+def test_garbage_collection_skips_running_builds(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+    build(snapshots, "1", 1)
+    builder = SnapshotManager(str(tmp_path), NAME)
+    building = builder.begin("2")
+
+    assert snapshots.collect_garbage() == []
+    assert os.path.exists(building)
+    builder.publish(building)
+
+
+def test_discarded_snapshot_is_never_read(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path), NAME)
+    first = build(snapshots, "1", 1)
+    path = snapshots.begin("2")
+    with duckdb.connect(path) as conn:
+        conn.execute("UPDATE t SET value = 2")
+
+    snapshots.discard(path)
+
+    assert not os.path.exists(path)
+    assert snapshots.current() == first
+    assert read_value(snapshots) == 1
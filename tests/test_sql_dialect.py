@@ -0,0 +1,294 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+import src.pages.blood_donation_pipeline.src.gbq_queries as gbqq
+from src.pages.blood_donation_pipeline.src.sql_dialect import (
+    apply_bigquery_settings,
+    bigquery_to_duckdb,
+)
+
+DATASET = "blood_donation_pipeline_v2"
+AGE_GROUPS = ["20-29", "30-39", "40-49", "50-59", "60-69", "70-79"]
+
+
+def test_translates_bigquery_functions():
+    query = """
+    SELECT
+        DATE_DIFF(DATE(a), DATE(CONCAT(y, '-12-31')), DAY) AS d,
+        IF(f(x, y) > 1, 'a,b', 'c') AS i,
+        CAST(n AS FLOAT64) AS c
+    FROM `blood_donation_pipeline_v2.ds_data_granular`
+    """
+
+    translated = bigquery_to_duckdb(query, DATASET)
+
+    assert (
+        "date_diff('day', CAST(CONCAT(y, '-12-31') AS DATE), CAST(a AS DATE)) AS d"
+        in translated
+    )
+    assert "CASE WHEN f(x, y) > 1 THEN 'a,b' ELSE 'c' END AS i" in translated
+    assert "CAST(n AS DOUBLE) AS c" in translated
+    assert "FROM ds_data_granular" in translated
+
+
+def test_translates_three_argument_date():
+    translated = bigquery_to_duckdb("SELECT DATE(EXTRACT(YEAR FROM d) + 2, 12, 31)")
+
+    assert "make_date(EXTRACT(YEAR FROM d) + 2, 12, 31)" in translated
+
+
+def test_translates_date_trunc_and_quoted_identifiers():
+    translated = bigquery_to_duckdb(
+        "SELECT DATE_TRUNC(DATE(date), ISOWEEK) AS period, SUM(`17-24`) AS `17-24`"
+    )
+
+    assert (
+        "CAST(date_trunc('week', CAST(date AS DATE)) AS DATE) AS period" in translated
+    )
+    assert 'SUM("17-24") AS "17-24"' in translated
+
+
+def test_sunday_weeks_raise():
+    # NOTE: duckdb weeks start on monday, bigquery's WEEK on sunday
+    with pytest.raises(ValueError):
+        bigquery_to_duckdb("SELECT DATE_TRUNC(d, WEEK)")
+
+
+def test_unbalanced_call_raises():
+    with pytest.raises(ValueError):
+        bigquery_to_duckdb("SELECT DATE(visit_date FROM t")
+
+
+@pytest.fixture
+def granular():
+    rng = np.random.default_rng(0)
+    rows = []
+    for donor in range(300):
+        birth_year = int(rng.integers(1935, 2004))
+        first_day = int(rng.integers(0, 4000))
+        # NOTE: distinct visit days per donor so the window ordering has no ties
+        for day in np.unique(first_day + rng.integers(0, 3000, rng.integers(1, 8))):
+            rows.append(
+                (
+                    f"d{donor}",
+                    pd.Timestamp("2006-01-01") + pd.Timedelta(days=int(day)),
+                    birth_year,
+                )
+            )
+    # NOTE: visits without a date, of a donor with dated visits & of one without
+    rows += [("d0", pd.NaT, 1950), ("d300", pd.NaT, 1950)]
+    return pd.DataFrame(rows, columns=["donor_id", "visit_date", "birth_date"])
+
+
+@pytest.fixture
+def conn(granular):
+    conn = duckdb.connect()
+    apply_bigquery_settings(conn)
+    conn.execute(
+        "CREATE TABLE ds_data_granular AS"
+        " SELECT donor_id, visit_date, CAST(birth_date AS SMALLINT) AS birth_date"
+        " FROM granular"
+    )
+    conn.execute(bigquery_to_duckdb(gbqq.granular_visits_enriched_query, DATASET))
+    return conn
+
+
+def age_group(age: pd.Series) -> pd.Series:
+    """the age bands of gbq_queries.AGE_BANDS, NA below 20"""
+    bands = pd.cut(age, [19, 29, 39, 49, 59, 69, 79], labels=AGE_GROUPS).astype(object)
+    return bands.where(age < 80, "80+").where(age >= 20)
+
+
+def order(groups: pd.Series) -> pd.Series:
+    return groups.map({group: i for i, group in enumerate([*AGE_GROUPS, "80+"])})
+
+
+def bq_round(values: pd.Series, digits: int = 2) -> pd.Series:
+    """ROUND of bigquery, halves are rounded away from zero unlike pandas"""
+    scale = 10**digits
+    return np.sign(values) * np.floor(np.abs(values) * scale + 0.5) / scale
+
+
+def visits(granular: pd.DataFrame) -> pd.DataFrame:
+    # NOTE: the former queries ignored visits without a date, MIN & age groups skip NULL
+    df = granular.dropna(subset=["visit_date"])
+    df = df.sort_values(["donor_id", "visit_date"]).copy()
+    df["next_visit_date"] = df.groupby("donor_id")["visit_date"].shift(-1)
+    df["age_on_visit"] = df["visit_date"].dt.year - df["birth_date"]
+    return df
+
+
+def reference_months_between_donations(granular: pd.DataFrame) -> pd.DataFrame:
+    df = visits(granular)
+    # NOTE: DATE_DIFF(visit_date, next_visit_date, DAY) is visit minus next, negative
+    df["days"] = (df["visit_date"] - df["next_visit_date"]).dt.days
+    df["age_group"] = age_group(df["age_on_visit"])
+    df = df.dropna(subset=["age_group"])
+    result = df.groupby("age_group")["days"].mean().reset_index()
+    result["average_months_between_visits"] = np.abs(np.floor(result["days"] / 30))
+    result = result.sort_values("age_group", key=order)
+    return result[["age_group", "average_months_between_visits"]]
+
+
+def reference_months_before_churn(granular: pd.DataFrame) -> pd.DataFrame:
+    df = visits(granular)
+    df["days"] = (df["visit_date"] - df["next_visit_date"]).dt.days.abs()
+    df["age_group"] = age_group(df["age_on_visit"])
+    df = df.dropna(subset=["age_group"])
+    df["rolling"] = df.groupby("donor_id")["days"].cumsum()
+    end_of_year = pd.to_datetime((df["visit_date"].dt.year + 2).astype(str) + "-12-31")
+    df = df[df["days"] > (end_of_year - df["visit_date"]).dt.days]
+    result = (df["rolling"] / 30).groupby(df["age_group"]).mean().reset_index()
+    result["average_months_to_churn"] = np.floor(result["rolling"])
+    result = result.sort_values("age_group", key=order)
+    return result[["age_group", "average_months_to_churn"]]
+
+
+def reference_donations_by_age_group(granular: pd.DataFrame) -> pd.DataFrame:
+    df = visits(granular)
+    df["age_group"] = age_group(df["age_on_visit"])
+    df = df.dropna(subset=["age_group"])
+    df = df[df["age_on_visit"] <= 80]
+    n_donations = df.groupby(["donor_id", "age_group"]).size()
+    result = bq_round(n_donations.groupby("age_group").mean()).reset_index()
+    result.columns = ["age_group", "avg_donations"]
+    result = result.sort_values("age_group", key=order)
+    return result
+
+
+def reference_cohorts(granular: pd.DataFrame) -> pd.DataFrame:
+    df = visits(granular)
+    first_year = df.groupby("donor_id").agg(
+        first_donation_year=("visit_date", lambda d: d.min().year),
+        birth_date=("birth_date", "first"),
+    )
+    age = first_year["first_donation_year"] - first_year["birth_date"]
+    first_year["age_group"] = age_group(age).where(age >= 20, "<20")
+    df = df.join(first_year[["first_donation_year", "age_group"]], on="donor_id")
+    df["donation_year"] = df["visit_date"].dt.year
+    cohorts = df.groupby(["first_donation_year", "donation_year", "age_group"])[
+        "donor_id"
+    ].nunique()
+    initial = first_year.groupby(["first_donation_year", "age_group"]).size()
+    retention = cohorts.reset_index(name="n_donors").join(
+        initial.rename("initial_donors"), on=["first_donation_year", "age_group"]
+    )
+    retention["retention_rate"] = bq_round(
+        retention["n_donors"] / retention["initial_donors"] * 100
+    )
+    retention["nth_year"] = (
+        retention["donation_year"] - retention["first_donation_year"] + 1
+    )
+    retention = retention[retention["nth_year"].between(1, 10)]
+    result = bq_round(
+        retention.groupby(["age_group", "nth_year"])["retention_rate"].mean()
+    )
+    return result.reset_index(name="average_retention_rate")
+
+
+def assert_same(actual: pd.DataFrame, expected: pd.DataFrame, ordered: bool = True):
+    # NOTE: a rounded average on a .xx5 tie can go either way with the summation order
+    if not ordered:
+        actual = actual.sort_values(list(actual.columns[:2]))
+        expected = expected.sort_values(list(expected.columns[:2]))
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True),
+        expected.reset_index(drop=True),
+        check_dtype=False,
+        check_exact=False,
+        atol=0.015,
+    )
+
+
+@pytest.mark.parametrize(
+    "query, reference, ordered",
+    [
+        (
+            gbqq.granular_average_months_between_donations_query,
+            reference_months_between_donations,
+            True,
+        ),
+        (
+            gbqq.granular_average_months_before_churn_query_v2,
+            reference_months_before_churn,
+            True,
+        ),
+        (
+            gbqq.granular_average_donations_by_age_group_query,
+            reference_donations_by_age_group,
+            True,
+        ),
+        # NOTE: the cohorts query has no final ORDER BY
+        (gbqq.granular_cohorts_query, reference_cohorts, False),
+    ],
+)
+def test_datamarts_match_bigquery_semantics(conn, granular, query, reference, ordered):
+    actual = conn.execute(bigquery_to_duckdb(query, DATASET)).df()
+
+    assert_same(actual, reference(granular), ordered)
+
+
+def test_rollups_match_daily_sums():
+    dates = pd.date_range("2019-12-25", "2021-01-10", freq="D")
+    newdonors = pd.DataFrame(
+        {
+            "date": list(dates) * 2,
+            "state": ["Johor"] * len(dates) + ["Melaka"] * len(dates),
+            "17-24": range(2 * len(dates)),
+            "total": 1,
+        }
+    )
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE newdonors_state AS SELECT * FROM newdonors")
+    query = gbqq.rollup_query("newdonors_state", "state", ["17-24", "total"])
+
+    actual = conn.execute(bigquery_to_duckdb(query, DATASET)).df()
+
+    for grain, freq in [("year", "YS"), ("month", "MS"), ("week", "W-MON")]:
+        # NOTE: periods are labelled by their first day, iso weeks start on monday
+        expected = (
+            newdonors.groupby(
+                [
+                    "state",
+                    pd.Grouper(key="date", freq=freq, label="left", closed="left"),
+                ]
+            )[["17-24", "total"]]
+            .sum()
+            .reset_index()
+        )
+        result = actual[actual["grain"] == grain]
+        pd.testing.assert_frame_equal(
+            result[["state", "period", "17-24", "total"]].reset_index(drop=True),
+            expected.rename(columns={"date": "period"}),
+            check_dtype=False,
+        )
+
+
+def test_age_group_metrics_join_every_datamart(conn):
+    datamarts = [
+        "granular_average_months_between_donations_query",
+        "granular_average_months_before_churn_query_v2",
+        "granular_average_donations_by_age_group_query",
+    ]
+    for name in datamarts:
+        query = bigquery_to_duckdb(getattr(gbqq, name), DATASET)
+        conn.execute(f"CREATE TABLE {name} AS {query}")
+    conn.execute(
+        "DELETE FROM granular_average_months_before_churn_query_v2"
+        " WHERE age_group = '80+'"
+    )
+
+    metrics = (
+        conn.execute(bigquery_to_duckdb(gbqq.granular_age_group_metrics_query, DATASET))
+        .df()
+        .set_index("age_group")
+    )
+
+    for name in datamarts:
+        datamart = conn.execute(f"SELECT * FROM {name}").df().set_index("age_group")
+        column = datamart.columns[0]
+        pd.testing.assert_series_equal(metrics[column].dropna(), datamart[column])
+    # NOTE: a band missing from one datamart keeps the metrics of the others
+    assert pd.isna(metrics.loc["80+", "average_months_to_churn"])
+    assert not pd.isna(metrics.loc["80+", "avg_donations"])
@@ -0,0 +1,65 @@
+import duckdb
+import pytest
+from src.pages.blood_donation_pipeline.src.table_clusterer import TableClusterer
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("""
+    CREATE TABLE donations_state AS
+    SELECT
+        DATE '2021-01-01' + CAST(hash(i) % 30 AS INTEGER) AS date,
+        'State ' || CAST(i % 4 AS VARCHAR) AS state,
+        i AS daily
+    FROM range(500) t(i);
+    """)
+    return conn
+
+
+def test_tables_are_sorted_by_their_keys(conn):
+    query = "SELECT * FROM donations_state ORDER BY daily"
+    before = conn.execute(query).fetchall()
+
+    assert TableClusterer(conn).cluster_all() == ["donations_state"]
+
+    rows = conn.execute("SELECT state, date FROM donations_state").fetchall()
+    assert rows == sorted(rows)
+    assert conn.execute(query).fetchall() == before
+
+
+def test_missing_tables_are_skipped(conn):
+    assert not TableClusterer(conn).cluster("ds_data_granular")
+
+
+def test_table_without_keys_raises(conn):
+    with pytest.raises(ValueError):
+        TableClusterer(conn).cluster("watermarks")
+
+
+def test_still_clustered_tables_are_not_rewritten(conn):
+    clusterer = TableClusterer(conn)
+    assert clusterer.cluster_all() == ["donations_state"]
+    append = "INSERT INTO donations_state SELECT * FROM donations_state LIMIT ?"
+
+    # NOTE: 10 rows appended to 500 stay under the default 10%
+    conn.execute(append, [10])
+    assert clusterer.cluster_all() == [], "a still clustered table was rewritten"
+    assert clusterer.cluster("donations_state", force=True)
+
+    conn.execute(append, [100])
+    assert clusterer.cluster_all() == ["donations_state"]
+
+
+def test_replaced_tables_are_rewritten(conn):
+    clusterer = TableClusterer(conn)
+    clusterer.cluster("donations_state")
+
+    conn.execute(
+        "CREATE OR REPLACE TABLE donations_state AS"
+        " SELECT * FROM donations_state ORDER BY daily"
+    )
+
+    assert clusterer.cluster("donations_state"), "a replaced table was skipped"
+    rows = conn.execute("SELECT state, date FROM donations_state").fetchall()
+    assert rows == sorted(rows)
@@ -0,0 +1,25 @@
+import threading
+
+from src.pages.blood_donation_pipeline.src.task_runner import run_all
+
+
+def test_failing_item_does_not_stop_the_others():
+    done = []
+    lock = threading.Lock()
+
+    def ingest(url: str) -> str:
+        if url == "broken":
+            raise ConnectionError("download failed")
+        with lock:
+            done.append(url)
+        return url
+
+    failures = run_all(ingest, ["a", "broken", "b", "c"], max_workers=2)
+
+    assert list(failures) == ["broken"]
+    assert isinstance(failures["broken"], ConnectionError)
+    assert sorted(done) == ["a", "b", "c"]
+
+
+def test_no_failures():
+    assert run_all(str.upper, ["a", "b"], max_workers=0) == {}
@@ -0,0 +1,136 @@
+import threading
+
+import duckdb
+import pandas as pd
+import pytest
+from src.pages.blood_donation_pipeline.src.uploaders import (
+    DuckDBUploader,
+    ParquetUploader,
+)
+
+
+def frame(start: str, periods: int, offset: int = 0) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "date": pd.date_range(start, periods=periods, freq="D"),
+            "value": range(offset, offset + periods),
+            "hospital": pd.Categorical(
+                ["a", "b"] * (periods // 2) + ["a"] * (periods % 2)
+            ),
+        }
+    )
+
+
+@pytest.fixture
+def parquet_uploader(tmp_path):
+    uploader = ParquetUploader(str(tmp_path / "tables"))
+    yield uploader
+    uploader.close()
+
+
+def test_loads_of_a_table_keep_their_order(parquet_uploader):
+    for i in range(5):
+        for table in ["first", "second"]:
+            parquet_uploader.upload(
+                frame("2021-01-01", 10, 10 * i),
+                table,
+                "replace" if i == 0 else "append",
+            )
+    parquet_uploader.wait()
+
+    for table in ["first", "second"]:
+        df = pd.read_parquet(parquet_uploader.table_path(table))
+        assert df["value"].tolist() == list(range(50))
+
+
+def test_replace_drops_the_previous_rows(parquet_uploader):
+    parquet_uploader.upload(frame("2021-01-01", 10), "table", "replace")
+    parquet_uploader.upload(frame("2021-01-01", 10), "table", "append")
+    parquet_uploader.upload(frame("2022-01-01", 3), "table", "replace")
+    parquet_uploader.wait("table")
+
+    assert len(pd.read_parquet(parquet_uploader.table_path("table"))) == 3
+
+
+def test_delete_since_keeps_older_and_missing_dates(parquet_uploader):
+    df = frame("2021-01-01", 10)
+    df.loc[9, "date"] = pd.NaT
+    parquet_uploader.upload(df, "table", "replace")
+    parquet_uploader.delete_since("table", "date", pd.Timestamp("2021-01-03"))
+    parquet_uploader.upload(frame("2021-01-04", 2, 100), "table", "append")
+    parquet_uploader.wait()
+
+    df = pd.read_parquet(parquet_uploader.table_path("table"))
+    assert df["value"].tolist() == [0, 1, 2, 9, 100, 101]
+
+
+def test_fail_raises_when_the_table_exists(parquet_uploader):
+    parquet_uploader.upload(frame("2021-01-01", 2), "table", "replace")
+    parquet_uploader.upload(frame("2021-01-01", 2), "table", "fail")
+
+    with pytest.raises(ValueError):
+        parquet_uploader.wait("table")
+
+
+def test_invalid_if_exists_raises(parquet_uploader):
+    with pytest.raises(ValueError):
+        parquet_uploader.upload(frame("2021-01-01", 2), "table", "upsert")
+
+
+class FlakyUploader(ParquetUploader):
+    BACKOFF_SECONDS = 0
+
+    def __init__(self, folder: str, failures: int, error: type[Exception]):
+        super().__init__(folder)
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+        self.attempts_lock = threading.Lock()
+
+    def load(self, path: str, table: str, if_exists: str) -> None:
+        with self.attempts_lock:
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise self.error("transient failure")
+        super().load(path, table, if_exists)
+
+
+def test_transient_errors_are_retried(tmp_path):
+    uploader = FlakyUploader(str(tmp_path), failures=2, error=ConnectionResetError)
+    uploader.upload(frame("2021-01-01", 4), "table", "replace")
+    uploader.close()
+
+    assert uploader.attempts == 3
+    assert len(pd.read_parquet(uploader.table_path("table"))) == 4
+
+
+def test_failed_load_fails_the_loads_queued_after_it(tmp_path):
+    uploader = FlakyUploader(str(tmp_path), failures=1, error=KeyError)
+    uploader.upload(frame("2021-01-01", 4), "table", "replace")
+    uploader.upload(frame("2021-01-05", 4), "table", "append")
+
+    with pytest.raises(KeyError):
+        uploader.wait("table")
+    # NOTE: non-retryable errors are raised on the first attempt, the append never ran
+    assert uploader.attempts == 1
+    assert not uploader._parts(uploader.table_path("table"))
+
+    uploader.upload(frame("2021-01-01", 4), "table", "replace")
+    uploader.close()
+    assert len(pd.read_parquet(uploader.table_path("table"))) == 4
+
+
+def test_duckdb_uploader_appends_and_deletes():
+    conn = duckdb.connect()
+    uploader = DuckDBUploader(conn)
+    uploader.upload(frame("2021-01-01", 5), "table", "append")
+    # NOTE: appended by column name, not position
+    uploader.upload(
+        frame("2021-01-06", 5, 5)[["value", "hospital", "date"]], "table", "append"
+    )
+    uploader.delete_since("table", "date", pd.Timestamp("2021-01-08"))
+    uploader.close()
+
+    df = conn.execute('SELECT * FROM "table" ORDER BY date').df()
+    assert df["value"].tolist() == list(range(8))
+    assert df["hospital"].tolist()[:2] == ["a", "b"]
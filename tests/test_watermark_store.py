@@ -0,0 +1,81 @@
+import duckdb
+import pandas as pd
+from src.pages.blood_donation_pipeline.src.dataframe_cleaner import DataFrameCleaner
+from src.pages.blood_donation_pipeline.src.deferred_commits import DeferredCommits
+from src.pages.blood_donation_pipeline.src.ingest_steps import refresh_incremental
+from src.pages.blood_donation_pipeline.src.uploaders import DuckDBUploader
+from src.pages.blood_donation_pipeline.src.watermark_store import WatermarkStore
+
+
+def source(end: str, corrections: dict[str, int] = None) -> pd.DataFrame:
+    """raw daily file, dates as strings, later versions may correct recent days"""
+    dates = pd.date_range("2024-01-01", end, freq="D").strftime("%Y-%m-%d")
+    df = pd.DataFrame({"date": dates, "daily": 1})
+    for date, daily in (corrections or {}).items():
+        df.loc[df["date"] == date, "daily"] = daily
+    return df
+
+
+def test_watermarks_persist_across_runs(tmp_path):
+    path = str(tmp_path / "watermarks.json")
+    WatermarkStore(path).set("donations_state", pd.Timestamp("2024-01-10"))
+    WatermarkStore(path).set("ds_data_granular", pd.NaT)
+
+    store = WatermarkStore(path)
+    assert store.get("donations_state") == pd.Timestamp("2024-01-10")
+    assert store.get("ds_data_granular") is None
+
+
+def test_watermark_only_advances_past_loaded_data(tmp_path):
+    store = WatermarkStore(str(tmp_path / "watermarks.json"))
+    store.set("donations_state", pd.Timestamp("2024-01-10"))
+
+    # NOTE: nothing loaded, or only rows inside the lookback window
+    assert store.advance("donations_state", pd.NaT) == pd.Timestamp("2024-01-10")
+    assert store.advance("donations_state", pd.Timestamp("2024-01-08")) == (
+        pd.Timestamp("2024-01-10")
+    )
+    assert store.advance("donations_state", pd.Timestamp("2024-01-12")) == (
+        pd.Timestamp("2024-01-12")
+    )
+    assert WatermarkStore(store.path).get("donations_state") == pd.Timestamp(
+        "2024-01-12"
+    )
+
+
+def test_refresh_replaces_the_lookback_window(tmp_path):
+    conn = duckdb.connect()
+    uploader = DuckDBUploader(conn)
+    store = WatermarkStore(str(tmp_path / "watermarks.json"))
+    first = source("2024-01-10").assign(date=lambda d: pd.to_datetime(d["date"]))
+    uploader.upload(first, "donations_state", "replace")
+    uploader.wait()
+    store.set("donations_state", first["date"].max())
+
+    # NOTE: the 2024-01-09 correction is inside the 3 day lookback, 2024-01-02 is not
+    df = source("2024-01-15", {"2024-01-09": 5, "2024-01-02": 7})
+    df.loc[len(df)] = ["not a date", 9]
+    commits = DeferredCommits()
+    appended = refresh_incremental(
+        df,
+        "donations_state",
+        "date",
+        DataFrameCleaner(),
+        [uploader],
+        store,
+        commits,
+        lookback_days=3,
+        date_columns=["date"],
+    )
+    assert appended == 8
+    uploader.close()
+    assert store.get("donations_state") == pd.Timestamp("2024-01-10")
+    commits.apply()
+
+    loaded = conn.execute('SELECT * FROM "donations_state" ORDER BY date').df()
+    assert loaded["date"].is_unique
+    assert len(loaded) == 15
+    daily = loaded.set_index("date")["daily"]
+    assert daily[pd.Timestamp("2024-01-09")] == 5
+    assert daily[pd.Timestamp("2024-01-02")] == 1
+    assert store.get("donations_state") == pd.Timestamp("2024-01-15")